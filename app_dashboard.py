@@ -4,6 +4,7 @@ import matplotlib.pyplot as plt
 from datetime import datetime
 import re
 import os
+from artifacts import find_artifact, read_artifact
 
 # 🧭 Page Config
 st.set_page_config(
@@ -16,15 +17,15 @@ st.title("🧠 Zeek XGBoost ML Dashboard v3")
 st.markdown("Monitoring and Insights Dashboard for Zeek ML Pipeline")
 
 # 📥 Load Data
-PREDICT_FILE = "data/output/predict_result.csv"
+PREDICT_FILE = find_artifact("data/output", "predict_result")
 ARCHIVE_FILE = "data/output/archive_log.txt"
 
-if not os.path.exists(PREDICT_FILE):
-    st.warning("⚠️ predict_result.csv not found. Please run the prediction pipeline first.")
+if not PREDICT_FILE:
+    st.warning("⚠️ predict_result (.csv / .parquet) not found. Please run the prediction pipeline first.")
     st.stop()
 
-# Load prediction result
-df = pd.read_csv(PREDICT_FILE, on_bad_lines='skip')
+# Load prediction result (CSV หรือ Parquet)
+df = read_artifact(PREDICT_FILE, on_bad_lines='skip')
 
 # Clean column names (if needed)
 df.columns = df.columns.str.strip()
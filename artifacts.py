@@ -0,0 +1,162 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# -------------------------------------
+# 📦 Artifact ระหว่าง stage (prepare → train → predict → dashboard): CSV หรือ Parquet
+# -------------------------------------
+# ARTIFACT_FORMAT เลือก format ตอนเขียน, ตอนอ่านตรวจจาก magic bytes ของไฟล์เอง
+ARTIFACT_FORMAT = os.getenv("ARTIFACT_FORMAT", "csv").lower()
+ARTIFACT_COMPRESSION = os.getenv("ARTIFACT_COMPRESSION", "zstd")
+ARTIFACT_EXTENSIONS = {"csv": ".csv", "parquet": ".parquet"}
+PARQUET_MAGIC = b"PAR1"
+
+
+def artifact_path(folder, name, fmt=None):
+    return os.path.join(folder, name + ARTIFACT_EXTENSIONS[fmt or ARTIFACT_FORMAT])
+
+
+def find_artifact(folder, name):
+    """path ของ artifact ที่มีอยู่ไม่ว่า format ไหน — ถ้ามีทั้ง CSV และ Parquet เลือกไฟล์ใหม่กว่า"""
+    existing = [p for p in (artifact_path(folder, name, fmt) for fmt in ARTIFACT_EXTENSIONS) if os.path.exists(p)]
+    return max(existing, key=os.path.getmtime) if existing else None
+
+
+def is_parquet(path):
+    with open(path, "rb") as f:
+        return f.read(4) == PARQUET_MAGIC
+
+
+def read_artifact(path, **csv_kwargs):
+    if is_parquet(path):
+        return pd.read_parquet(path)
+    return pd.read_csv(path, **csv_kwargs)
+
+
+# อ่าน artifact ทีละ chunk (CSV chunksize / Parquet record batch) → memory ตามขนาด chunk ไม่ใช่ขนาดไฟล์
+def iter_artifact(path, chunk_rows, **csv_kwargs):
+    if is_parquet(path):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_rows, **csv_kwargs)
+
+
+# -------------------------------------
+# 🗜 dtype แคบที่สุดที่ไม่เสียข้อมูล (ใช้กับ Parquet เท่านั้น — CSV เขียนเหมือนเดิม)
+# -------------------------------------
+def downcast_series(s):
+    if pd.api.types.is_bool_dtype(s):
+        return s
+    if pd.api.types.is_integer_dtype(s):
+        # flag 0/1 → int8
+        return pd.to_numeric(s, downcast="integer")
+    if pd.api.types.is_float_dtype(s):
+        f32 = s.astype(np.float32)
+        return f32 if np.array_equal(f32.to_numpy(np.float64), s.to_numpy(np.float64), equal_nan=True) else s
+    if pd.api.types.infer_dtype(s, skipna=True) in ("string", "empty", "boolean"):
+        return s
+    # object ปนหลายชนิด (เช่น 443 กับ "-") → Parquet ต้องเป็นชนิดเดียว
+    return s.astype("string")
+
+
+def cast_series(s, dtype):
+    if dtype == "string":
+        return s.astype("string")
+    if dtype == "bool":
+        return s.astype(bool)
+    return pd.to_numeric(s, errors="coerce").astype(dtype)
+
+
+# dtypes: dtype ที่ประกาศไว้ต่อคอลัมน์, คอลัมน์อื่นเป็น text ถ้า text_default (schema คงที่ทุก chunk) ไม่งั้น downcast
+def compact_frame(df, dtypes=None, text_default=False):
+    dtypes = dtypes or {}
+    columns = {}
+    for col in df.columns:
+        if col in dtypes:
+            columns[col] = cast_series(df[col], dtypes[col])
+        elif text_default:
+            columns[col] = df[col].astype("string")
+        else:
+            columns[col] = downcast_series(df[col])
+    return pd.DataFrame(columns, index=df.index)
+
+
+# -------------------------------------
+# 💾 เขียน artifact ทีละ chunk (CSV append / Parquet row group) — format ตามนามสกุลของ path
+# -------------------------------------
+class ArtifactWriter:
+    def __init__(self, path, dtypes=None, text_default=False):
+        self.path = path
+        self.dtypes = dtypes
+        self.text_default = text_default
+        self.parquet = path.endswith(ARTIFACT_EXTENSIONS["parquet"])
+        self.writer = None
+        self.written = False
+
+    def write(self, df):
+        if self.parquet:
+            table = pa.Table.from_pandas(compact_frame(df, self.dtypes, self.text_default), preserve_index=False)
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.path, table.schema, compression=ARTIFACT_COMPRESSION)
+            else:
+                table = table.cast(self.writer.schema)
+            self.writer.write_table(table)
+        else:
+            df.to_csv(self.path, index=False, mode="a" if self.written else "w", header=not self.written)
+        self.written = True
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        return self.path
+
+
+def write_artifact(df, path, dtypes=None, text_default=False):
+    writer = ArtifactWriter(path, dtypes, text_default)
+    writer.write(df)
+    return writer.close()
+
+
+# เติมแถวท้าย artifact เดิม (CSV append ตรง ๆ, Parquet ต้องเขียนใหม่ทั้งไฟล์)
+def append_artifact(df, path):
+    if is_parquet(path):
+        return write_artifact(pd.concat([pd.read_parquet(path), df[pq.read_schema(path).names]], ignore_index=True), path)
+    columns = list(pd.read_csv(path, nrows=0).columns)
+    df[columns].to_csv(path, index=False, mode="a", header=False)
+    return path
+
+
+# รวมไฟล์ผลลัพธ์ย่อยเป็นไฟล์เดียว
+# CSV header เดียวกัน → ต่อไฟล์ตรง ๆ, Parquet → ต่อ row group ตาม schema ของไฟล์แรก, ไม่งั้นใช้ pandas จัดคอลัมน์
+def concat_artifacts(part_paths, output_path):
+    if output_path.endswith(ARTIFACT_EXTENSIONS["parquet"]):
+        if len({tuple(pq.read_schema(p).names) for p in part_paths}) > 1:
+            return write_artifact(pd.concat([pd.read_parquet(p) for p in part_paths], ignore_index=True), output_path)
+        writer = None
+        for path in part_paths:
+            table = pq.read_table(path)
+            if writer is None:
+                writer = pq.ParquetWriter(output_path, table.schema, compression=ARTIFACT_COMPRESSION)
+            writer.write_table(table.cast(writer.schema))
+        writer.close()
+        return output_path
+
+    headers = []
+    for path in part_paths:
+        with open(path, "r", encoding="utf-8") as f:
+            headers.append(f.readline())
+    if len(set(headers)) <= 1:
+        with open(output_path, "w", encoding="utf-8") as out:
+            for i, path in enumerate(part_paths):
+                with open(path, "r", encoding="utf-8") as f:
+                    if i:
+                        f.readline()
+                    shutil.copyfileobj(f, out)
+    else:
+        pd.concat([pd.read_csv(p) for p in part_paths], ignore_index=True).to_csv(output_path, index=False)
+    return output_path
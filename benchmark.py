@@ -0,0 +1,565 @@
+import os, sys, io, re, glob, json, time, shutil, datetime, platform, tempfile, subprocess, contextlib, importlib.util
+import numpy as np
+import pandas as pd
+import sklearn
+import xgboost as xgb
+import joblib
+from prepare_data import transform_data, FeatureTransformer, FEATURE_COLUMNS, transformer_path_for
+from artifacts import artifact_path, write_artifact
+from session_features import SessionStore, session_features
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# -------------------------------------
+# 🧪 สร้างข้อมูล Zeek HTTP จำลองสำหรับ benchmark
+# -------------------------------------
+# label สุ่มก่อน (MALICIOUS_RATE) แล้วแต่ละ field สุ่มจากน้ำหนักตาม label → (ค่า, น้ำหนัก benign, น้ำหนัก malicious)
+# ทั้งสองฝั่งมีค่าทับซ้อนกัน → model เรียนรู้ได้แต่ไม่ง่ายจนได้ 100%
+MALICIOUS_RATE = 0.3
+
+USER_AGENTS = [
+    ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36", 30, 8),
+    ("Mozilla/5.0 (Macintosh; Intel Mac OS X 14_2) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.2 Safari/605.1.15", 10, 2),
+    ("Mozilla/5.0 (X11; Linux x86_64; rv:121.0) Gecko/20100101 Firefox/121.0", 8, 3),
+    ("Microsoft-CryptoAPI/10.0", 10, 1),
+    ("Microsoft-Delivery-Optimization/10.0", 6, 1),
+    ("Windows-Update-Agent/10.0.10011.16384 Client-Protocol/2.50", 6, 1),
+    ("python-requests/2.32.5", 4, 12),
+    ("curl/8.5.0", 3, 12),
+    ("keystoneauth1/5.1.2 python-requests/2.31.0 CPython/3.10.12", 6, 1),
+    ("Googlebot/2.1 (+http://www.google.com/bot.html)", 2, 4),
+    ("Go-http-client/1.1", 2, 8),
+    ("sqlmap/1.7.2#stable (https://sqlmap.org)", 0, 5),
+    ("aws-sdk-go/1.44.0 (go1.20; linux; amd64)", 2, 2),
+    ("-", 4, 10),
+]
+# (prefix, suffix) → prefix + เลขสุ่ม + suffix; suffix=None = URL คงที่
+URLS = [
+    (("/", None), 15, 4),
+    (("/index.html", None), 8, 2),
+    (("/static/js/app.", ".js"), 12, 1),
+    (("/api/v1/items/", "?page=1"), 10, 3),
+    (("/images/p", ".jpg"), 8, 1),
+    (("/connecttest.txt", None), 5, 1),
+    (("/msdownload/update/v3/static/trustedr/en/authrootstl.cab", None), 6, 1),
+    (("http://ctldl.windowsupdate.com/msdownload/update/v3/static/trustedr/en/disallowedcertstl.cab", None), 4, 1),
+    (("/v3/auth/tokens/", None), 5, 2),
+    (("/login.php?user=admin&id=", None), 2, 10),
+    (("/admin/config", None), 1, 8),
+    (("/download/update", ".exe"), 1, 8),
+    (("/api/v1/token?reset=1&x=%20", None), 1, 6),
+    (("/cgi-bin/shell?cmd=id&session=", None), 0, 10),
+    (("/wp-admin/admin-ajax.php?action=", None), 1, 6),
+    (("/upload/", None), 2, 5),
+    (("-", None), 3, 6),
+]
+REFERRERS = [("-", 40, 60), ("", 5, 10), ("none", 2, 5), ("https://portal.local/home", 25, 5),
+             ("http://example.com/", 10, 10), ("http://www.google.com/search?q=x", 18, 10)]
+# ปลายทาง: internal IP / external IP / hostname ของ Microsoft / ไม่มีค่า
+DESTINATIONS = [("internal", 40, 15), ("external", 35, 75), ("microsoft", 20, 2), ("-", 5, 8)]
+MICROSOFT_HOSTS = ["tlu.dl.delivery.mp.microsoft.com", "ctldl.windowsupdate.com", "download.windowsupdate.com", "settings-win.data.microsoft.com"]
+EXTERNAL_FIRST_OCTETS = [8, 13, 20, 34, 45, 52, 91, 104, 142, 185, 203]
+PROTOCOLS = [("http", 45, 70), ("https", 40, 15), ("HTTP", 5, 5), ("-", 10, 10)]
+METHODS = [("GET", 70, 45), ("POST", 20, 30), ("HEAD", 5, 5), ("PUT", 2, 10), ("OPTIONS", 2, 5), ("-", 1, 5)]
+STATUS_CODES = [(200, 70, 40), (204, 5, 5), (301, 8, 5), (404, 10, 30), (500, 2, 10), (403, 5, 10)]
+PORTS = [(80, 40, 55), (443, 45, 15), (8080, 10, 20), (8443, 5, 10)]
+COUNTRIES = [("TH", 50, 15), ("US", 25, 30), ("SG", 10, 10), ("JP", 5, 10), ("RU", 1, 15), ("CN", 2, 15), ("-", 7, 5)]
+# กิจกรรมปกติช่วงกลางวัน, malicious กระจายทั้งวัน
+HOURS = [(h, 3 if 8 <= h <= 18 else 1, 1) for h in range(24)]
+
+
+def pick_by_label(rng, table, label):
+    values = [row[0] for row in table]
+    weights = np.array([row[1:] for row in table], dtype=float)
+    cumulative = np.cumsum(weights / weights.sum(axis=0), axis=0)
+    u = rng.random(len(label))
+    idx = np.where(label == 1,
+                   np.searchsorted(cumulative[:, 1], u, side="right"),
+                   np.searchsorted(cumulative[:, 0], u, side="right"))
+    return np.minimum(idx, len(values) - 1), values
+
+
+def pick_values(rng, table, label):
+    idx, values = pick_by_label(rng, table, label)
+    return np.asarray(values, dtype=object)[idx]
+
+
+OCTETS = np.array([str(i) for i in range(256)])
+
+
+# string ops บน numpy unicode array (เร็วกว่า astype(str) ของ object หลายเท่า)
+def join_octets(*parts):
+    out = parts[0]
+    for part in parts[1:]:
+        out = np.char.add(np.char.add(out, "."), part)
+    return out
+
+
+def random_ips(rng, n, first_octets=None):
+    octet = lambda low, high: OCTETS[rng.integers(low, high, n)]
+    if first_octets is None:
+        # 10.x.x.x / 192.168.x.x / 172.16-31.x.x ในสัดส่วนใกล้เคียงกัน
+        kind = rng.integers(0, 3, n)
+        first = np.where(kind == 0, "10", np.where(kind == 1, "192", "172"))
+        second = OCTETS[np.where(kind == 0, rng.integers(0, 256, n), np.where(kind == 1, 168, rng.integers(16, 32, n)))]
+    else:
+        first = OCTETS[np.asarray(first_octets)[rng.integers(0, len(first_octets), n)]]
+        second = octet(0, 256)
+    return join_octets(first, second, octet(0, 256), octet(1, 255)).astype(object)
+
+
+def make_synthetic_http(n_rows, seed=42):
+    rng = np.random.default_rng(seed)
+    label = (rng.random(n_rows) < MALICIOUS_RATE).astype(int)
+
+    url_idx, url_parts = pick_by_label(rng, URLS, label)
+    prefix = pd.Series(np.asarray([p for p, _ in url_parts], dtype=object)[url_idx])
+    suffix = pd.Series(np.asarray([s or "" for _, s in url_parts], dtype=object)[url_idx])
+    has_id = np.asarray([s is not None or p.endswith(("=", "/")) and p != "/" for p, s in url_parts])[url_idx]
+    ids = np.where(has_id, rng.integers(1, 100000, n_rows).astype(str), "")
+    urls = prefix + ids + suffix
+
+    dest_kind = pick_values(rng, DESTINATIONS, label)
+    destination = np.full(n_rows, "-", dtype=object)
+    for kind, fill in [
+        ("internal", lambda n: random_ips(rng, n)),
+        ("external", lambda n: random_ips(rng, n, EXTERNAL_FIRST_OCTETS)),
+        ("microsoft", lambda n: np.asarray(MICROSOFT_HOSTS, dtype=object)[rng.integers(0, len(MICROSOFT_HOSTS), n)]),
+    ]:
+        mask = dest_kind == kind
+        destination[mask] = fill(int(mask.sum()))
+    # ต้นทางส่วนใหญ่เป็นเครื่องภายใน, บาง malicious มาจากภายนอก
+    external_source = rng.random(n_rows) < np.where(label == 1, 0.25, 0.03)
+    source = random_ips(rng, n_rows)
+    source[external_source] = random_ips(rng, int(external_source.sum()), EXTERNAL_FIRST_OCTETS)
+    source_country = np.where(external_source, pick_values(rng, COUNTRIES, label), "TH")
+    dest_country = np.where(dest_kind == "internal", "TH", pick_values(rng, COUNTRIES, label))
+
+    days = rng.integers(0, 30, n_rows)
+    hours = pick_values(rng, HOURS, label).astype(int)
+    seconds = days * 86400 + hours * 3600 + rng.integers(0, 3600, n_rows)
+    timestamps = np.datetime64("2025-01-01T00:00:00") + seconds.astype("timedelta64[s]")
+    timestamps = np.char.add(np.datetime_as_string(timestamps, unit="s"), ".000Z").astype(object)
+    return pd.DataFrame({
+        "@timestamp": timestamps,
+        "source.ip": source,
+        "destination.ip": destination,
+        "url.original": urls.to_numpy(dtype=object),
+        "http.response.status_code": pick_values(rng, STATUS_CODES, label),
+        "destination.port": pick_values(rng, PORTS, label),
+        "network.protocol": pick_values(rng, PROTOCOLS, label),
+        "user_agent.original": pick_values(rng, USER_AGENTS, label),
+        "http.request.method": pick_values(rng, METHODS, label),
+        "http.request.referrer": pick_values(rng, REFERRERS, label),
+        "source.geoip.country_code2": source_country,
+        "destination.geoip.country_code2": dest_country,
+        "ioc.dest_ip_misp_is_alert": label,
+    })
+
+
+# ไฟล์ใหญ่ (ถึง 10M rows) → สร้างทีละ chunk, seed ต่อ chunk คงที่ → ได้ไฟล์เดิมทุกครั้ง
+def iter_synthetic_http(n_rows, chunk_rows=1_000_000, seed=42):
+    for i, offset in enumerate(range(0, n_rows, chunk_rows)):
+        yield make_synthetic_http(min(chunk_rows, n_rows - offset), seed=seed + i)
+
+
+def write_synthetic_http(path, n_rows, seed=42, chunk_rows=1_000_000):
+    for i, chunk in enumerate(iter_synthetic_http(n_rows, chunk_rows, seed)):
+        chunk.to_csv(path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+    return path
+
+
+# "1k" / "250k" / "10M" → จำนวนแถว
+def parse_rows(value):
+    value = str(value).strip().lower().replace("_", "").replace(",", "")
+    scale = {"k": 1_000, "m": 1_000_000}.get(value[-1:], 1)
+    return int(float(value[:-1] if scale > 1 else value) * scale)
+
+
+# -------------------------------------
+# ⏱ วัด rows/sec ของ transform_data (ผลลัพธ์เทียบกับ baseline อยู่ใน tests/test_transform_parity.py)
+# -------------------------------------
+def bench_transform(df):
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        transform_data(df, mode="train")
+        duration = time.perf_counter() - start
+    print(f"⏱ transform_data: {len(df):,} rows in {duration:.2f}s → {len(df) / duration:,.0f} rows/sec")
+    # key "vectorized" คงไว้ → compare กับผล benchmark รุ่นก่อนได้
+    return {"vectorized": {"rows": len(df), "seconds": duration, "rows_per_s": len(df) / duration}}
+
+
+# -------------------------------------
+# 🪟 Session window: batch (vectorized) vs streaming (SessionStore) — rows/sec + ค่าต้องตรงกัน
+# -------------------------------------
+# source IP ของข้อมูลจำลองแทบไม่ซ้ำ → สุ่มใหม่จาก host ชุดเล็ก ให้ window มี request หลายตัวจริง ๆ
+def bench_session(df, window_s, stream_rows, hosts=1000):
+    rng = np.random.default_rng(3)
+    df = df.assign(**{"source.ip": random_ips(rng, hosts)[rng.integers(0, hosts, len(df))]})
+    start = time.perf_counter()
+    batch = session_features(df, window_s)
+    duration = time.perf_counter() - start
+    print(f"⏱ session_features[batch]: {len(df):,} rows in {duration:.2f}s → {len(df) / duration:,.0f} rows/sec")
+    results = {"batch": {"rows": len(df), "seconds": duration, "rows_per_s": len(df) / duration}}
+
+    sample = df.iloc[:stream_rows]
+    if len(sample):
+        start = time.perf_counter()
+        streamed = SessionStore(window_s).update_frame(sample)
+        duration = time.perf_counter() - start
+        print(f"⏱ session_features[stream]: {len(sample):,} rows in {duration:.2f}s → {len(sample) / duration:,.0f} rows/sec")
+        results["stream"] = {"rows": len(sample), "seconds": duration, "rows_per_s": len(sample) / duration}
+        pd.testing.assert_frame_equal(session_features(sample, window_s), streamed, check_exact=False, atol=1e-9)
+        print("✅ streaming session features match the batch computation")
+    return results
+
+
+# -------------------------------------
+# 🏎 Single-record: fast path vs pandas path (parity + p50/p99 latency)
+# -------------------------------------
+def fit_bench_model(df, n_estimators=100):
+    transformer = FeatureTransformer()
+    with contextlib.redirect_stdout(io.StringIO()):
+        train = transformer.fit_transform(df, mode="train")
+    model = xgb.XGBClassifier(n_estimators=n_estimators, max_depth=6, n_jobs=-1)
+    model.fit(train.drop(columns=["label"]), train["label"])
+    return transformer, model
+
+
+# model + transformer ลงไฟล์แบบเดียวกับ training → predict.py / ml-serve โหลดได้ตรง ๆ
+def save_bench_model(transformer, model, workdir):
+    model_path = os.path.join(workdir, "xgboost-model.pkl")
+    joblib.dump(model, model_path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        transformer.save(transformer_path_for(model_path))
+    return model_path
+
+
+def to_records(df):
+    df = df.drop(columns=["ioc.dest_ip_misp_is_alert"], errors="ignore").astype(object)
+    records = df.to_dict(orient="records")
+    return [{k: (v.item() if hasattr(v, "item") else v) for k, v in r.items()} for r in records]
+
+
+def latency_summary(name, samples):
+    samples = np.asarray(samples) * 1000
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    print(f"⏱ {name}: p50={p50:.3f} ms | p95={p95:.3f} ms | p99={p99:.3f} ms | mean={samples.mean():.3f} ms")
+    return {"count": len(samples), "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99), "mean_ms": float(samples.mean())}
+
+
+def bench_single_record(transformer, model, records):
+    booster = model.get_booster()
+    pandas_times, fast_times = [], []
+    for record in records:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            x = transformer.transform(pd.DataFrame([record], dtype=object), mode="predict")
+            pred_pandas = model.predict(x).tolist()
+            pandas_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        vector = np.asarray([transformer.transform_record(record)], dtype=np.float32)
+        pred_fast = [int(booster.inplace_predict(vector, validate_features=False)[0] > 0.5)]
+        fast_times.append(time.perf_counter() - start)
+
+        expected = x.iloc[0].tolist()
+        got = transformer.transform_record(record)
+        assert list(x.columns) == FEATURE_COLUMNS, "❌ feature column order drifted from FEATURE_COLUMNS"
+        assert got == expected and pred_fast == pred_pandas, f"❌ fast path mismatch for record: {record}"
+    print(f"✅ fast path matches transform_data + model.predict on {len(records):,} records")
+    return {"pandas_path": latency_summary("pandas path", pandas_times), "fast_path": latency_summary("fast path", fast_times)}
+
+
+# -------------------------------------
+# 🏋️ Training: in-memory vs shard iterator (quantile / external memory) → peak RSS + เวลา
+# -------------------------------------
+# แต่ละ mode รันเป็น process แยก → ru_maxrss ไม่ปนกัน
+def bench_training(transformer, n_rows, modes=("memory", "quantile", "external", "cached")):
+    workdir = tempfile.mkdtemp(prefix="bench-train-")
+    with contextlib.redirect_stdout(io.StringIO()):
+        features = transformer.transform(make_synthetic_http(n_rows, seed=11), mode="train")
+    split = int(len(features) * 0.8)
+    write_artifact(features.iloc[:split], artifact_path(workdir, "training-set"))
+    write_artifact(features.iloc[split:], artifact_path(workdir, "testing-set"))
+    del features
+
+    # cached: รันสองรอบ (cold = build + เขียน cache, warm = โหลด binary DMatrix) → เห็น speedup
+    runs = [(name, mode) for mode in modes for name in ([f"{mode}_cold", f"{mode}_warm"] if mode == "cached" else [mode])]
+    results = {}
+    try:
+        for name, mode in runs:
+            proc = subprocess.run(
+                [sys.executable, "training-ml-xgboost.py", workdir],
+                env={**os.environ, "TRAIN_MODE": mode, "TRAIN_SEARCH": "off", "DMATRIX_CACHE_ENABLED": "1",
+                     "DMATRIX_CACHE_DIR": os.path.join(workdir, "dmatrix-cache"),
+                     "METRICS_ENABLED": "1", "METRICS_DIR": os.path.join(workdir, "metrics", name)},
+                capture_output=True, text=True, cwd=HERE,
+            )
+            if proc.returncode != 0:
+                raise RuntimeError(f"❌ training[{name}] failed:\n{proc.stdout[-2000:]}{proc.stderr[-2000:]}")
+            rss, duration = re.search(r"Peak RSS: ([\d.]+) MB .* train time=([\d.]+)s", proc.stdout).groups()
+            acc = re.search(r"Accuracy: ([\d.]+)%", proc.stdout).group(1)
+            stages = training_stages(workdir, name)
+            results[name] = {"rows": split, "peak_rss_mb": float(rss), "train_s": float(duration), "accuracy_pct": float(acc),
+                             "rows_per_s": split / float(duration), "stages_s": stages}
+            # เวลาเตรียมข้อมูลก่อน fit (อ่าน CSV / สร้าง DMatrix / โหลด cache)
+            load_s = stages.get("load", 0) + stages.get("build_dmatrix", 0) + stages.get("load_dmatrix", 0)
+            if load_s:
+                results[name]["data_load_s"] = load_s
+            print(f"⏱ training[{name}]: {split:,} rows | peak RSS={rss} MB | train={duration}s | data load={load_s:.3f}s | accuracy={acc}%")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+# เวลาแต่ละ stage จาก metrics JSON ที่ training-ml-xgboost.py เขียนไว้
+def training_stages(workdir, mode):
+    files = sorted(glob.glob(os.path.join(workdir, "metrics", mode, "training-*.json")))
+    if not files:
+        return {}
+    with open(files[-1], encoding="utf-8") as f:
+        return {stage["name"]: stage["wall_s"] for stage in json.load(f)["summary"]}
+
+
+# -------------------------------------
+# 🔮 Batch predict: predict.load_and_prepare_data + predict.run_prediction บนไฟล์ CSV จำลอง
+# -------------------------------------
+# default = เหมือน predict.py (verdict cache + feature cache, cache ว่างตอนเริ่ม = predict ไฟล์นี้ครั้งแรก)
+# no_cache = transform ทุกแถวแล้ว predict ทั้ง frame (ไม่มีทั้งสอง cache)
+def time_predict(predict, model_path, transformer, csv_path, verdicts):
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        df, df_clean, file_hash = predict.load_and_prepare_data(csv_path, transformer, verdicts)
+        prepared = time.perf_counter()
+        _, acc, _, score_s = predict.run_prediction(model_path, df, df_clean, transformer, verdicts, file_hash)
+        done = time.perf_counter()
+    n_rows = len(df)
+    return {
+        "rows": n_rows,
+        "load_transform_s": prepared - start,
+        "predict_s": done - prepared,
+        "score_s": score_s,
+        "total_s": done - start,
+        "rows_per_s": n_rows / (done - start),
+        "accuracy_pct": acc * 100 if acc is not None else None,
+    }
+
+
+def bench_predict(model_path, transformer, n_rows):
+    import predict
+    from feature_cache import open_feature_cache
+    workdir = tempfile.mkdtemp(prefix="bench-predict-")
+    # output + feature cache อยู่ใน workdir ไม่ไปปนกับ data/output จริง (cache เก่าจะทำให้ตัวเลขดีเกินจริง)
+    predict.BASE_OUTPUT_DIR = workdir
+    csv_path = write_synthetic_http(os.path.join(workdir, "bench.csv"), n_rows, seed=13)
+    results = {}
+    try:
+        predict.FEATURE_CACHE = open_feature_cache(workdir)
+        verdicts = predict.open_verdict_cache(model_path, transformer)
+        results["default"] = time_predict(predict, model_path, transformer, csv_path, verdicts)
+        results["default"]["verdict_cache"] = verdicts.stats() if verdicts is not None else None
+        predict.FEATURE_CACHE = None
+        results["no_cache"] = time_predict(predict, model_path, transformer, csv_path, None)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    for label, result in results.items():
+        print(f"⏱ predict[{label}]: {n_rows:,} rows in {result['total_s']:.2f}s (load+transform={result['load_transform_s']:.2f}s, "
+              f"run_prediction={result['predict_s']:.2f}s) → {result['rows_per_s']:,.0f} rows/sec")
+    return results
+
+
+# -------------------------------------
+# 🌐 ml-serve /predict ผ่าน Flask test client (ทั้ง WSGI stack + JSON parse, ไม่รวม network)
+# -------------------------------------
+def load_serve_app(model_path):
+    os.environ.update(MODEL_PATH=model_path, SERVE_DEBUG="0", MODEL_WATCH_ENABLED="0", MICRO_BATCH_ENABLED="0")
+    spec = importlib.util.spec_from_file_location("ml_serve", os.path.join(HERE, "ml-serve.py"))
+    serve = importlib.util.module_from_spec(spec)
+    with contextlib.redirect_stdout(io.StringIO()):
+        spec.loader.exec_module(serve)
+        serve.warm_up()
+    return serve
+
+
+def bench_serve(model_path, records, batch_rows, batch_requests):
+    serve = load_serve_app(model_path)
+    client = serve.app.test_client()
+
+    def timed_post(payload):
+        start = time.perf_counter()
+        response = client.post("/predict", json=payload)
+        duration = time.perf_counter() - start
+        if response.status_code != 200:
+            raise RuntimeError(f"❌ /predict returned {response.status_code}: {response.get_data(as_text=True)[:500]}")
+        return duration
+
+    # batch = record ใหม่ทุก request (verdict cache miss → transform + predict จริง)
+    # batch_cached = ส่ง batch แรกซ้ำ → ตอบจาก verdict cache (แยกตัวเลขไว้ ไม่ปนกับ throughput จริง)
+    verdicts = serve.active.verdicts
+    fresh = to_records(make_synthetic_http(batch_rows * batch_requests, seed=17)) if batch_rows > 0 else []
+    with contextlib.redirect_stdout(io.StringIO()):
+        single = [timed_post(record) for record in records]
+        batches = [timed_post(fresh[i:i + batch_rows]) for i in range(0, len(fresh), batch_rows)]
+        result = {"verdict_cache": verdicts.stats() if verdicts is not None else None}
+        cached = [timed_post(fresh[:batch_rows]) for _ in range(batch_requests)] if fresh and verdicts is not None else []
+    result["single"] = latency_summary(f"/predict single record x{len(single):,}", single)
+    result["single"]["requests_per_s"] = len(single) / sum(single)
+    for label, samples in [("batch", batches), ("batch_cached", cached)]:
+        if samples:
+            result[label] = latency_summary(f"/predict {label} of {batch_rows:,} x{len(samples):,}", samples)
+            result[label]["rows"] = batch_rows
+            result[label]["rows_per_s"] = batch_rows * len(samples) / sum(samples)
+    if verdicts is not None:
+        print(verdicts.summary())
+    return result
+
+
+# -------------------------------------
+# 🧾 ผลลัพธ์เป็น JSON → เทียบข้าม commit ด้วย python benchmark.py compare <base.json> <new.json>
+# -------------------------------------
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=HERE, capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def save_results(results, n_rows):
+    commit, dirty = git_revision()
+    started = datetime.datetime.now()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "created_at": started.isoformat(timespec="seconds"),
+        "rows": n_rows,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "sklearn": sklearn.__version__,
+            "xgboost": xgb.__version__,
+        },
+        "results": results,
+    }
+    output_dir = os.getenv("BENCH_OUTPUT_DIR", os.path.join(HERE, "data", "output", "benchmarks"))
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.getenv("BENCH_OUTPUT") or os.path.join(output_dir, f"bench-{started:%Y%m%d-%H%M%S}-{commit or 'nogit'}-{n_rows}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"🧾 Benchmark results saved → {path}")
+    return path
+
+
+def flatten(tree, prefix=""):
+    flat = {}
+    for key, value in tree.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+# ค่าที่มากขึ้นคือดีขึ้น / แย่ลง (อย่างอื่น เช่น rows, count ไม่เทียบ)
+HIGHER_IS_BETTER = ("rows_per_s", "requests_per_s", "accuracy_pct")
+LOWER_IS_BETTER = ("_ms", "_s", "_mb")
+
+
+def compare_results(base_path, new_path, threshold_pct):
+    with open(base_path, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"📊 {base.get('commit')} ({base.get('rows'):,} rows) → {new.get('commit')} ({new.get('rows'):,} rows)")
+    if base.get("rows") != new.get("rows"):
+        print("⚠️ Different row counts — throughput is comparable, absolute times are not")
+    base_flat, new_flat = flatten(base["results"]), flatten(new["results"])
+    regressions = []
+    for key in sorted(base_flat.keys() & new_flat.keys()):
+        if key.endswith(HIGHER_IS_BETTER):
+            direction = 1
+        elif key.endswith(LOWER_IS_BETTER):
+            direction = -1
+        else:
+            continue
+        old, cur = base_flat[key], new_flat[key]
+        change = (cur - old) / old * 100 if old else 0.0
+        regressed = change * direction < -threshold_pct
+        marker = "❌" if regressed else ("✅" if change * direction > threshold_pct else "  ")
+        print(f"{marker} {key:<52} {old:>14,.3f} → {cur:>14,.3f} ({change:+.1f}%)")
+        if regressed:
+            regressions.append(key)
+    if regressions:
+        print(f"❌ {len(regressions)} metric(s) regressed more than {threshold_pct:g}%")
+    else:
+        print(f"✅ No regression beyond {threshold_pct:g}%")
+    return regressions
+
+
+# -------------------------------------
+# ▶️ CLI
+# -------------------------------------
+# python benchmark.py [rows]                          → รันทุก benchmark, BENCH_ROWS รับ 1k / 100k / 10M
+# python benchmark.py generate <path.csv> <rows>     → เขียนไฟล์ Zeek HTTP จำลอง (ทีละ chunk)
+# python benchmark.py compare <base.json> <new.json> → exit 1 ถ้าแย่ลงเกิน BENCH_REGRESSION_PCT
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "generate":
+        path, n_rows = sys.argv[2], parse_rows(sys.argv[3])
+        print(f"🧪 Writing {n_rows:,} synthetic Zeek HTTP rows → {path}")
+        write_synthetic_http(path, n_rows, seed=int(os.getenv("BENCH_SEED", 42)))
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        regressions = compare_results(sys.argv[2], sys.argv[3], float(os.getenv("BENCH_REGRESSION_PCT", 10)))
+        sys.exit(1 if regressions else 0)
+
+    n_rows = parse_rows(sys.argv[1] if len(sys.argv) > 1 else os.getenv("BENCH_ROWS", "100k"))
+    results = {}
+    print(f"🧪 Generating {n_rows:,} synthetic Zeek HTTP rows ...")
+    df = make_synthetic_http(n_rows)
+    results["transform"] = bench_transform(df)
+    session_window = float(os.getenv("BENCH_SESSION_WINDOW_S", 300))
+    if session_window > 0:
+        results["session"] = bench_session(df, session_window, parse_rows(os.getenv("BENCH_SESSION_STREAM_ROWS", "100k")))
+
+    print("🏋️ Fitting a small benchmark model ...")
+    transformer, model = fit_bench_model(df)
+    del df
+    n_records = parse_rows(os.getenv("BENCH_RECORDS", "2000"))
+    records = to_records(make_synthetic_http(n_records, seed=7)) if n_records > 0 else []
+    if records:
+        results["single_record"] = bench_single_record(transformer, model, records)
+
+    train_rows = parse_rows(os.getenv("BENCH_TRAIN_ROWS", str(n_rows)))
+    if train_rows > 0:
+        print(f"🏋️ Training benchmark on {train_rows:,} rows ...")
+        modes = tuple(os.getenv("BENCH_TRAIN_MODES", "memory,quantile,external,cached").split(","))
+        results["training"] = bench_training(transformer, train_rows, modes)
+
+    model_dir = tempfile.mkdtemp(prefix="bench-model-")
+    try:
+        model_path = save_bench_model(transformer, model, model_dir)
+        predict_rows = parse_rows(os.getenv("BENCH_PREDICT_ROWS", str(n_rows)))
+        if predict_rows > 0:
+            print(f"🔮 Predict benchmark on {predict_rows:,} rows ...")
+            results["predict"] = bench_predict(model_path, transformer, predict_rows)
+        if records:
+            print("🌐 ml-serve /predict benchmark ...")
+            results["serve"] = bench_serve(
+                model_path, records,
+                batch_rows=parse_rows(os.getenv("BENCH_SERVE_BATCH_ROWS", "256")),
+                batch_requests=int(os.getenv("BENCH_SERVE_BATCH_REQUESTS", 50)),
+            )
+    finally:
+        shutil.rmtree(model_dir, ignore_errors=True)
+
+    save_results(results, n_rows)
+
+
+if __name__ == "__main__":
+    main()
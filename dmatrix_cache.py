@@ -0,0 +1,76 @@
+import os
+import json
+import time
+import xgboost as xgb
+from artifacts import read_artifact
+from feature_cache import FeatureCache, file_sha256
+
+# -------------------------------------
+# 💽 DMatrix cache: training/testing set → xgboost binary DMatrix ครั้งเดียวต่อ dataset
+# -------------------------------------
+# key = hash เนื้อไฟล์ artifact + version ของ pipeline (FEATURE_SCHEMA) + version ของ xgboost
+# เทรนซ้ำกับ dataset เดิม → โหลด binary ตรง ๆ ไม่ต้อง parse CSV / enforce schema / แปลง DataFrame
+# xgboost เก็บ binary ได้เฉพาะ DMatrix ธรรมดา (QuantileDMatrix save ไม่ได้) → quantize (hist sketch) ยังทำต่อ run
+# ข้าง .buffer มี .json เก็บเวลาตอน build → รอบที่ hit รายงาน speedup เทียบกับ build ได้
+def open_dmatrix_cache(output_dir):
+    if os.getenv("DMATRIX_CACHE_ENABLED", "1") != "1":
+        return None
+    root = os.getenv("DMATRIX_CACHE_DIR", os.path.join(output_dir, "dmatrix-cache"))
+    return FeatureCache(root, max_mb=os.getenv("DMATRIX_CACHE_MAX_MB", 2048))
+
+
+def build_dmatrix(path):
+    from prepare_data import enforce_feature_schema
+    df = enforce_feature_schema(read_artifact(path))
+    if "label" not in df.columns:
+        raise ValueError(f"❌ Missing 'label' column in {path}")
+    return xgb.DMatrix(df.drop(columns=["label"]), label=df["label"])
+
+
+# คืน (DMatrix, info) — info: status hit/miss/off, load_s, build_s, speedup
+def load_dmatrix(cache, path):
+    start = time.perf_counter()
+    if cache is None:
+        dmatrix = build_dmatrix(path)
+        return dmatrix, {"status": "off", "load_s": time.perf_counter() - start}
+
+    key = cache.key("dmatrix", xgb.__version__, file_sha256(path))
+    buffer_path, meta_path = cache.path(key, ".buffer"), cache.path(key, ".json")
+    if os.path.exists(buffer_path):
+        try:
+            dmatrix = xgb.DMatrix(buffer_path)
+            load_s = time.perf_counter() - start
+            meta = {}
+            if os.path.exists(meta_path):
+                with open(meta_path, encoding="utf-8") as f:
+                    meta = json.load(f)
+                os.utime(meta_path)
+            os.utime(buffer_path)
+            cache.hits += 1
+            build_s = meta.get("build_s")
+            return dmatrix, {"status": "hit", "load_s": load_s, "build_s": build_s,
+                             "speedup": build_s / load_s if build_s and load_s > 0 else None}
+        except xgb.core.XGBoostError as e:
+            print(f"⚠️ DMatrix cache entry unreadable ({e}) — rebuilding")
+
+    cache.misses += 1
+    dmatrix = build_dmatrix(path)
+    build_s = time.perf_counter() - start
+    # tmp ต่อ pid → search worker หลายตัว build พร้อมกันได้ไม่ทับไฟล์กัน
+    tmp = f"{buffer_path}.{os.getpid()}.tmp"
+    dmatrix.save_binary(tmp, silent=True)
+    os.replace(tmp, buffer_path)
+    with open(f"{meta_path}.{os.getpid()}.tmp", "w", encoding="utf-8") as f:
+        json.dump({"source": os.path.abspath(path), "rows": dmatrix.num_row(), "build_s": build_s, "xgboost": xgb.__version__}, f)
+    os.replace(f"{meta_path}.{os.getpid()}.tmp", meta_path)
+    cache.evict()
+    return dmatrix, {"status": "miss", "load_s": build_s, "build_s": build_s}
+
+
+def describe_load(name, info):
+    if info["status"] == "hit":
+        speedup = f" (x{info['speedup']:.1f} vs build {info['build_s']:.2f}s)" if info.get("speedup") else ""
+        return f"💽 {name}: DMatrix cache hit — loaded in {info['load_s']:.2f}s{speedup}"
+    if info["status"] == "miss":
+        return f"💽 {name}: DMatrix cache miss — built + cached in {info['build_s']:.2f}s"
+    return f"💽 {name}: built DMatrix in {info['load_s']:.2f}s (cache off)"
@@ -0,0 +1,130 @@
+import os
+import glob
+import hashlib
+import joblib
+import pandas as pd
+import sklearn
+import pyarrow as pa
+from artifacts import write_artifact
+
+# -------------------------------------
+# 🗄 Feature cache: feature block ที่ transform แล้ว เก็บเป็น Parquet บน disk
+# -------------------------------------
+# key = hash ของเนื้อไฟล์ input + version ของ feature pipeline (+ ส่วนอื่นที่มีผลต่อผลลัพธ์ เช่น transformer, chunk)
+# แก้โค้ดที่กำหนดค่าใน block (feature, การอ่าน/map Zeek log, การเขียน/อ่าน artifact) หรืออัปเกรด pandas/sklearn/pyarrow
+# → version เปลี่ยน → block เก่าไม่ถูกใช้และค่อย ๆ ถูก evict
+# เกิน FEATURE_CACHE_MAX_MB → ลบ block ที่ไม่ได้ใช้นานที่สุดก่อน (LRU ตาม mtime, hit แล้ว touch)
+# verdict_cache.py: key ของ verdict cache กำหนดว่า record ไหนอยู่ใน block "predict-unique" ของ predict.py
+PIPELINE_MODULES = ("prepare_data.py", "session_features.py", "zeek_logs.py", "artifacts.py", "feature_cache.py", "verdict_cache.py")
+PIPELINE_SOURCES = [os.path.join(os.path.dirname(os.path.abspath(__file__)), name) for name in PIPELINE_MODULES]
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def pipeline_version():
+    source = b""
+    for path in PIPELINE_SOURCES:
+        with open(path, "rb") as f:
+            source += f.read()
+    versions = f"pandas={pd.__version__};sklearn={sklearn.__version__};pyarrow={pa.__version__}"
+    return hashlib.sha256(source + versions.encode()).hexdigest()[:16]
+
+
+# IDF ที่ fit แล้วมีผลต่อคอลัมน์ TF-IDF → transformer คนละตัวต้องได้ key คนละตัว
+def transformer_fingerprint(transformer):
+    if transformer is None or transformer.vectorizer is None:
+        return "batch-fit"
+    vectorizer = transformer.vectorizer
+    digest = hashlib.sha256(repr(sorted(vectorizer.vocabulary_.items())).encode())
+    digest.update(vectorizer.idf_.tobytes())
+    digest.update(repr(transformer.features).encode())
+    digest.update(repr(transformer.session_window_s).encode())
+    return digest.hexdigest()[:16]
+
+
+class FeatureCache:
+    def __init__(self, root, max_mb=None):
+        self.root = root
+        self.max_bytes = int(float(max_mb if max_mb is not None else os.getenv("FEATURE_CACHE_MAX_MB", 1024)) * 1024 ** 2)
+        self.version = pipeline_version()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, *parts):
+        return hashlib.sha256("|".join([self.version, *map(str, parts)]).encode()).hexdigest()[:32]
+
+    def path(self, key, suffix=".parquet"):
+        return os.path.join(self.root, key + suffix)
+
+    def get(self, key):
+        path = self.path(key)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        # import ตอนใช้: prepare_data เองก็ import โมดูลนี้
+        from prepare_data import enforce_feature_schema
+        try:
+            df = enforce_feature_schema(pd.read_parquet(path))
+        except Exception as e:
+            # block เสีย (เช่นเขียนไม่จบ) → ถือว่า miss แล้วเขียนใหม่
+            print(f"⚠️ Feature cache block unreadable ({e}) — recomputing")
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return df
+
+    def put(self, key, df):
+        path = self.path(key)
+        write_artifact(df, path + ".tmp.parquet")
+        os.replace(path + ".tmp.parquet", path)
+        self.evict()
+        return df
+
+    def get_or_compute(self, key, compute):
+        df = self.get(key)
+        return df if df is not None else self.put(key, compute())
+
+    # object อื่นที่ต้องเก็บคู่กับ block (เช่น state ของ FeatureTransformer)
+    def get_object(self, key):
+        path = self.path(key, ".pkl")
+        if not os.path.exists(path):
+            return None
+        os.utime(path)
+        return joblib.load(path)
+
+    def put_object(self, key, obj):
+        path = self.path(key, ".pkl")
+        joblib.dump(obj, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        return obj
+
+    def evict(self):
+        entries = [(os.path.getmtime(p), os.path.getsize(p), p)
+                   for p in glob.glob(os.path.join(self.root, "*")) if not p.endswith(".tmp") and ".tmp." not in p]
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(p)
+                total -= size
+            except OSError:
+                pass
+
+    def summary(self):
+        return f"🗄 Feature cache: {self.hits} hit(s), {self.misses} miss(es) → {self.root}"
+
+
+# FEATURE_CACHE_ENABLED=0 → ปิด cache (คืน None ให้ผู้เรียก transform ตรง ๆ เหมือนเดิม)
+def open_feature_cache(output_dir):
+    if os.getenv("FEATURE_CACHE_ENABLED", "1") != "1":
+        return None
+    return FeatureCache(os.getenv("FEATURE_CACHE_DIR", os.path.join(output_dir, "feature-cache")))
@@ -0,0 +1,57 @@
+import os
+import sys
+
+# -------------------------------------
+# ⚙️ gunicorn config สำหรับ ml-serve (gunicorn -c gunicorn.conf.py wsgi:app)
+# -------------------------------------
+bind = f"0.0.0.0:{os.getenv('SERVE_PORT', 8000)}"
+
+# 0 = ใช้ทุก core ของ container (โมเดลที่ใช้ session feature → ถูกบังคับเหลือ 1, ดู limit_workers_for_session)
+workers = int(os.getenv("SERVE_WORKERS", 0)) or os.cpu_count() or 1
+worker_class = "gthread"
+threads = int(os.getenv("SERVE_THREADS", 4))
+timeout = int(os.getenv("SERVE_TIMEOUT", 60))
+
+# 📦 โหลดโมเดลใน master ก่อน fork → แชร์หน่วยความจำระหว่าง worker
+preload_app = True
+
+accesslog = "-" if os.getenv("SERVE_ACCESS_LOG", "0") == "1" else None
+errorlog = "-"
+
+
+# worker หลายตัว → booster ใช้ thread ละ 1 core พอ ไม่แย่ง CPU กันเอง
+os.environ.setdefault("BOOSTER_NTHREAD", "1")
+
+
+# 🔥 warm-up + model watcher หลัง fork ในแต่ละ worker
+# (OpenMP ของ xgboost ไม่ควรถูกใช้ใน master ก่อน fork และ thread ไม่ข้าม fork)
+def post_worker_init(worker):
+    from wsgi import serve
+    serve.warm_up()
+    serve.start_model_watcher()
+    serve.metrics.start_flusher()
+
+
+# 🪟 โมเดลที่ใช้ session feature → บังคับ worker เดียว (session window อยู่ใน memory ของ worker,
+# N worker = window ต่ำกว่าตอนเทรน ~N เท่า) | เรียกตอน start และทุกครั้งที่จำนวน worker เปลี่ยน (TTIN/TTOU)
+def limit_workers_for_session(server):
+    serve = sys.modules.get("ml_serve")
+    if serve is None:
+        # ยังไม่ได้ preload app (Arbiter.setup ตั้ง num_workers ก่อน import wsgi)
+        return
+    if serve.active.session is not None and server.num_workers > 1:
+        print(f"⚠️ Model uses session features (window={serve.active.session.window_s:g}s) → "
+              f"{server.num_workers} workers would split the window state, forcing workers=1")
+        server.num_workers = 1
+    serve.worker_count = server.num_workers
+
+
+# 📊 snapshot /metrics ของรอบก่อน (pid เก่า) ไม่นับรวมกับรอบนี้
+def on_starting(server):
+    from serve_metrics import clear_snapshots
+    clear_snapshots()
+    limit_workers_for_session(server)
+
+
+def nworkers_changed(server, new_value, old_value):
+    limit_workers_for_session(server)
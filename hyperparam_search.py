@@ -0,0 +1,205 @@
+import os, json, math, time, random, itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import xgboost as xgb
+from sklearn.model_selection import train_test_split
+from artifacts import read_artifact
+from prepare_data import enforce_feature_schema
+from stage_metrics import clear_run
+from dmatrix_cache import load_dmatrix, describe_load
+from feature_cache import FeatureCache
+
+# -------------------------------------
+# 🔎 Hyperparameter search: grid / random บน process pool + early stopping บน validation split
+# -------------------------------------
+# แต่ละ worker สร้าง QuantileDMatrix (train + validation ที่ใช้ quantile cut เดียวกัน) ครั้งเดียวตอนเริ่ม
+# แล้วทุก trial ใน worker นั้นใช้ DMatrix ชุดเดิม → ไม่ quantize ข้อมูลซ้ำต่อ trial
+# มี dmatrix-cache → โหลด binary DMatrix แทนการ parse CSV แล้วแยก train/validation จาก CSR ของมันเป็น QuantileDMatrix แบบเดียวกัน
+# SEARCH_SPACE: JSON (inline หรือ path ไฟล์) → {"max_depth": [4, 6, 8], "learning_rate": {"min": 0.02, "max": 0.3, "log": true}}
+#   list = ตัวเลือก, {"min","max"} = ช่วง (random เท่านั้น, int ถ้าขอบเป็น int ทั้งคู่)
+SEARCH_MODES = ["off", "grid", "random"]
+DEFAULT_SPACE = {
+    "max_depth": [4, 6, 8],
+    "learning_rate": [0.05, 0.1, 0.2],
+    "min_child_weight": [1, 5],
+    "subsample": [0.8, 1.0],
+}
+# metric ที่ค่ามากกว่าดีกว่า (ที่เหลือ เช่น logloss / error น้อยกว่าดีกว่า)
+MAXIMIZE_METRICS = {"auc", "aucpr", "map", "ndcg", "pre"}
+# QuantileDMatrix quantize ตาม max_bin ตอนสร้าง → ทุก trial ต้องใช้ค่าเดียวกัน
+FIXED_PARAMS = {"max_bin", "tree_method"}
+
+
+def load_search_space(value):
+    if not value:
+        return dict(DEFAULT_SPACE)
+    if os.path.exists(value):
+        with open(value, encoding="utf-8") as f:
+            space = json.load(f)
+    else:
+        space = json.loads(value)
+    fixed = FIXED_PARAMS & set(space)
+    if fixed:
+        raise ValueError(f"❌ SEARCH_SPACE cannot vary {sorted(fixed)} (shared quantized DMatrix)")
+    return space
+
+
+def sample_value(rng, spec):
+    if isinstance(spec, list):
+        return rng.choice(spec)
+    low, high = spec["min"], spec["max"]
+    value = math.exp(rng.uniform(math.log(low), math.log(high))) if spec.get("log") else rng.uniform(low, high)
+    return int(round(value)) if isinstance(low, int) and isinstance(high, int) else round(value, 6)
+
+
+def expand_space(space, mode, trials, seed):
+    keys = sorted(space)
+    if mode == "grid":
+        ranged = [k for k in keys if not isinstance(space[k], list)]
+        if ranged:
+            raise ValueError(f"❌ grid search needs a list of values for {ranged} (ranges are random-only)")
+        return [dict(zip(keys, values)) for values in itertools.product(*(space[k] for k in keys))]
+
+    # random: สุ่มทีละ key (ไม่สร้าง product ทั้งหมด) แล้วตัดชุดที่ซ้ำ
+    rng = random.Random(seed)
+    combos, seen = [], set()
+    for _ in range(trials * 20):
+        combo = {k: sample_value(rng, space[k]) for k in keys}
+        signature = json.dumps(combo, sort_keys=True)
+        if signature not in seen:
+            seen.add(signature)
+            combos.append(combo)
+        if len(combos) == trials:
+            break
+    return combos
+
+
+# -------------------------------------
+# 👷 Worker: โหลด + split + quantize ครั้งเดียว, ใช้ซ้ำทุก trial
+# -------------------------------------
+_search_data = None
+
+
+def init_search_worker(train_file, validation_pct, seed, nthread, in_pool=True, cache_dir=None):
+    global _search_data
+    # worker ที่ fork มาได้ metrics run ของ parent ติดมา → ไม่บันทึกซ้ำ
+    if in_pool:
+        clear_run()
+    if cache_dir:
+        dmatrix, info = load_dmatrix(FeatureCache(cache_dir, max_mb=os.getenv("DMATRIX_CACHE_MAX_MB", 2048)), train_file)
+        print(f"   {describe_load(f'search worker {os.getpid()}', info)}")
+        # split แบบ stratify เดียวกับทางที่อ่าน CSV (ใช้แค่ label) → ได้แถวชุดเดียวกัน
+        rows = np.arange(dmatrix.num_row())
+        labels = dmatrix.get_label()
+        train_rows, valid_rows = train_test_split(rows, test_size=validation_pct / 100, random_state=seed, stratify=labels)
+        train_rows, valid_rows = np.sort(train_rows), np.sort(valid_rows)
+        # DMatrix.slice ยังเป็น DMatrix ธรรมดา → hist sketch ใหม่ทุก trial; CSR เก็บศูนย์ไว้ครบ (NaN = missing เหมือนเดิม)
+        data, names, types = dmatrix.get_data(), dmatrix.feature_names, dmatrix.feature_types
+        del dmatrix
+        dtrain = xgb.QuantileDMatrix(data[train_rows], label=labels[train_rows], feature_names=names, feature_types=types, nthread=nthread)
+        dvalid = xgb.QuantileDMatrix(data[valid_rows], label=labels[valid_rows], feature_names=names, feature_types=types, ref=dtrain, nthread=nthread)
+        _search_data = {"dtrain": dtrain, "dvalid": dvalid, "nthread": nthread}
+        return
+    df = enforce_feature_schema(read_artifact(train_file))
+    train, valid = train_test_split(df, test_size=validation_pct / 100, random_state=seed, stratify=df["label"])
+    del df
+    dtrain = xgb.QuantileDMatrix(train.drop(columns=["label"]), label=train["label"], nthread=nthread)
+    dvalid = xgb.QuantileDMatrix(valid.drop(columns=["label"]), label=valid["label"], ref=dtrain, nthread=nthread)
+    _search_data = {"dtrain": dtrain, "dvalid": dvalid, "nthread": nthread}
+
+
+def run_trial(trial_id, params, base_params, metric, early_stopping_rounds):
+    dtrain, dvalid = _search_data["dtrain"], _search_data["dvalid"]
+    merged = {**base_params, **params}
+    rounds = int(merged.pop("n_estimators"))
+    booster_params = {
+        **{k: v for k, v in merged.items() if k not in ("random_state", "eval_metric")},
+        "objective": "binary:logistic",
+        "tree_method": "hist",
+        "eval_metric": metric,
+        "seed": merged.get("random_state", 0),
+        "nthread": _search_data["nthread"],
+    }
+    start = time.perf_counter()
+    booster = xgb.train(
+        booster_params, dtrain, num_boost_round=rounds,
+        evals=[(dvalid, "validation")], early_stopping_rounds=early_stopping_rounds, verbose_eval=False,
+    )
+    best_iteration = booster.best_iteration
+    # ตัดต้นไม้หลัง best iteration ทิ้ง → ml-serve (inplace_predict ทุกต้น) ได้ผลเดียวกับตอน validate
+    best = booster[: best_iteration + 1]
+    return {
+        "trial": trial_id,
+        "params": params,
+        "score": float(booster.best_score),
+        "best_iteration": best_iteration,
+        "rounds_run": booster.num_boosted_rounds(),
+        "seconds": round(time.perf_counter() - start, 3),
+        "model": bytes(best.save_raw("ubj")),
+    }
+
+
+def describe(params):
+    return ", ".join(f"{k}={v}" for k, v in params.items())
+
+
+# -------------------------------------
+# 🏁 รัน search ทั้งหมด → (XGBClassifier ของผู้ชนะ, params ของผู้ชนะ, leaderboard)
+# -------------------------------------
+def search_hyperparameters(train_file, base_params, mode, space, trials, workers, validation_pct, early_stopping_rounds, metric, cache_dir=None):
+    seed = base_params.get("random_state", 42)
+    combos = expand_space(space, mode, trials, seed)
+    if not combos:
+        raise ValueError("❌ SEARCH_SPACE produced no parameter combinations")
+    workers = max(1, min(workers or os.cpu_count() or 1, len(combos)))
+    nthread = max(1, (os.cpu_count() or 1) // workers)
+    maximize = metric in MAXIMIZE_METRICS
+    print(f"🔎 {mode} search: {len(combos)} trial(s) on {workers} worker(s) x {nthread} thread(s), "
+          f"early stopping {early_stopping_rounds} rounds on {validation_pct}% validation ({metric})")
+
+    results = []
+    best = None
+
+    def collect(result):
+        nonlocal best
+        model = result.pop("model")
+        results.append(result)
+        better = best is None or (result["score"] > best[0]["score"] if maximize else result["score"] < best[0]["score"])
+        if better:
+            best = (result, model)
+        print(f"   ↳ [{len(results)}/{len(combos)}] trial {result['trial']}: {describe(result['params'])} → {metric}={result['score']:.5f} "
+              f"@ {result['best_iteration'] + 1} round(s) ({result['seconds']:.1f}s)")
+
+    # trial ที่ params ใช้ไม่ได้ → ข้ามไป ไม่ล้มทั้ง search
+    def failed(trial_id, error):
+        print(f"   ❌ trial {trial_id}: {describe(combos[trial_id])} → {type(error).__name__}: {error}")
+
+    args = (base_params, metric, early_stopping_rounds)
+    if workers == 1:
+        init_search_worker(train_file, validation_pct, seed, nthread, in_pool=False, cache_dir=cache_dir)
+        for i, params in enumerate(combos):
+            try:
+                collect(run_trial(i, params, *args))
+            except xgb.core.XGBoostError as e:
+                failed(i, e)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_search_worker, initargs=(train_file, validation_pct, seed, nthread, True, cache_dir)) as pool:
+            futures = {pool.submit(run_trial, i, params, *args): i for i, params in enumerate(combos)}
+            for future in as_completed(futures):
+                try:
+                    collect(future.result())
+                except xgb.core.XGBoostError as e:
+                    failed(futures[future], e)
+    if best is None:
+        raise RuntimeError("❌ Every search trial failed — check SEARCH_SPACE")
+
+    leaderboard = sorted(results, key=lambda r: r["score"], reverse=maximize)
+    for rank, row in enumerate(leaderboard, start=1):
+        row["rank"] = rank
+    winner, raw_model = best
+    winner_params = {**base_params, **winner["params"], "n_estimators": winner["best_iteration"] + 1}
+    print(f"🏆 Best trial {winner['trial']}: {metric}={winner['score']:.5f} | {winner['params']} | {winner['best_iteration'] + 1} tree(s)")
+
+    model = xgb.XGBClassifier(**winner_params, n_jobs=-1)
+    model.load_model(bytearray(raw_model))
+    return model, winner_params, leaderboard
@@ -0,0 +1,131 @@
+import os, sys, time
+import numpy as np
+import pandas as pd
+import joblib
+import xgboost as xgb
+from sklearn.metrics import accuracy_score, f1_score
+from sklearn.model_selection import train_test_split
+from artifacts import find_artifact, read_artifact, iter_artifact, append_artifact
+from prepare_data import INPUT_FIELDS, enforce_feature_schema, load_feature_transformer, windows_of
+from session_features import session_features, timestamps_ms, window_ms
+
+# -------------------------------------
+# 🔁 Incremental retrain: ต่อ boosting จากโมเดลเดิมด้วยแถวใหม่เท่านั้น
+# -------------------------------------
+# แถวเก่าไม่ถูก transform ซ้ำ: ใช้ training-set / testing-set ที่ prepare_data เขียนไว้แล้วเป็น feature cache
+#   - replay: สุ่มแถวเก่าจาก cache มาผสม → โมเดลไม่เอียงไปทาง label ของแถวใหม่อย่างเดียว
+#   - guard: วัด test set (cache + แถวใหม่ที่กันไว้) ทั้งโมเดลเดิมและโมเดลใหม่ → แย่ลงเกินกำหนดไม่รับ
+KEEP_FIELDS = INPUT_FIELDS + ["ioc.dest_ip_misp_is_alert"]
+RETRAIN_ROUNDS = int(os.getenv("RETRAIN_ROUNDS", 20))
+RETRAIN_REPLAY_ROWS = int(os.getenv("RETRAIN_REPLAY_ROWS", 50000))
+RETRAIN_TEST_PCT = int(os.getenv("RETRAIN_TEST_PCT", os.getenv("TEST_SET_PCT", 20)))
+RETRAIN_MAX_METRIC_DROP = float(os.getenv("RETRAIN_MAX_METRIC_DROP", 0.005))
+RETRAIN_HISTORY_CHUNK_ROWS = int(os.getenv("RETRAIN_HISTORY_CHUNK_ROWS", 100000))
+
+
+# key ต่อแถวจาก field ดิบ: ตัวเลขเทียบแบบตัวเลข (443 / "443" / 443.0 ถือว่าเหมือนกัน) → hash 64-bit
+def row_keys(df):
+    columns = {}
+    for col in KEEP_FIELDS:
+        values = df[col].fillna("-") if col in df.columns else pd.Series("-", index=df.index)
+        numeric = pd.to_numeric(values, errors="coerce")
+        columns[col] = np.where(numeric.notna(), numeric.astype(float).astype(str), values.astype(str))
+    return pd.util.hash_pandas_object(pd.DataFrame(columns, index=df.index), index=False).to_numpy()
+
+
+# อ่าน history ทีละ chunk: เก็บแค่ key ของแถว (dedup) + แถวที่ยังอยู่ใน session window ของแถวใหม่ได้
+# (t > เวลาแรกสุดของ candidate - window) → memory ตามจำนวน key ไม่ใช่ขนาด dataset
+def scan_history(history_path, df_candidates, session_window_s=None):
+    seen, recent, header = set(), [], None
+    since = None
+    if session_window_s:
+        t, valid = timestamps_ms(df_candidates["@timestamp"])
+        since = int(t[valid].min()) - window_ms(session_window_s) if valid.any() else None
+    for chunk in iter_artifact(history_path, RETRAIN_HISTORY_CHUNK_ROWS):
+        header = header or list(chunk.columns)
+        seen.update(row_keys(chunk).tolist())
+        if since is not None:
+            t, valid = timestamps_ms(chunk["@timestamp"])
+            recent.append(chunk.loc[valid & (t > since)].reindex(columns=KEEP_FIELDS))
+    recent = pd.concat(recent, ignore_index=True) if recent else pd.DataFrame(columns=KEEP_FIELDS)
+    return seen, recent, header
+
+
+def new_rows_only(seen, df_candidates):
+    keys = row_keys(df_candidates)
+    fresh = ~pd.Series(keys).isin(seen).to_numpy() & ~pd.Series(keys).duplicated().to_numpy()
+    return df_candidates[fresh]
+
+
+def evaluate(model, x, y):
+    y_pred = model.predict(x)
+    return {"accuracy": accuracy_score(y, y_pred), "f1_macro": f1_score(y, y_pred, average="macro")}
+
+
+def incremental_retrain(df_new_raw, history_path, output_dir):
+    model_path = os.path.join(output_dir, "xgboost-model.pkl")
+    train_cache = find_artifact(output_dir, "training-set")
+    test_cache = find_artifact(output_dir, "testing-set")
+    transformer = load_feature_transformer(model_path)
+    if not os.path.exists(model_path) or not train_cache or not test_cache or transformer is None:
+        sys.exit("❌ Incremental retrain ต้องมี xgboost-model.pkl, feature-transformer.pkl และ training/testing-set เดิม — รันแบบ full ก่อน")
+
+    # 1️⃣ เฉพาะแถวที่ยังไม่เคยอยู่ใน dataset (หรือ label เปลี่ยน)
+    for col in KEEP_FIELDS:
+        if col not in df_new_raw.columns:
+            df_new_raw[col] = None
+    seen, df_recent, history_columns = scan_history(history_path, df_new_raw, transformer.session_window_s)
+    df_fresh = new_rows_only(seen, df_new_raw[KEEP_FIELDS])
+    print(f"🆕 New/changed rows: {len(df_fresh):,} of {len(df_new_raw):,} candidates")
+    if df_fresh.empty:
+        print("✅ Nothing new to learn — model unchanged.")
+        return False
+
+    # 🪟 session window ของแถวใหม่นับ request ใน history ด้วย (เหมือน prepare ที่คำนวณบนทั้ง dataset ก่อน split)
+    # แถว history ที่เก่ากว่าแถวใหม่แรกสุดเกิน window ไม่มีผลกับค่าของแถวใหม่ → คำนวณแค่ช่วงท้าย
+    windows = None
+    if transformer.session_window_s:
+        combined = pd.concat([df_recent, df_fresh], ignore_index=True)
+        windows = session_features(combined, transformer.session_window_s).iloc[len(df_recent):].set_axis(df_fresh.index)
+
+    # 2️⃣ transform เฉพาะแถวใหม่ ด้วย transformer เดิม (IDF เดียวกับที่โมเดลเห็นตอนเทรน)
+    labels = df_fresh["ioc.dest_ip_misp_is_alert"].fillna(0).astype(int)
+    stratify = labels if len(df_fresh) >= 10 and labels.value_counts().min() >= 2 else None
+    new_train_raw, new_test_raw = train_test_split(df_fresh, test_size=RETRAIN_TEST_PCT / 100, random_state=42, stratify=stratify)
+    new_train = transformer.transform(new_train_raw, mode="train", session_values=windows_of(windows, new_train_raw))
+    new_test = transformer.transform(new_test_raw, mode="train", session_values=windows_of(windows, new_test_raw))
+
+    # 3️⃣ feature cache ของแถวเก่า: replay sample + test set เดิม
+    cached_train = enforce_feature_schema(read_artifact(train_cache))
+    replay = cached_train.sample(n=min(RETRAIN_REPLAY_ROWS, len(cached_train)), random_state=42)
+    fit_df = pd.concat([replay, new_train], ignore_index=True)
+    eval_df = pd.concat([enforce_feature_schema(read_artifact(test_cache)), new_test], ignore_index=True)
+    x_eval, y_eval = eval_df.drop(columns=["label"]), eval_df["label"]
+    del cached_train
+
+    # 4️⃣ ต่อ boosting จาก booster เดิมอีก RETRAIN_ROUNDS รอบ
+    base_model = joblib.load(model_path)
+    candidate = xgb.XGBClassifier(**base_model.get_params())
+    candidate.set_params(n_estimators=RETRAIN_ROUNDS)
+    print(f"🏋️‍♂️ Continuing boosting: +{RETRAIN_ROUNDS} rounds on {len(new_train):,} new + {len(replay):,} replayed rows ...")
+    start = time.time()
+    candidate.fit(fit_df.drop(columns=["label"]), fit_df["label"], xgb_model=base_model.get_booster())
+    print(f"✅ Incremental training complete in {time.time() - start:.2f}s")
+
+    # 5️⃣ guard: metric ห้ามลดลงเกิน RETRAIN_MAX_METRIC_DROP
+    before, after = evaluate(base_model, x_eval, y_eval), evaluate(candidate, x_eval, y_eval)
+    for name in before:
+        print(f"📏 {name}: {before[name] * 100:.2f}% → {after[name] * 100:.2f}%")
+    regressed = [name for name in before if after[name] < before[name] - RETRAIN_MAX_METRIC_DROP]
+    if regressed:
+        sys.exit(f"❌ Rejected: {', '.join(regressed)} dropped more than {RETRAIN_MAX_METRIC_DROP * 100:.2f} pts — keeping current model")
+
+    # 6️⃣ รับโมเดล → เขียนแบบ atomic (ml-serve hot reload) แล้วเติมแถวใหม่เข้า dataset + feature cache
+    joblib.dump(candidate, model_path + ".tmp")
+    os.replace(model_path + ".tmp", model_path)
+    print(f"💾 Model saved → {model_path} ({candidate.get_booster().num_boosted_rounds()} trees total)")
+    append_artifact(new_train, train_cache)
+    append_artifact(new_test, test_cache)
+    df_fresh.reindex(columns=history_columns).to_csv(history_path, index=False, mode="a", header=False)
+    print(f"🗃 Appended {len(df_fresh):,} rows → {history_path} + feature cache")
+    return True
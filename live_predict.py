@@ -0,0 +1,291 @@
+import os, io, json, time, fnmatch, signal, threading
+import pandas as pd
+import joblib
+from watchdog.observers import Observer
+from watchdog.observers.polling import PollingObserver
+from watchdog.events import FileSystemEventHandler
+from prepare_data import load_feature_transformer
+from session_features import SessionStore
+from artifacts import ArtifactWriter, artifact_path
+from zeek_logs import new_zeek_meta, parse_zeek_header_line, read_zeek_tsv, parse_zeek_json
+from predict import BASE_OUTPUT_DIR, RESULT_DTYPES, KEEP_FIELDS, split_features, score_frame, apply_filters, transform_cached, open_verdict_cache, predict_probs_cached
+
+# -------------------------------------
+# 📡 Live mode: ตามอ่านบรรทัดใหม่ของไฟล์ใน input folder แล้ว predict ทีละ batch เล็ก ๆ
+# -------------------------------------
+# - watchdog แจ้งไฟล์ที่ถูกสร้าง/เขียนเพิ่ม → อ่านต่อจาก offset เดิมเฉพาะบรรทัดที่จบแล้ว
+# - flush เมื่อครบ LIVE_BATCH_ROWS แถว หรือแถวแรกที่รออยู่เก่ากว่า LIVE_FLUSH_S วินาที
+# - ผลต่อท้าย predict_result.csv / whitelist_filtered.csv (CSV เสมอ → dashboard อ่านได้ระหว่างเขียน)
+# - ตัวนับสะสมเขียนลง live_stats.json ทุก batch
+LIVE_BATCH_ROWS = int(os.getenv("LIVE_BATCH_ROWS", 500))
+LIVE_FLUSH_S = float(os.getenv("LIVE_FLUSH_S", 1.0))
+LIVE_PATTERNS = os.getenv("LIVE_PATTERNS", "*.csv,*.log,*.json,*.ndjson").split(",")
+LIVE_FROM_START = os.getenv("LIVE_FROM_START", "1") == "1"
+# PollingObserver สำหรับ volume ที่ไม่ส่ง inotify (NFS/SMB, Docker Desktop)
+LIVE_POLL = os.getenv("LIVE_POLL", "0") == "1"
+# 🪟 state ของ session window (โมเดลที่เทรนด้วย SESSION_WINDOW_S) เก็บข้าม restart → window ไม่เริ่มนับใหม่จากศูนย์
+LIVE_SESSION_STATE = os.getenv("LIVE_SESSION_STATE", os.path.join(BASE_OUTPUT_DIR, "live_session_state.pkl"))
+# 📍 offset ของแต่ละไฟล์ เก็บพร้อม session state ตอนหยุด → restart แล้วอ่านต่อจากเดิม
+# (ไม่งั้น LIVE_FROM_START=1 อ่านไฟล์เดิมจาก 0 → score/เขียนซ้ำ และนับเข้า session ที่โหลดกลับมาซ้ำอีกรอบ)
+LIVE_OFFSETS_STATE = os.getenv("LIVE_OFFSETS_STATE", os.path.join(BASE_OUTPUT_DIR, "live_offsets.json"))
+
+
+# -------------------------------------
+# 📄 อ่านเฉพาะส่วนที่เพิ่มมาของไฟล์ (บรรทัดสุดท้ายที่ยังเขียนไม่จบรอรอบหน้า)
+# -------------------------------------
+# CSV (header บรรทัดแรก) | Zeek TSV (#fields) | JSON lines (Zeek JSON หรือ ECS)
+# resume: {"offset", "inode"} ที่บันทึกไว้รอบก่อน → ไฟล์เดิม (inode เดียวกัน, ไม่สั้นลง) อ่านต่อจาก offset นั้น
+class FileTail:
+    def __init__(self, path, from_start=True, resume=None):
+        self.path = path
+        self.header = None
+        self.zeek_meta = None
+        self.offset = 0
+        self.inode = os.stat(path).st_ino if os.path.exists(path) else None
+        if resume and self.inode == resume["inode"] and os.path.getsize(path) >= resume["offset"]:
+            self.read_header()
+            self.offset = resume["offset"]
+        elif not from_start and os.path.exists(path):
+            # ข้ามข้อมูลเดิม แต่ยังต้องใช้ header (CSV บรรทัดแรก / Zeek #fields)
+            self.read_header()
+            with open(path, "rb") as f:
+                # เริ่มต่อจากบรรทัดสุดท้ายที่จบแล้ว (บรรทัดที่กำลังเขียนอ่านรอบหน้า)
+                size = os.path.getsize(path)
+                f.seek(max(0, size - 65536))
+                self.offset = max(0, size - 65536) + f.read().rfind(b"\n") + 1
+
+    def read_header(self):
+        with open(self.path, "rb") as f:
+            head = []
+            for line in f:
+                if not self.is_csv and not line.startswith(b"#"):
+                    break
+                head.append(line)
+                if self.is_csv:
+                    break
+        self.parse_header(b"".join(head))
+
+    def state(self):
+        return {"offset": self.offset, "inode": self.inode}
+
+    @property
+    def is_csv(self):
+        return self.path.lower().endswith(".csv")
+
+    def read_new(self):
+        size = os.path.getsize(self.path)
+        if size < self.offset:
+            # truncate / rotate → เริ่มอ่านใหม่จากต้นไฟล์
+            print(f"🔄 {os.path.basename(self.path)} was truncated — reading from the start")
+            self.offset, self.header, self.zeek_meta = 0, None, None
+            self.inode = os.stat(self.path).st_ino
+        if size == self.offset:
+            return None
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            return None
+        self.offset += end
+        return self.parse(data[:end])
+
+    # อ่าน header อย่างเดียว (ตอนเริ่มที่ท้ายไฟล์)
+    def parse_header(self, data):
+        if self.is_csv:
+            self.header = data.partition(b"\n")[0] + b"\n" if data else None
+            return
+        for line in data.decode("utf-8", errors="replace").splitlines():
+            if line.startswith("#"):
+                self.zeek_meta = parse_zeek_header_line(line, self.zeek_meta or new_zeek_meta())
+
+    def parse(self, data):
+        if self.is_csv:
+            if self.header is None:
+                self.header, _, data = data.partition(b"\n")
+                self.header += b"\n"
+            if not data.strip():
+                return None
+            return pd.read_csv(io.BytesIO(self.header + data), on_bad_lines="skip")
+        lines = data.decode("utf-8", errors="replace").splitlines()
+        # Zeek TSV: header (#fields ...) ปนมาได้ทุกเมื่อ เช่นหลัง rotate
+        if self.zeek_meta is not None or (lines and lines[0].startswith("#")):
+            rows = []
+            for line in lines:
+                if line.startswith("#"):
+                    self.zeek_meta = parse_zeek_header_line(line, self.zeek_meta or new_zeek_meta())
+                elif line:
+                    rows.append(line)
+            if not rows or not self.zeek_meta["fields"]:
+                return None
+            return next(read_zeek_tsv([row + "\n" for row in rows], self.zeek_meta, KEEP_FIELDS))
+        return parse_zeek_json(lines, KEEP_FIELDS)
+
+
+class TailHandler(FileSystemEventHandler):
+    def __init__(self, dirty, wake):
+        self.dirty = dirty
+        self.wake = wake
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        path = getattr(event, "dest_path", "") or event.src_path
+        if any(fnmatch.fnmatch(os.path.basename(path).lower(), p.strip().lower()) for p in LIVE_PATTERNS):
+            self.dirty.add(os.path.abspath(path))
+            self.wake.set()
+
+
+# -------------------------------------
+# 🔮 Live scorer: model/transformer โหลดครั้งเดียว, เขียนผลต่อท้ายทีละ batch
+# -------------------------------------
+# restore_session=False → เริ่ม session ว่าง (ไม่มี offset ของรอบก่อน แต่จะอ่านไฟล์เดิมจากต้น → ห้ามนับซ้ำ)
+# resume=True (อ่านต่อจาก offset เดิม) → ต่อท้าย predict_result / whitelist_filtered ของรอบก่อนแทนการเขียนทับ
+class LiveScorer:
+    def __init__(self, model_path, restore_session=True, resume=False):
+        self.model = joblib.load(model_path)
+        self.transformer = load_feature_transformer(model_path)
+        self.output_path = artifact_path(BASE_OUTPUT_DIR, "predict_result", "csv")
+        self.whitelist_path = artifact_path(BASE_OUTPUT_DIR, "whitelist_filtered", "csv")
+        self.stats_path = os.path.join(BASE_OUTPUT_DIR, "live_stats.json")
+        self.output_writer = ArtifactWriter(self.output_path, RESULT_DTYPES, text_default=True)
+        self.whitelist_writer = ArtifactWriter(self.whitelist_path, RESULT_DTYPES, text_default=True)
+        self.columns = None
+        if resume:
+            for writer in (self.output_writer, self.whitelist_writer):
+                if os.path.exists(writer.path) and os.path.getsize(writer.path):
+                    writer.written = True
+            if self.output_writer.written:
+                self.columns = list(pd.read_csv(self.output_path, nrows=0).columns)
+        self.session = None
+        if self.transformer and self.transformer.session_window_s:
+            if restore_session:
+                self.session = SessionStore.load(LIVE_SESSION_STATE, self.transformer.session_window_s)
+            else:
+                if os.path.exists(LIVE_SESSION_STATE):
+                    print(f"⚠️ No saved file offsets → re-reading inputs from the start, session state {LIVE_SESSION_STATE} not restored")
+                self.session = SessionStore(self.transformer.session_window_s)
+        # 🧠 log ที่วนซ้ำ (telemetry / update check) → prob_1 จาก cache, transform + predict เฉพาะ record ใหม่
+        self.verdicts = open_verdict_cache(model_path, self.transformer)
+        self.stats = {"batches": 0, "total": 0, "whitelist": 0, "alerts": 0, "correct": 0, "labeled": 0,
+                      "cache_hit_rate": None, "last_latency_s": None, "started_at": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+    def score(self, df, oldest):
+        df = df.reset_index(drop=True)
+        if self.verdicts is not None:
+            probs, y_true, labeled, _ = predict_probs_cached(self.model, self.transformer, df, self.verdicts, self.session)
+            df_result, y_pred, _ = score_frame(self.model, df, None, probs)
+        else:
+            x_data, y_true, labeled = split_features(transform_cached(df, self.transformer, session=self.session))
+            df_result, y_pred, _ = score_frame(self.model, df, x_data)
+        # ไฟล์ต่างแหล่ง (CSV / JSON) คอลัมน์ไม่ตรงกัน → ยึดคอลัมน์ของ batch แรก
+        if self.columns is None:
+            self.columns = list(df_result.columns)
+        df_result = df_result.reindex(columns=self.columns)
+
+        is_whitelist = df_result["is_whitelist"] == True
+        if is_whitelist.any():
+            self.whitelist_writer.write(df_result[is_whitelist])
+        apply_filters(df_result)
+        self.output_writer.write(df_result)
+
+        alerts = int((df_result["prediction"] == 1).sum())
+        self.stats["batches"] += 1
+        self.stats["total"] += len(df_result)
+        self.stats["whitelist"] += int(is_whitelist.sum())
+        self.stats["alerts"] += alerts
+        if labeled:
+            self.stats["labeled"] += len(y_pred)
+            self.stats["correct"] += int((y_true.to_numpy() == y_pred).sum())
+        if self.verdicts is not None:
+            self.stats["cache_hit_rate"] = self.verdicts.stats()["hit_rate"]
+        self.stats["last_latency_s"] = round(time.time() - oldest, 3)
+        self.save_stats()
+        print(f"{'🚨' if alerts else '✅'} batch {self.stats['batches']}: {len(df_result):,} rows, {alerts} alert(s) "
+              f"| total={self.stats['total']:,} alerts={self.stats['alerts']:,} | latency={self.stats['last_latency_s']:.2f}s")
+
+    def save_stats(self):
+        stats = dict(self.stats, updated_at=time.strftime("%Y-%m-%d %H:%M:%S"))
+        if stats["labeled"]:
+            stats["accuracy"] = round(stats["correct"] / stats["labeled"], 4)
+        with open(self.stats_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(stats, f, indent=2)
+        os.replace(self.stats_path + ".tmp", self.stats_path)
+
+    def save_session(self):
+        if self.session is not None:
+            print(f"🪟 Session state saved → {self.session.save(LIVE_SESSION_STATE)} ({len(self.session):,} active key(s))")
+
+
+def load_offsets(path=LIVE_OFFSETS_STATE):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+# บันทึกตอนหยุดพร้อม session state (หลัง score แถวที่ค้างหมดแล้ว) → offset กับ window ตรงกันเสมอ
+def save_offsets(tails, path=LIVE_OFFSETS_STATE):
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({p: tail.state() for p, tail in tails.items()}, f, indent=2)
+    os.replace(path + ".tmp", path)
+    print(f"📍 File offsets saved → {path} ({len(tails)} file(s))")
+
+
+def run_live(model_path, input_folder):
+    offsets = load_offsets()
+    # ไม่มี offset เดิม + อ่านจากต้นไฟล์ → แถวเดิมจะถูกนับใหม่ทั้งหมด → session state เดิมใช้ไม่ได้
+    scorer = LiveScorer(model_path, restore_session=offsets is not None or not LIVE_FROM_START, resume=offsets is not None)
+    offsets = offsets or {}
+    tails, dirty, wake, stop = {}, set(), threading.Event(), threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: (stop.set(), wake.set()))
+
+    # ไฟล์ที่มีอยู่แล้วตอนเริ่ม: ต่อจาก offset ของรอบก่อน, ไม่งั้นอ่านตั้งแต่ต้น (LIVE_FROM_START=1) หรือเริ่มที่ท้ายไฟล์
+    for name in sorted(os.listdir(input_folder)):
+        path = os.path.abspath(os.path.join(input_folder, name))
+        if os.path.isfile(path) and any(fnmatch.fnmatch(name.lower(), p.strip().lower()) for p in LIVE_PATTERNS):
+            tails[path] = FileTail(path, from_start=LIVE_FROM_START, resume=offsets.get(path))
+            dirty.add(path)
+
+    observer = PollingObserver() if LIVE_POLL else Observer()
+    observer.schedule(TailHandler(dirty, wake), input_folder)
+    observer.start()
+    print(f"📡 Live mode: watching {input_folder} ({', '.join(LIVE_PATTERNS)}) | batch={LIVE_BATCH_ROWS} rows / {LIVE_FLUSH_S:g}s")
+    print(f"💾 Appending predictions → {scorer.output_path}")
+
+    pending, pending_rows, oldest = [], 0, None
+    try:
+        while not stop.is_set():
+            wake.wait(timeout=LIVE_FLUSH_S / 2)
+            wake.clear()
+            while dirty:
+                path = dirty.pop()
+                if not os.path.exists(path):
+                    tails.pop(path, None)
+                    continue
+                tail = tails.setdefault(path, FileTail(path))
+                try:
+                    df = tail.read_new()
+                except Exception as e:
+                    print(f"⚠️ Failed to read {os.path.basename(path)} → {e}")
+                    continue
+                if df is not None and len(df):
+                    pending.append(df)
+                    pending_rows += len(df)
+                    oldest = oldest or time.time()
+
+            if pending and (pending_rows >= LIVE_BATCH_ROWS or time.time() - oldest >= LIVE_FLUSH_S):
+                batch = pd.concat(pending, ignore_index=True)
+                for start in range(0, len(batch), LIVE_BATCH_ROWS):
+                    scorer.score(batch.iloc[start:start + LIVE_BATCH_ROWS], oldest)
+                pending, pending_rows, oldest = [], 0, None
+    except KeyboardInterrupt:
+        pass
+    finally:
+        observer.stop()
+        observer.join()
+        if pending:
+            scorer.score(pd.concat(pending, ignore_index=True), oldest)
+        scorer.save_session()
+        save_offsets(tails)
+        print(f"🛑 Live mode stopped: {scorer.stats['total']:,} rows, {scorer.stats['alerts']:,} alert(s) in {scorer.stats['batches']} batch(es)")
@@ -0,0 +1,89 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+# -------------------------------------
+# 📦 MicroBatcher: รวม request เล็ก ๆ เป็น batch เดียวก่อนเข้าโมเดล
+# -------------------------------------
+# request แต่ละตัวส่ง list ของ records เข้ามา แล้วรอผลของตัวเอง
+# thread เบื้องหลังจะรอไม่เกิน wait_ms หรือจนครบ max_rows แล้วเรียก predict_fn ครั้งเดียว
+# prepare_fn(records) → ค่าต่อ record ที่ต้องคำนวณครั้งเดียว (เช่น session window ที่นับ record เข้า state)
+# → predict_fn(records, prepared); batch ล้มแล้ว retry ทีละ request ก็ใช้ค่าเดิม ไม่นับ record ซ้ำ
+class MicroBatcher:
+    def __init__(self, predict_fn, max_rows=256, wait_ms=5, prepare_fn=None):
+        self.predict_fn = predict_fn
+        self.prepare_fn = prepare_fn
+        self.max_rows = max_rows
+        self.wait = wait_ms / 1000.0
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, records):
+        future = Future()
+        self.ensure_started()
+        self.queue.put((records, future))
+        return future.result()
+
+    # start แบบ lazy → แต่ละ process (เช่น worker หลัง fork) ได้ thread ของตัวเอง
+    def ensure_started(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="micro-batcher", daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            rows = len(batch[0][0])
+            deadline = time.monotonic() + self.wait
+            while rows < self.max_rows:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                rows += len(item[0])
+            self.flush(batch)
+
+    def call(self, records, prepared=None):
+        if self.prepare_fn is None:
+            return self.predict_fn(records)
+        if prepared is None:
+            prepared = self.prepare_fn(records)
+        return self.predict_fn(records, prepared)
+
+    def flush(self, batch):
+        records = [r for recs, _ in batch for r in recs]
+        prepared = None
+        try:
+            if self.prepare_fn is not None:
+                prepared = self.prepare_fn(records)
+            predictions = self.call(records, prepared)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # batch ล้ม → ทำทีละ request เพื่อให้ error ตกกับ request ที่ผิดเท่านั้น
+            # prepare สำเร็จแล้ว → ใช้ส่วนของแต่ละ request ต่อ | prepare ล้ม (ไม่แตะ state) → prepare ใหม่ทีละ request
+            offset = 0
+            for recs, future in batch:
+                part = None if prepared is None else prepared[offset:offset + len(recs)]
+                offset += len(recs)
+                try:
+                    future.set_result(self.call(recs, part))
+                except Exception as e:
+                    future.set_exception(e)
+            return
+
+        offset = 0
+        for recs, future in batch:
+            future.set_result(predictions[offset:offset + len(recs)])
+            offset += len(recs)
@@ -1,24 +1,320 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
 import joblib
 import pandas as pd
+import numpy as np
+import hashlib
+import hmac
+import io
 import os
 import time
-from prepare_data import transform_data
+import threading
+from prepare_data import transform_data, load_feature_transformer, transformer_path_for, INPUT_FIELDS
+from micro_batch import MicroBatcher
+from verdict import THRESHOLD, RULES, decide, decide_many
+from verdict_cache import VerdictCache
+from session_features import SESSION_FEATURES
+from serve_metrics import ServeMetrics
 
 app = Flask(__name__)
 
+MODEL_PATH = os.getenv("MODEL_PATH", "data/output/xgboost-model.pkl")
+
+# 🧩 print feature/sample row ทุก request (ปิดใน production ด้วย SERVE_DEBUG=0)
+DEBUG_LOG = os.getenv("SERVE_DEBUG", "1") == "1"
+
+# 🏎 Fast path: record จำนวนน้อย → feature vector ทีละ record โดยไม่ผ่าน pandas
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "1") == "1"
+FAST_PATH_MAX_ROWS = int(os.getenv("FAST_PATH_MAX_ROWS", 32))
+
+# /healthz ตอบ ready หลัง warm_up() เสร็จเท่านั้น
+ready = threading.Event()
+
+# 📊 /metrics (Prometheus)
+metrics = ServeMetrics()
+
+
 # -----------------------------
-# ✅ โหลดโมเดลตอนเริ่ม server
+# ✅ โมเดล + transformer + booster ที่ใช้ตอบ request (1 snapshot ต่อ version)
 # -----------------------------
-MODEL_PATH = "data/output/xgboost-model.pkl"
+# request จับ snapshot ไว้ครั้งเดียวตอนเริ่ม → ระหว่าง reload request ที่ค้างอยู่ใช้โมเดลเดิมจนจบ
+class ServingModel:
+    def __init__(self, model_path):
+        with open(model_path, "rb") as f:
+            raw = f.read()
+        self.path = model_path
+        self.mtime = os.path.getmtime(model_path)
+        self.version = hashlib.sha256(raw).hexdigest()[:12]
+        self.model = joblib.load(io.BytesIO(raw))
+
+        # TF-IDF ที่ fit ไว้ตอน prepare_data → ตอน request ทำแค่ transform
+        self.transformer = load_feature_transformer(model_path)
+        self.transformer_mtime = file_mtime(transformer_path_for(model_path))
+        self.fast_path = FAST_PATH_ENABLED and self.transformer is not None
+        # 🪟 session window ของ request ที่ผ่านมา (อยู่ใน process นี้ → ต้องรัน worker เดียว ดู check_session_workers)
+        self.session = self.transformer.new_session() if self.transformer else None
+        # 🧠 verdict ของ record ที่เคยเห็น — ผูกกับ version นี้ (reload = cache ใหม่) | VERDICT_CACHE_SIZE=0 → None
+        self.verdicts = VerdictCache.create(self.version, self.transformer, RULES.fields)
+
+        # ⚙️ Booster ตรง ๆ (ไม่ผ่าน XGBClassifier.predict)
+        self.booster = self.model.get_booster()
+        nthread = int(os.getenv("BOOSTER_NTHREAD", 0))
+        if nthread:
+            self.booster.set_param({"nthread": nthread})
+        self.n_features = self.booster.num_features()
+        self.loaded_at = time.time()
+
+        print(f"✅ Model loaded successfully. (version={self.version})")
+        print(f"🧭 Model path: {model_path}")
+        print(f"📅 Model last modified: {time.ctime(self.mtime)}")
+
+    def is_stale(self):
+        return (file_mtime(self.path), file_mtime(transformer_path_for(self.path))) != (self.mtime, self.transformer_mtime)
+
+    def info(self):
+        return {
+            "model_path": self.path,
+            "model_version": self.version,
+            "model_mtime": time.ctime(self.mtime),
+            "model_loaded_at": time.ctime(self.loaded_at),
+        }
+
+
+def file_mtime(path):
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+
+# 🪟 session window อยู่ใน memory ของ process → gunicorn N worker = แต่ละตัวเห็น traffic แค่ ~1/N
+# (window ต่ำกว่าตอนเทรน ~N เท่า = train/serve skew เงียบ ๆ) → โมเดลที่ใช้ session feature ต้องมี worker เดียว
+# gunicorn.conf.py บังคับ workers=1 ตอน start และตั้ง worker_count ให้ก่อน fork
+worker_count = 1
+
+def check_session_workers(current):
+    if current.session is not None and worker_count > 1:
+        raise RuntimeError(
+            f"model uses session features (window={current.session.window_s:g}s) but ml-serve runs {worker_count} workers "
+            "→ restart ml-serve so gunicorn starts a single worker"
+        )
+
+
 if not os.path.exists(MODEL_PATH):
     raise FileNotFoundError(f"❌ Model not found: {MODEL_PATH}")
 
-model = joblib.load(MODEL_PATH)
-print("✅ Model loaded successfully.")
-print(f"🧭 Model path: {MODEL_PATH}")
-print(f"📅 Model last modified: {time.ctime(os.path.getmtime(MODEL_PATH))}")
+active = ServingModel(MODEL_PATH)
+metrics.set_model(active.version)
+
+
+# -----------------------------
+# ⚙️ feature buffer ที่จองไว้ล่วงหน้า (แยกต่อ thread)
+# -----------------------------
+_buffers = threading.local()
+
+def feature_buffer(rows, n_features):
+    buf = getattr(_buffers, "array", None)
+    if buf is None or buf.shape[0] < rows or buf.shape[1] != n_features:
+        buf = _buffers.array = np.empty((max(rows, 1), n_features), dtype=np.float32)
+    return buf[:rows]
+
+
+# -----------------------------
+# 🧠 แปลง records → features → prob_1 → verdict (ใช้ทั้งแบบปกติและ micro-batch)
+# -----------------------------
+# 🪟 ค่า session window ของทั้งชุด (นับเข้า state ครั้งเดียว, เรียงตามเวลา, lock ครั้งเดียว) | ไม่ใช้ session → None
+def session_windows(records, current):
+    if current.transformer is None:
+        return None
+    return current.transformer.session_records(records, current.session)
+
+
+# windows: ค่า session window ที่คำนวณไว้แล้ว (verdict cache) ต่อ record → ไม่นับ record ซ้ำเข้า session
+def build_features(records, current, windows=None):
+    x = feature_buffer(len(records), current.n_features)
+    if windows is None:
+        windows = session_windows(records, current)
+    if current.fast_path and len(records) <= FAST_PATH_MAX_ROWS:
+        for i, record in enumerate(records):
+            x[i] = current.transformer.transform_record(record, session_values=None if windows is None else windows[i])
+        return x
+
+    # dtype=object → ค่าจาก JSON ไม่ถูก upcast ตาม record อื่นใน batch (เช่น 443 → 443.0)
+    df = pd.DataFrame(records, dtype=object)
+
+    # 🧠 แปลงฟีเจอร์ให้เหมือนตอนเทรน
+    if current.transformer:
+        session_values = None if windows is None else pd.DataFrame(windows, columns=SESSION_FEATURES)
+        df_transformed = current.transformer.transform(df, mode="predict", session=current.session, session_values=session_values)
+    else:
+        df_transformed = transform_data(df, mode="predict")
+
+    # 🧩 DEBUG LOG: ตรวจว่าข้อมูลส่งเข้าโมเดลเป็นอะไร
+    if DEBUG_LOG:
+        print("\n🧠 [DEBUG] Features passed to model:")
+        print(list(df_transformed.columns))
+        print("\n🧩 [DEBUG] Sample transformed row:")
+        print(df_transformed.head(1).to_dict(orient="records"))
+
+    x[:] = df_transformed.to_numpy(dtype=np.float32)
+    return x
+
+def score_records(records, current, record_metrics=True, windows=None):
+    start = time.perf_counter()
+    x = build_features(records, current, windows)
+    transformed = time.perf_counter()
+    probs = current.booster.inplace_predict(x, validate_features=False)
+    inferred = time.perf_counter()
+    # threshold + whitelist + post-filter เดียวกับ batch (predict.py): request เล็กทีละ record, batch ใหญ่ทั้ง frame
+    if len(records) <= FAST_PATH_MAX_ROWS:
+        verdicts = [decide(record, prob) for record, prob in zip(records, probs)]
+    else:
+        verdicts = decide_many(records, probs)
+    if record_metrics:
+        path = "fast" if current.fast_path and len(records) <= FAST_PATH_MAX_ROWS else "pandas"
+        metrics.observe_batch(path, transformed - start, inferred - transformed, time.perf_counter() - inferred)
+    return verdicts
+
 
+# 🧠 ผ่าน verdict cache: hit → verdict เดิม, miss (ไม่ซ้ำกันใน batch) → score_records แล้วเก็บ
+# session window นับทุก record ก่อน (รวมตัวที่ hit) → ค่า window เป็นส่วนหนึ่งของ key
+# windows: คำนวณไว้แล้ว (micro-batch) → ไม่นับ record เข้า session ซ้ำ
+def predict_records(records, current=None, record_metrics=True, windows=None):
+    current = current or active
+    if windows is None:
+        windows = session_windows(records, current)
+    cache = current.verdicts
+    if cache is None:
+        return score_records(records, current, record_metrics, windows)
+    keys = [cache.record_key(record, None if windows is None else windows[i]) for i, record in enumerate(records)]
+    verdicts = cache.get_many(keys)
+    misses = {}
+    for i, (key, verdict) in enumerate(zip(keys, verdicts)):
+        if verdict is None and key not in misses:
+            misses[key] = i
+    if misses:
+        rows = list(misses.values())
+        computed = score_records([records[i] for i in rows], current, record_metrics, None if windows is None else [windows[i] for i in rows])
+        cache.put_many(misses, computed)
+        by_key = dict(zip(misses, computed))
+        verdicts = [by_key[key] if verdict is None else verdict for key, verdict in zip(keys, verdicts)]
+    if record_metrics:
+        metrics.observe_cache(len(records) - len(misses), len(misses), len(cache))
+    return verdicts
+
+
+# -----------------------------
+# 🔥 Warm-up: ยิง record ตัวอย่างผ่านทั้ง fast path และ pandas path ก่อนรับ traffic
+# -----------------------------
+WARMUP_RECORD = {
+    "@timestamp": "2025-01-01T00:00:00.000Z",
+    "source.ip": "10.0.0.5",
+    "destination.ip": "8.8.8.8",
+    "url.original": "/index.html?warmup=1",
+    "http.response.status_code": 200,
+    "destination.port": 80,
+    "network.protocol": "http",
+    "user_agent.original": "Mozilla/5.0",
+    "http.request.method": "GET",
+    "http.request.referrer": "-",
+    "source.geoip.country_code2": "TH",
+    "destination.geoip.country_code2": "US",
+}
+
+def warm_up(current=None):
+    current = current or active
+    start = time.perf_counter()
+    # ข้าม verdict cache → ได้วิ่งทั้ง fast path และ pandas path จริง
+    score_records([WARMUP_RECORD], current, record_metrics=False)
+    score_records([WARMUP_RECORD] * (FAST_PATH_MAX_ROWS + 1), current, record_metrics=False)
+    # record ตัวอย่างไม่ใช่ traffic จริง → ไม่ให้ค้างอยู่ใน session window
+    if current.session is not None:
+        current.session.clear()
+    ready.set()
+    print(f"🔥 Warm-up done in {time.perf_counter() - start:.2f}s (pid={os.getpid()}, version={current.version})")
+
+
+# -----------------------------
+# 🔁 Hot reload: โหลด + warm-up โมเดลใหม่ให้เสร็จก่อน แล้วค่อยสลับ reference (atomic)
+# -----------------------------
+reload_lock = threading.Lock()
+reload_status = {"reloads": 0, "last_reload_error": None}
+
+def reload_model(force=False, reason="manual"):
+    global active
+    with reload_lock:
+        if not force and not active.is_stale():
+            return False
+        try:
+            candidate = ServingModel(MODEL_PATH)
+            # โมเดลเดิมไม่มี session แต่ตัวใหม่มี → หลาย worker ใช้ไม่ได้ ต้อง restart
+            check_session_workers(candidate)
+            warm_up(candidate)
+            # window เท่าเดิม → ใช้ state เดิมต่อ (โมเดลใหม่ไม่ต้องเริ่มนับ request จากศูนย์)
+            if candidate.session is not None and active.session is not None and candidate.session.window_s == active.session.window_s:
+                candidate.session = active.session
+        except Exception as e:
+            # ไฟล์ใหม่เสีย/เขียนไม่เสร็จ → ใช้โมเดลเดิมต่อไป
+            reload_status["last_reload_error"] = f"{type(e).__name__}: {e}"
+            print(f"❌ [RELOAD] {reason}: keeping version {active.version} → {e}")
+            return False
+        previous, active = active, candidate
+        reload_status["reloads"] += 1
+        metrics.set_model(active.version, reloaded=True)
+        reload_status["last_reload_error"] = None
+        print(f"🔁 [RELOAD] {reason}: {previous.version} → {active.version} (pid={os.getpid()})")
+        return True
+
+
+# 👀 watcher บนโฟลเดอร์โมเดล: รอให้ไฟล์นิ่ง MODEL_RELOAD_DEBOUNCE_S วินาทีก่อน reload
+class ModelFileHandler(FileSystemEventHandler):
+    def __init__(self, paths, debounce_s):
+        self.paths = {os.path.abspath(p) for p in paths}
+        self.debounce_s = debounce_s
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def on_any_event(self, event):
+        touched = {os.path.abspath(p) for p in (event.src_path, getattr(event, "dest_path", "")) if p}
+        if not touched & self.paths:
+            return
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+            self.timer = threading.Timer(self.debounce_s, reload_model, kwargs={"reason": "file watcher"})
+            self.timer.daemon = True
+            self.timer.start()
+
+
+observer = None
+
+# start หลัง fork (แต่ละ worker มี thread ของตัวเอง)
+def start_model_watcher():
+    global observer
+    if observer is not None or os.getenv("MODEL_WATCH_ENABLED", "1") != "1":
+        return
+    handler = ModelFileHandler(
+        [MODEL_PATH, transformer_path_for(MODEL_PATH)],
+        debounce_s=float(os.getenv("MODEL_RELOAD_DEBOUNCE_S", 2)),
+    )
+    observer = Observer()
+    observer.daemon = True
+    observer.schedule(handler, os.path.dirname(os.path.abspath(MODEL_PATH)))
+    observer.start()
+    print(f"👀 Watching {MODEL_PATH} for new models (pid={os.getpid()})")
+
+
+# -----------------------------
+# 📦 Micro-batching (optional): รวม request ภายใน MICRO_BATCH_WAIT_MS หรือจนครบ MICRO_BATCH_MAX_ROWS
+# -----------------------------
+batcher = None
+if os.getenv("MICRO_BATCH_ENABLED", "0") == "1":
+    # session window ของทั้ง batch นับครั้งเดียวก่อน score → retry ทีละ request ไม่นับ record ซ้ำ
+    batcher = MicroBatcher(
+        lambda records, windows: predict_records(records, windows=windows),
+        prepare_fn=lambda records: session_windows(records, active),
+        max_rows=int(os.getenv("MICRO_BATCH_MAX_ROWS", 256)),
+        wait_ms=float(os.getenv("MICRO_BATCH_WAIT_MS", 5)),
+    )
+    print(f"📦 Micro-batching enabled: max_rows={batcher.max_rows}, wait_ms={batcher.wait * 1000:g}")
 
 
 # -----------------------------
@@ -26,34 +322,34 @@ print(f"📅 Model last modified: {time.ctime(os.path.getmtime(MODEL_PATH))}")
 # -----------------------------
 @app.route("/predict", methods=["POST"])
 def predict():
+    start = time.perf_counter()
+    parse_s = 0.0
     try:
         data = request.get_json()
+        parse_s = time.perf_counter() - start
 
         # รองรับทั้ง JSON object และ list
         if isinstance(data, dict):
-            df = pd.DataFrame([data])
+            records = [data]
         elif isinstance(data, list):
-            df = pd.DataFrame(data)
+            records = data
         else:
+            metrics.observe_request("400", parse_s, time.perf_counter() - start)
             return jsonify({"error": "Invalid input format (must be JSON object or array)"}), 400
 
-        # 🧠 แปลงฟีเจอร์ให้เหมือนตอนเทรน
-        df_transformed = transform_data(df)
+        # record ที่ขาด field ต้อง error เหมือนเดิม แม้ถูกรวม batch กับ record อื่นที่มีครบ
+        for record in records:
+            missing = [f for f in INPUT_FIELDS if f not in record]
+            if missing:
+                raise KeyError(missing[0])
 
-        # ✅ ลบ label ออกถ้ามี (กัน feature mismatch)
-        if "label" in df_transformed.columns:
-            df_transformed = df_transformed.drop(columns=["label"])
-
-        # 🧩 DEBUG LOG: ตรวจว่าข้อมูลส่งเข้าโมเดลเป็นอะไร
-        print("\n🧠 [DEBUG] Features passed to model:")
-        print(list(df_transformed.columns))
-        print("\n🧩 [DEBUG] Sample transformed row:")
-        print(df_transformed.head(1).to_dict(orient="records"))
-
-
-        # 🔮 Predict
-        predictions = model.predict(df_transformed)
-        result = predictions.tolist()
+        # JSON object เดียวบน fast path เร็วพอแล้ว ไม่ต้องรอ batch
+        current = active
+        if batcher and not (current.fast_path and isinstance(data, dict)):
+            verdicts = batcher.submit(records)
+        else:
+            verdicts = predict_records(records, current)
+        result = [v["prediction"] for v in verdicts]
 
         # 🧾 แปลงเป็นข้อความอ่านง่าย
         label_map = {0: "Normal", 1: "Malicious"}
@@ -63,16 +359,50 @@ def predict():
         if len(readable_results) == 1:
             readable_results = readable_results[0]
 
+        metrics.observe_request(
+            "200", parse_s, time.perf_counter() - start,
+            rows=len(verdicts), alerts=sum(result), whitelist=sum(bool(v["is_whitelist"]) for v in verdicts),
+        )
         return jsonify({
             "prediction": result,
+            "prob_1": [v["prob_1"] for v in verdicts],
+            "is_whitelist": [v["is_whitelist"] for v in verdicts],
+            "threshold": THRESHOLD,
             "label": readable_results
         })
 
     except Exception as e:
         print("❌ [ERROR]", str(e))
+        metrics.observe_request("500", parse_s, time.perf_counter() - start)
         return jsonify({"error": str(e)}), 500
 
 
+# -----------------------------
+# 📊 Prometheus scrape (รวมทุก gunicorn worker ถ้าตั้ง SERVE_METRICS_DIR)
+# -----------------------------
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+# -----------------------------
+# 🛠 Admin: สั่ง reload เอง (เฉพาะ worker ที่รับ request นี้ — worker อื่นพึ่ง file watcher)
+# -----------------------------
+@app.route("/admin/reload-model", methods=["POST"])
+def admin_reload_model():
+    # ไม่ตั้ง ADMIN_TOKEN → ปิด endpoint (port 8000 เปิดออกนอก container ใครก็ยิงได้)
+    token = os.getenv("ADMIN_TOKEN")
+    if not token:
+        return jsonify({"error": "Admin endpoint disabled (ADMIN_TOKEN not set)"}), 404
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", "").encode(), token.encode()):
+        return jsonify({"error": "Unauthorized"}), 401
+
+    force = request.args.get("force", "0") == "1"
+    reloaded = reload_model(force=force, reason="admin endpoint")
+    status = 200 if reloaded or reload_status["last_reload_error"] is None else 500
+    return jsonify({"reloaded": reloaded, "pid": os.getpid(), **active.info(), **reload_status}), status
+
+
 # -----------------------------
 # 🏠 Health Check
 # -----------------------------
@@ -81,6 +411,22 @@ def home():
     return jsonify({"message": "🚀 ML Serve API is running"})
 
 
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    status = {
+        "status": "ready" if ready.is_set() else "warming_up",
+        "pid": os.getpid(),
+        **active.info(),
+        **reload_status,
+        "verdict_cache": active.verdicts.stats() if active.verdicts else None,
+    }
+    return jsonify(status), 200 if ready.is_set() else 503
+
+
 
+# 🧪 dev server: python ml-serve.py | production: gunicorn -c gunicorn.conf.py wsgi:app
 if __name__ == "__main__":
+    warm_up()
+    start_model_watcher()
+    metrics.start_flusher()
     app.run(host="0.0.0.0", port=8000)
@@ -0,0 +1,221 @@
+import os, sys, json, time, hashlib
+import numpy as np
+import joblib
+import xgboost as xgb
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import train_test_split
+from artifacts import find_artifact, read_artifact
+from prepare_data import TRANSFORMER_FILENAME, enforce_feature_schema, load_feature_transformer
+from stage_metrics import stage, start_run, finish_run
+
+# -------------------------------------
+# ✂️ Model compaction: ฟีเจอร์ + ต้นไม้ที่น้อยที่สุดที่ accuracy ลดไม่เกิน COMPACT_TOLERANCE_PCT
+# -------------------------------------
+# 1️⃣ เทรน baseline บน fit split (training set หัก VALIDATION_PCT) → เรียงฟีเจอร์ตาม gain (COMPACT_IMPORTANCE)
+# 2️⃣ ทิ้งฟีเจอร์ซ้ำซ้อน (ค่าเท่ากัน / complement กันทุกแถว เช่น dst_is_public_ip) และฟีเจอร์ที่ไม่เคยถูกใช้ split
+# 3️⃣ binary search จำนวนฟีเจอร์ top-k ที่น้อยที่สุด (เทรนใหม่ทุกครั้ง) → แล้วจำนวนต้นไม้ (booster[:n], ไม่ต้องเทรน)
+# 4️⃣ เทรนใหม่บน training set เต็มด้วยฟีเจอร์/ต้นไม้ที่เลือก → guard กับ test set เทียบโมเดลเดิม
+# ผ่าน → xgboost-model.pkl + feature-transformer.pkl (prune แล้ว) ลง COMPACT_OUTPUT_DIR
+#   ชี้ MODEL_PATH ของ ml-serve / predict มาที่นี่ → transform คำนวณเฉพาะฟีเจอร์ที่โมเดลใช้
+# โมเดลเต็มใน output folder ไม่ถูกแตะ (incremental_retrain ยังใช้ training-set แบบครบคอลัมน์ได้)
+COMPACT_TOLERANCE_PCT = float(os.getenv("COMPACT_TOLERANCE_PCT", 0.5))
+COMPACT_IMPORTANCE = os.getenv("COMPACT_IMPORTANCE", "total_gain")
+COMPACT_REPORT_FILENAME = "compaction-report.json"
+# โมเดลที่ load_model มา (cached / quantile / search) get_params() ติดค่าที่ได้จากข้อมูลมาด้วย → เทรนใหม่ต้องคำนวณเอง
+DATA_BOUND_PARAMS = {"n_estimators", "feature_types", "feature_names", "base_score"}
+
+
+def rank_features(booster, importance_type):
+    scores = booster.get_score(importance_type=importance_type)
+    return sorted(((name, float(scores.get(name, 0.0))) for name in booster.feature_names), key=lambda item: -item[1])
+
+
+# flag (2 ค่า) → mask เทียบกับค่าแถวแรก: ฟีเจอร์ที่เป็น complement กันได้ signature เดียวกัน
+def value_signature(values):
+    values = np.asarray(values, dtype=np.float64)
+    if len(values):
+        differs = values != values[0]
+        if not differs.any() or (values[differs] == values[differs][0]).all():
+            values = ~differs
+    return hashlib.sha256(np.ascontiguousarray(values).tobytes()).hexdigest()
+
+
+# {ฟีเจอร์ที่ทิ้ง: ฟีเจอร์ที่เก็บไว้แทน} — เก็บตัวที่ gain สูงกว่า (ranked เรียงมาแล้ว)
+def redundant_features(df, ranked):
+    seen, redundant = {}, {}
+    for name, _ in ranked:
+        key = value_signature(df[name].to_numpy())
+        if key in seen:
+            redundant[name] = seen[key]
+        else:
+            seen[key] = name
+    return redundant
+
+
+def fit_model(params, x, y, n_estimators):
+    model = xgb.XGBClassifier(**{**params, "n_estimators": n_estimators})
+    model.fit(x, y)
+    return model
+
+
+def accuracy(model, x, y, n_trees=None):
+    return accuracy_score(y, model.predict(x, iteration_range=(0, n_trees) if n_trees else None))
+
+
+# ค่าที่น้อยที่สุดใน [lo, hi] ที่ passes() ผ่าน (passes(hi) ต้องผ่าน, accuracy โดยประมาณเพิ่มตามค่า)
+def smallest_passing(lo, hi, passes):
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if passes(mid):
+            hi = mid
+        else:
+            lo = mid + 1
+    return hi
+
+
+def rows_per_second(model, x, repeat=3):
+    booster, data = model.get_booster(), x.to_numpy(dtype=np.float32)
+    best = min(timed(lambda: booster.inplace_predict(data, validate_features=False)) for _ in range(repeat))
+    return len(x) / best if best > 0 else None
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def save_atomic(obj, path):
+    joblib.dump(obj, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+# -------------------------------------
+# 🚀 compaction ของโมเดลใน output folder → report (dict) + ไฟล์ใน COMPACT_OUTPUT_DIR ถ้าผ่าน guard
+# -------------------------------------
+def compact_model(output_folder, tolerance_pct=COMPACT_TOLERANCE_PCT, importance_type=COMPACT_IMPORTANCE, validation_pct=None):
+    start_time = time.time()
+    validation_pct = validation_pct or int(os.getenv("VALIDATION_PCT", 20))
+    compact_dir = os.getenv("COMPACT_OUTPUT_DIR") or os.path.join(output_folder, "compact")
+    model_path = os.path.join(output_folder, "xgboost-model.pkl")
+    train_file = find_artifact(output_folder, "training-set")
+    test_file = find_artifact(output_folder, "testing-set")
+    transformer = load_feature_transformer(model_path) if os.path.exists(model_path) else None
+    if not train_file or not test_file or transformer is None:
+        sys.exit("❌ Compaction ต้องมี xgboost-model.pkl, feature-transformer.pkl และ training/testing-set — รัน training ก่อน")
+
+    original = joblib.load(model_path)
+    params = {k: v for k, v in original.get_params().items() if v is not None and k not in DATA_BOUND_PARAMS}
+    rounds = original.get_booster().num_boosted_rounds()
+    tolerance = tolerance_pct / 100
+
+    with stage("compact.load") as info:
+        df_train = enforce_feature_schema(read_artifact(train_file))
+        df_test = enforce_feature_schema(read_artifact(test_file))
+        info["rows"] = len(df_train) + len(df_test)
+    features = [c for c in df_train.columns if c != "label"]
+    x_test, y_test = df_test[features], df_test["label"]
+    original_acc = accuracy(original, x_test, y_test)
+    print(f"✂️ Compacting {len(features)} feature(s) x {rounds} tree(s) | test accuracy {original_acc * 100:.2f}% "
+          f"| tolerance {tolerance_pct:.2f} pts on {validation_pct}% validation")
+
+    fit, valid = train_test_split(df_train, test_size=validation_pct / 100, random_state=params.get("random_state", 42), stratify=df_train["label"])
+    x_fit, y_fit, x_valid, y_valid = fit[features], fit["label"], valid[features], valid["label"]
+
+    # 1️⃣ baseline บน split เดียวกับ candidate → ranking + เกณฑ์ขั้นต่ำ
+    with stage("compact.baseline", rows=len(fit)):
+        baseline = fit_model(params, x_fit, y_fit, rounds)
+        baseline_acc = accuracy(baseline, x_valid, y_valid)
+    floor = baseline_acc - tolerance
+    ranked = rank_features(baseline.get_booster(), importance_type)
+    print(f"📏 Baseline validation accuracy {baseline_acc * 100:.2f}% → floor {floor * 100:.2f}%")
+
+    # 2️⃣ ตัวซ้ำ / ไม่ถูกใช้ → ทิ้งก่อนเลย
+    redundant = redundant_features(x_fit, ranked)
+    candidates = [name for name, gain in ranked if gain > 0 and name not in redundant] or [ranked[0][0]]
+    for name, same_as in redundant.items():
+        print(f"   ♻️ {name}: same split as {same_as} → drop")
+
+    # 3️⃣ top-k ที่น้อยที่สุด
+    trials = {}
+
+    def passes_features(k):
+        if k not in trials:
+            model = fit_model(params, x_fit[candidates[:k]], y_fit, rounds)
+            trials[k] = (model, accuracy(model, x_valid[candidates[:k]], y_valid))
+            print(f"   ↳ top {k:>2} feature(s) → validation accuracy {trials[k][1] * 100:.2f}%")
+        return trials[k][1] >= floor
+
+    with stage("compact.features"):
+        if passes_features(len(candidates)):
+            k = smallest_passing(1, len(candidates), passes_features)
+        else:
+            # ทิ้งแค่ตัวซ้ำ/ไม่ใช้ก็ยังต่ำกว่า floor (random ของ hist) → คงทุกฟีเจอร์ ตัดแค่ต้นไม้
+            candidates, k = [name for name, _ in ranked], len(ranked)
+            trials[k] = (baseline, baseline_acc)
+    chosen, chosen_acc = trials[k]
+    kept = candidates[:k]
+
+    # 4️⃣ จำนวนต้นไม้ที่น้อยที่สุดของโมเดลที่เลือก
+    with stage("compact.trees"):
+        n_trees = smallest_passing(1, rounds, lambda n: accuracy(chosen, x_valid[kept], y_valid, n) >= floor)
+    print(f"🌲 Trees: {rounds} → {n_trees}")
+
+    # 5️⃣ เทรนใหม่บน training set เต็ม — ลำดับคอลัมน์ต้องตรงกับที่ transformer ที่ prune แล้วออก (transformer.all_columns)
+    kept = set(kept)
+    kept = [c for c in features if c in kept]
+    with stage("compact.retrain", rows=len(df_train)):
+        compact = fit_model(params, df_train[kept], df_train["label"], n_trees)
+    compact_acc = accuracy(compact, x_test[kept], y_test)
+    accepted = compact_acc >= original_acc - tolerance
+
+    report = {
+        "accepted": accepted,
+        "tolerance_pct": tolerance_pct,
+        "importance_type": importance_type,
+        "validation_pct": validation_pct,
+        "original": {"features": len(features), "trees": rounds, "test_accuracy": round(original_acc, 6),
+                     "rows_per_s": rows_per_second(original, x_test)},
+        "compact": {"features": len(kept), "trees": n_trees, "test_accuracy": round(compact_acc, 6),
+                    "validation_accuracy": round(chosen_acc, 6), "rows_per_s": rows_per_second(compact, x_test[kept])},
+        "baseline_validation_accuracy": round(baseline_acc, 6),
+        "kept": kept,
+        "dropped": [
+            {"feature": name, "gain": gain,
+             "reason": "redundant" if name in redundant else "unused" if gain == 0 else "low_gain",
+             **({"same_as": redundant[name]} if name in redundant else {})}
+            for name, gain in ranked if name not in kept
+        ],
+        "ranking": [{"feature": name, "gain": gain} for name, gain in ranked],
+        "feature_trials": [{"features": n, "validation_accuracy": round(acc, 6)} for n, (_, acc) in sorted(trials.items())],
+        "output_dir": compact_dir if accepted else None,
+        "seconds": round(time.time() - start_time, 3),
+    }
+    report_path = os.path.join(output_folder, COMPACT_REPORT_FILENAME)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"📦 {len(features)} → {len(kept)} feature(s), {rounds} → {n_trees} tree(s) | "
+          f"test accuracy {original_acc * 100:.2f}% → {compact_acc * 100:.2f}%")
+    print(f"🧾 Compaction report saved → {report_path}")
+    if not accepted:
+        print(f"❌ Rejected: accuracy dropped more than {tolerance_pct:.2f} pts — compact model not written")
+        return report
+
+    # ml-serve watch ทั้งสองไฟล์ + debounce → reload ครั้งเดียวหลังเขียนครบคู่
+    os.makedirs(compact_dir, exist_ok=True)
+    transformer.prune(kept).save(os.path.join(compact_dir, TRANSFORMER_FILENAME))
+    compact_path = os.path.join(compact_dir, "xgboost-model.pkl")
+    save_atomic(compact, compact_path)
+    print(f"💾 Compact model saved → {compact_path}")
+    return report
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("วิธีใช้: python model_compaction.py <output_folder>")
+        sys.exit(1)
+    start_run("compaction", sys.argv[1])
+    result = compact_model(sys.argv[1])
+    finish_run(accepted=result["accepted"], features=result["compact"]["features"], trees=result["compact"]["trees"],
+               test_accuracy=result["compact"]["test_accuracy"])
@@ -1,112 +1,214 @@
-import os, sys, glob, time, datetime, shutil, ipaddress
+import os, sys, time, datetime, shutil, itertools
+import numpy as np
 import pandas as pd
 import joblib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from minio import Minio
 from sklearn.metrics import classification_report, accuracy_score
 from jinja2 import Environment, FileSystemLoader
-from prepare_data import transform_data
+from prepare_data import INPUT_FIELDS, transform_data, load_feature_transformer
+from verdict import THRESHOLD, whitelist_mask, filter_predictions
+from artifacts import ArtifactWriter, artifact_path, find_artifact, write_artifact, concat_artifacts
+from feature_cache import file_sha256, open_feature_cache, transformer_fingerprint
+from verdict_cache import VerdictCache
+from zeek_logs import list_inputs, read_input, iter_input
+from stage_metrics import stage, start_run, finish_run, clear_run
 
 # Global Path Settings
 BASE_OUTPUT_DIR = os.getenv("OUTPUT_DIR", "data/output")
 os.makedirs(BASE_OUTPUT_DIR, exist_ok=True)
 
-# ค้นหา CSV ล่าสุด
+# 🗄 feature ของไฟล์ที่เคย transform แล้ว (เช่น predict ซ้ำหลังเปลี่ยนโมเดล) อ่านจาก cache แทน
+# key = hash ไฟล์ + transformer + chunk → field ดิบยังอ่านจาก CSV เสมอ (whitelist/post-filter ใช้ค่าดิบ)
+# ใช้ร่วมกับ verdict cache ได้: block เก็บ feature ของ record ไม่ซ้ำใน chunk → record ที่ verdict cache miss อ่านจาก block
+FEATURE_CACHE = open_feature_cache(BASE_OUTPUT_DIR)
+
+# schema ของ predict_result / whitelist_filtered ตอนเป็น Parquet: คอลัมน์จาก pipeline มี type, field ดิบเป็น text
+# (คงที่ทุก chunk/ทุกไฟล์ → ต่อ row group ได้ตรง ๆ)
+RESULT_DTYPES = {"ioc.dest_ip_misp_is_alert": "Int8", "prob_1": "float32", "prediction": "int8", "is_whitelist": "bool"}
+
+# Zeek log (TSV/JSON/.gz) ถูก map เป็นคอลัมน์เหล่านี้ตอนอ่าน, CSV/Parquet export อ่านทุกคอลัมน์เหมือนเดิม
+KEEP_FIELDS = INPUT_FIELDS + ["ioc.dest_ip_misp_is_alert"]
+
+# ค้นหา input ล่าสุด (CSV / Parquet / Zeek log)
 def get_latest_csv(input_folder):
-    csv_files = glob.glob(os.path.join(input_folder, "*.csv")) + glob.glob(os.path.join(input_folder, "*.CSV"))
+    csv_files = list_inputs(input_folder)
     if not csv_files:
-        sys.exit(f"❌ No CSV files found in input folder: {input_folder}")
+        sys.exit(f"❌ No input files (CSV / Zeek log) found in input folder: {input_folder}")
     latest = max(csv_files, key=os.path.getmtime)
     print(f"🕒 Latest CSV selected: {os.path.basename(latest)}")
     return latest
 
-# โหลดข้อมูล + เตรียมฟีเจอร์
-def load_and_prepare_data(latest_csv):
+# transform ผ่าน feature cache (file_hash=None → ไม่ใช้ cache)
+# session (SessionStore ของไฟล์นี้) → session window ต่อเนื่องข้าม chunk
+def transform_cached(df, transformer, file_hash=None, chunk_size=0, chunk_index=0, session=None):
+    computed = []
+    def compute():
+        computed.append(True)
+        return transformer.transform(df, session=session) if transformer else transform_data(df)
+    if FEATURE_CACHE is None or file_hash is None:
+        return compute()
+    key = FEATURE_CACHE.key("predict", file_hash, transformer_fingerprint(transformer), chunk_size, chunk_index)
+    df_clean = FEATURE_CACHE.get_or_compute(key, compute)
+    # cache hit ข้าม transform → ยังต้องนับ chunk นี้เข้า window ไม่งั้น chunk ถัดไปได้ค่าต่างจากรอบแรก
+    if session is not None and not computed:
+        session.update_frame(df)
+    return df_clean
+
+def input_hash(csv_path):
+    return file_sha256(csv_path) if FEATURE_CACHE is not None else None
+
+# 🧠 verdict cache ต่อ process (โมเดลเดียวตลอดการรัน): เก็บเฉพาะ prob_1 — whitelist/post-filter ยังรันทั้ง frame ตามเดิม
+# → key ไม่ต้องรวม field ของ rule, record ที่ซ้ำกัน (ในไฟล์เดียวกันหรือข้ามไฟล์/chunk) transform + predict ครั้งเดียว
+def open_verdict_cache(model_path, transformer):
+    return VerdictCache.create(os.path.basename(model_path), transformer)
+
+# feature ของ record ที่ verdict cache miss (first = แถวแรกของแต่ละ key ไม่ซ้ำใน chunk, เรียงตาม key)
+# file_hash → block = feature ของ record ไม่ซ้ำ "ทั้ง chunk" (ไม่ขึ้นกับว่า verdict cache มีอะไรอยู่แล้ว)
+# → รอบแรก transform เกินกว่า miss แค่ record ที่ hit จาก chunk/ไฟล์ก่อน, รอบหน้า (เช่นเปลี่ยนโมเดล) ไม่ต้อง transform เลย
+def transform_unique(df, transformer, windows, first, missing, file_hash=None, chunk_size=0, chunk_index=0):
+    def compute(rows):
+        return transformer.transform(df.iloc[rows], mode="predict", session_values=None if windows is None else windows.iloc[rows])
+    if FEATURE_CACHE is None or file_hash is None:
+        return compute(first[missing])
+    key = FEATURE_CACHE.key("predict-unique", file_hash, transformer_fingerprint(transformer), chunk_size, chunk_index)
+    block = FEATURE_CACHE.get(key)
+    if block is None or len(block) != len(first):
+        block = FEATURE_CACHE.put(key, compute(first))
+    return block[missing]
+
+# transform + predict_proba เฉพาะ record ที่ไม่ซ้ำและไม่อยู่ใน cache → (prob_1 ทุกแถว, y_true, labeled, เวลา predict)
+# session window คำนวณจากทุกแถวก่อน (ค่า window ของแต่ละแถวเป็นส่วนหนึ่งของ key) → block ใน feature cache ไม่ต้องนับ window ซ้ำ
+def predict_probs_cached(model, transformer, df, cache, session=None, file_hash=None, chunk_size=0, chunk_index=0):
+    windows = transformer.session_frame(df, session)
+    unique, first, inverse = np.unique(cache.frame_keys(df, windows), return_index=True, return_inverse=True)
+    cached = cache.get_many(unique.tolist())
+    missing = np.array([p is None for p in cached], dtype=bool)
+    probs = np.array([0.0 if p is None else p for p in cached], dtype=np.float32)
+    duration = 0.0
+    if missing.any():
+        x_data = transform_unique(df, transformer, windows, first, missing, file_hash, chunk_size, chunk_index)
+        start = time.time()
+        probs[missing] = model.predict_proba(x_data)[:, 1]
+        duration = time.time() - start
+        cache.put_many(unique[missing].tolist(), probs[missing].tolist())
+    labeled = "ioc.dest_ip_misp_is_alert" in df.columns
+    y_true = df["ioc.dest_ip_misp_is_alert"].fillna(0).astype(int) if labeled else None
+    return probs[inverse.reshape(-1)], y_true, labeled, duration
+
+# โหลดข้อมูล + เตรียมฟีเจอร์ (verdicts → transform เฉพาะ record ที่ไม่ซ้ำตอน score แทน, df_clean = None)
+# → (df, df_clean, file_hash)
+def load_and_prepare_data(latest_csv, transformer=None, verdicts=None):
     print(f"📥 Loading: {latest_csv}")
-    df = pd.read_csv(latest_csv, on_bad_lines='skip')
+    with stage("load") as info:
+        df = read_input(latest_csv, KEEP_FIELDS, on_bad_lines='skip')
+        info["rows"] = len(df)
     print(f"🔢 Total rows: {len(df)}")
+    file_hash = input_hash(latest_csv)
+    if verdicts is not None:
+        return df, None, file_hash
     print("🧹 Transforming features ...")
-    df_clean = transform_data(df)
-    return df, df_clean
-
-# พยากรณ์และสร้างรายงาน
-def run_prediction(model_path, df, df_clean):
-    print("🤖 Loading trained model ...")
-    model = joblib.load(model_path)
+    with stage("transform", rows=len(df)):
+        df_clean = transform_cached(df, transformer, file_hash)
+    if FEATURE_CACHE is not None:
+        print(FEATURE_CACHE.summary())
+    return df, df_clean, file_hash
 
+# แยก features / label
+def split_features(df_clean):
     if "label" in df_clean.columns:
-        x_data = df_clean.drop(columns=["label"])
-        y_true = df_clean["label"]
-        labeled = True
-    else:
-        x_data = df_clean
-        y_true = None
-        labeled = False
-        print("⚠️ No 'label' column found — running in unlabeled mode.")
+        return df_clean.drop(columns=["label"]), df_clean["label"], True
+    return df_clean, None, False
 
-    # Predict with probability threshold
-    print("🔮 Predicting with probability threshold ...")
+# predict_proba + threshold + whitelist flag (ใช้ทั้งโหมดปกติและ streaming)
+# เพิ่มคอลัมน์ผลลัพธ์ลงใน df โดยตรง (ไม่ copy ทั้ง frame) | probs → prob_1 ที่ได้มาแล้ว (verdict cache)
+def score_frame(model, df, x_data, probs=None):
     start = time.time()
-    probs = model.predict_proba(x_data)
-    THRESHOLD = 0.65
-    y_pred = (probs[:, 1] >= THRESHOLD).astype(int)
+    if probs is None:
+        probs = model.predict_proba(x_data)[:, 1]
+    y_pred = (probs >= THRESHOLD).astype(int)
     duration = time.time() - start
 
-    df_result = df.copy()
-    df_result["prob_1"] = probs[:, 1]
+    df_result = df
+    df_result["prob_1"] = probs
     df_result["prediction"] = y_pred
+    df_result["is_whitelist"] = whitelist_mask(df_result)
+    return df_result, y_pred, duration
 
-    # Whitelist Filtering
-    def is_internal_ip(ip):
-        try: return ipaddress.ip_address(ip).is_private
-        except: return False
-
-    def is_whitelisted(row):
-        ua = str(row.get("user_agent.original", "")).lower()
-        url = str(row.get("url.original", "")).lower()
-        src_ip = str(row.get("source.ip", ""))
-        dest_ip = str(row.get("destination.ip", ""))
-        status = str(row.get("http.response.status_code", ""))
-
-        ms_keywords = ["msftconnecttest", "microsoft", "windows update", "cryptoapi", "windowsupdate", "officecdn", "outlook", "onenote", "onedrive", "bingbot", "defender", "edge"]
-        safe_domains = ["microsoft.com", "windows.com", "office.com", "msedge.net", "live.com", "bing.com", "skype.com", "update.microsoft.com", "google.com", "youtube.com", "apple.com", "icloud.com", "cloudflare.com", "akamai.net"]
-
-        if any(k in ua for k in ms_keywords) or any(d in url for d in safe_domains):
-            if is_internal_ip(src_ip) or status.startswith("20") or "http" in url:
-                return True
-        if any(k in ua for k in ["mozilla", "chrome", "safari", "applewebkit"]):
-            if is_internal_ip(src_ip): return True
-        return False
-
-    df_result["is_whitelist"] = df_result.apply(is_whitelisted, axis=1)
-    whitelist_count = df_result["is_whitelist"].sum()
+# whitelist → Normal แล้วตามด้วย post-filter (rule ทั้ง frame จาก rules.json)
+def apply_filters(df_result):
+    df_result["prediction"] = filter_predictions(df_result, df_result["prediction"].to_numpy(), df_result["is_whitelist"].to_numpy(dtype=bool))
+    return df_result
+
+# แปลง classification_report เป็น HTML (ปัดเป็น %)
+def report_to_html(report_dict):
+    for lbl, metrics in report_dict.items():
+        if isinstance(metrics, dict):
+            for k, v in metrics.items():
+                metrics[k] = round(v * 100, 2) if k != "support" else int(v)
+    df_report = pd.DataFrame(report_dict).transpose()
+    return df_report.to_html(classes="table table-striped table-bordered", border=0)
+
+# classification_report(output_dict=True) จาก confusion counts สะสม — ไม่ต้องเก็บ y ทั้งไฟล์
+def report_from_confusion(confusion):
+    labels = sorted({t for t, _ in confusion} | {p for _, p in confusion})
+    total = sum(confusion.values())
+    report = {}
+    for lbl in labels:
+        tp = confusion.get((lbl, lbl), 0)
+        support = sum(n for (t, _), n in confusion.items() if t == lbl)
+        predicted = sum(n for (_, p), n in confusion.items() if p == lbl)
+        precision = tp / predicted if predicted else 0.0
+        recall = tp / support if support else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        report[str(lbl)] = {"precision": precision, "recall": recall, "f1-score": f1, "support": support}
+    per_label = [report[str(lbl)] for lbl in labels]
+    report["accuracy"] = sum(confusion.get((lbl, lbl), 0) for lbl in labels) / total if total else 0.0
+    report["macro avg"] = {k: sum(m[k] for m in per_label) / len(per_label) for k in ["precision", "recall", "f1-score"]}
+    report["macro avg"]["support"] = total
+    report["weighted avg"] = {k: sum(m[k] * m["support"] for m in per_label) / total for k in ["precision", "recall", "f1-score"]}
+    report["weighted avg"]["support"] = total
+    return report
+
+# พยากรณ์และสร้างรายงาน
+def run_prediction(model_path, df, df_clean, transformer=None, verdicts=None, file_hash=None):
+    print("🤖 Loading trained model ...")
+    with stage("load_model"):
+        model = joblib.load(model_path)
+
+    # Predict with probability threshold
+    print("🔮 Predicting with probability threshold ...")
+    if verdicts is not None:
+        print("🧹 Transforming features (unique records only) ...")
+        with stage("score", rows=len(df)):
+            probs, y_true, labeled, duration = predict_probs_cached(model, transformer, df, verdicts, file_hash=file_hash)
+            df_result, y_pred, threshold_s = score_frame(model, df, None, probs)
+            duration += threshold_s
+        print(verdicts.summary())
+        if FEATURE_CACHE is not None:
+            print(FEATURE_CACHE.summary())
+    else:
+        x_data, y_true, labeled = split_features(df_clean)
+        with stage("score", rows=len(df)):
+            df_result, y_pred, duration = score_frame(model, df, x_data)
+    if not labeled:
+        print("⚠️ No 'label' column found — running in unlabeled mode.")
 
+    whitelist_count = df_result["is_whitelist"].sum()
     if whitelist_count > 0:
         print(f"🧩 Found {whitelist_count} whitelisted benign logs (Microsoft/System).")
-        whitelist_path = os.path.join(BASE_OUTPUT_DIR, "whitelist_filtered.csv")
-        df_result[df_result["is_whitelist"] == True].to_csv(whitelist_path, index=False)
+        whitelist_path = artifact_path(BASE_OUTPUT_DIR, "whitelist_filtered")
+        with stage("write_whitelist", rows=int(whitelist_count)):
+            write_artifact(df_result[df_result["is_whitelist"] == True], whitelist_path, RESULT_DTYPES, text_default=True)
         print(f"💾 Whitelist entries saved → {whitelist_path}")
-        df_result.loc[df_result["is_whitelist"] == True, "prediction"] = 0
-
-    # Post-filter ลด False Positive เพิ่มเติม
-    def post_filter(row, pred):
-        if pred == 1:
-            proto = str(row.get("network.protocol", "")).lower()
-            code = str(row.get("http.response.status_code", ""))
-            ua = str(row.get("user_agent.original", "")).lower()
-            if proto == "https" and code.startswith("20"):
-                if "mozilla" in ua or "chrome" in ua or "safari" in ua: return 0
-        src_cc = str(row.get("source.geoip.country_code2", ""))
-        dst_cc = str(row.get("destination.geoip.country_code2", ""))
-        if pred == 1 and src_cc and dst_cc and src_cc == dst_cc: return 0
-        if pred == 1 and row.get("prob_1", 0) < 0.55: return 0
-        return pred
-
-    df_result["prediction"] = df_result.apply(lambda r: post_filter(r, r["prediction"]), axis=1)
+    with stage("filter", rows=len(df_result)):
+        apply_filters(df_result)
 
     # บันทึกผลลัพธ์
-    output_csv_path = os.path.join(BASE_OUTPUT_DIR, "predict_result.csv")
-    df_result.to_csv(output_csv_path, index=False)
-    print(f"💾 Saved predictions → {output_csv_path}")
+    output_path = artifact_path(BASE_OUTPUT_DIR, "predict_result")
+    with stage("write", rows=len(df_result)):
+        write_artifact(df_result, output_path, RESULT_DTYPES, text_default=True)
+    print(f"💾 Saved predictions → {output_path}")
 
     # สรุปจำนวนผลลัพธ์
     total_logs = len(df_result)
@@ -119,15 +221,169 @@ def run_prediction(model_path, df, df_clean):
     if labeled:
         acc = accuracy_score(y_true, y_pred)
         print(f"✅ Accuracy: {acc*100:.2f}%")
-        report_dict = classification_report(y_true, y_pred, output_dict=True)
-        for lbl, metrics in report_dict.items():
-            if isinstance(metrics, dict):
-                for k, v in metrics.items():
-                    metrics[k] = round(v * 100, 2) if k != "support" else int(v)
-        df_report = pd.DataFrame(report_dict).transpose()
-        report_html = df_report.to_html(classes="table table-striped table-bordered", border=0)
+        report_html = report_to_html(classification_report(y_true, y_pred, output_dict=True))
     return y_pred, acc, report_html, duration
 
+# ทำนายทั้งไฟล์ (ทีละ chunk ถ้า chunk_size > 0) แล้วเขียนผลลง output_path / whitelist_path (CSV หรือ Parquet ตามนามสกุล)
+# คืนตัวนับสะสมของไฟล์นั้น — ใช้ร่วมกันทั้งโหมด streaming และ parallel
+def predict_file(model, transformer, csv_path, output_path, whitelist_path, chunk_size=0, verdicts=None):
+    stats = {"total": 0, "whitelist": 0, "alerts": 0, "duration": 0.0, "confusion": {}, "labeled": False, "whitelist_written": False}
+    chunks = iter_input(csv_path, KEEP_FIELDS, chunk_size, on_bad_lines='skip')
+    output_writer = ArtifactWriter(output_path, RESULT_DTYPES, text_default=True)
+    whitelist_writer = ArtifactWriter(whitelist_path, RESULT_DTYPES, text_default=True)
+    file_hash = input_hash(csv_path)
+    # 🪟 ทั้งไฟล์เป็น chunk เดียว → คำนวณ window แบบ vectorized ได้เลย, หลาย chunk → state ต่อกันทีละไฟล์
+    session = transformer.new_session() if transformer and chunk_size > 0 else None
+    # ⏱ ทุก chunk บันทึกเป็น stage ชื่อเดียวกัน → metrics รวมเวลา/rows ต่อขั้นให้เอง
+    for i in itertools.count():
+        with stage("load") as info:
+            df = next(chunks, None)
+            info["rows"] = len(df) if df is not None else 0
+        if df is None:
+            break
+        if verdicts is not None:
+            with stage("score", rows=len(df)):
+                probs, y_true, labeled, chunk_duration = predict_probs_cached(model, transformer, df, verdicts, session, file_hash, chunk_size, i)
+                df_result, y_pred, threshold_s = score_frame(model, df, None, probs)
+                chunk_duration += threshold_s
+        else:
+            with stage("transform", rows=len(df)):
+                df_clean = transform_cached(df, transformer, file_hash, chunk_size, i, session)
+            x_data, y_true, labeled = split_features(df_clean)
+            with stage("score", rows=len(df)):
+                df_result, y_pred, chunk_duration = score_frame(model, df, x_data)
+
+        with stage("filter", rows=len(df_result)):
+            is_whitelist = df_result["is_whitelist"] == True
+            if is_whitelist.any():
+                whitelist_writer.write(df_result[is_whitelist])
+                stats["whitelist_written"] = True
+            apply_filters(df_result)
+        with stage("write", rows=len(df_result)):
+            output_writer.write(df_result)
+
+        stats["total"] += len(df_result)
+        stats["whitelist"] += int(is_whitelist.sum())
+        stats["alerts"] += int((df_result["prediction"] == 1).sum())
+        stats["duration"] += chunk_duration
+        stats["labeled"] = labeled
+        if labeled:
+            for (t, p), n in pd.DataFrame({"t": y_true.to_numpy(), "p": y_pred}).value_counts().items():
+                stats["confusion"][(int(t), int(p))] = stats["confusion"].get((int(t), int(p)), 0) + int(n)
+        if chunk_size > 0:
+            print(f"   ↳ {os.path.basename(csv_path)} chunk {i + 1}: {stats['total']:,} rows scored")
+    output_writer.close()
+    whitelist_writer.close()
+    if verdicts is not None:
+        print(f"   ↳ {os.path.basename(csv_path)}: {verdicts.summary()}")
+    if FEATURE_CACHE is not None:
+        print(f"   ↳ {os.path.basename(csv_path)}: {FEATURE_CACHE.summary()}")
+    return stats
+
+# สรุปผลจากตัวนับสะสม → (accuracy, report_html)
+def summarize_stats(stats):
+    normals = stats["total"] - stats["alerts"]
+    print(f"📊 Summary: Total={stats['total']} | Whitelist={stats['whitelist']} | Alerts(after filter)={stats['alerts']} | Normal={normals}")
+    acc, report_html = None, "<p>No ground truth labels available.</p>"
+    if stats["labeled"] and stats["confusion"]:
+        report_dict = report_from_confusion(stats["confusion"])
+        acc = report_dict["accuracy"]
+        print(f"✅ Accuracy: {acc*100:.2f}%")
+        report_html = report_to_html(report_dict)
+    return acc, report_html
+
+# Streaming: อ่านทีละ chunk → transform → predict → whitelist/post-filter → append CSV / Parquet row group
+# memory คงที่ตามขนาด chunk, สรุปผลจากตัวนับสะสม
+def run_prediction_streaming(model_path, csv_path, transformer, chunk_size):
+    print("🤖 Loading trained model ...")
+    with stage("load_model"):
+        model = joblib.load(model_path)
+    output_path = artifact_path(BASE_OUTPUT_DIR, "predict_result")
+    whitelist_path = artifact_path(BASE_OUTPUT_DIR, "whitelist_filtered")
+
+    print(f"🌊 Streaming {os.path.basename(csv_path)} in chunks of {chunk_size:,} rows ...")
+    stats = predict_file(model, transformer, csv_path, output_path, whitelist_path, chunk_size, open_verdict_cache(model_path, transformer))
+    print(f"💾 Saved predictions → {output_path}")
+    if stats["whitelist_written"]:
+        print(f"💾 Whitelist entries saved → {whitelist_path}")
+    acc, report_html = summarize_stats(stats)
+    return stats["total"], acc, report_html, stats["duration"]
+
+# ค้นหา input ทั้งหมดที่ยังไม่ถูก archive (เก่า → ใหม่)
+def get_pending_csvs(input_folder):
+    csv_files = list_inputs(input_folder)
+    if not csv_files:
+        sys.exit(f"❌ No input files (CSV / Zeek log) found in input folder: {input_folder}")
+    csv_files = sorted(set(csv_files), key=lambda f: (os.path.getmtime(f), f))
+    print(f"🗂 Pending CSV files: {len(csv_files)}")
+    return csv_files
+
+# Worker process: โหลด model/transformer ครั้งเดียวต่อ process
+_worker_model, _worker_transformer, _worker_verdicts = None, None, None
+
+def init_worker(model_path):
+    global _worker_model, _worker_transformer, _worker_verdicts
+    # worker ที่ fork มาได้ run ของ parent ติดมาด้วย → ไม่บันทึก stage ซ้ำ (parent จับเวลาทั้ง pool แทน)
+    clear_run()
+    _worker_model = joblib.load(model_path)
+    # แต่ละ process ใช้ 1 thread → แบ่ง core ตามจำนวน worker ไม่แย่งกัน
+    _worker_model.set_params(n_jobs=1)
+    _worker_transformer = load_feature_transformer(model_path)
+    # cache ต่อ worker → record ที่ซ้ำข้ามไฟล์ที่ worker เดียวกันได้รับไม่ต้อง predict ซ้ำ
+    _worker_verdicts = open_verdict_cache(model_path, _worker_transformer)
+
+def predict_file_worker(csv_path, parts_dir, chunk_size):
+    # ชื่อเต็มรวมนามสกุล → a.csv กับ a.log ไม่ชนกันใน parts
+    name = os.path.basename(csv_path)
+    output_path = artifact_path(parts_dir, f"{name}.predict")
+    whitelist_path = artifact_path(parts_dir, f"{name}.whitelist")
+    stats = predict_file(_worker_model, _worker_transformer, csv_path, output_path, whitelist_path, chunk_size, _worker_verdicts)
+    return stats, output_path, whitelist_path if stats["whitelist_written"] else None
+
+def merge_stats(total, stats):
+    for key in ["total", "whitelist", "alerts", "duration"]:
+        total[key] += stats[key]
+    for key, n in stats["confusion"].items():
+        total["confusion"][key] = total["confusion"].get(key, 0) + n
+    total["labeled"] = total["labeled"] or stats["labeled"]
+    return total
+
+# Parallel: ทุกไฟล์ที่ค้างอยู่ กระจายไปยัง process pool, archive + log แยกรายไฟล์
+def run_prediction_parallel(model_path, input_folder, csv_files, workers, chunk_size):
+    parts_dir = os.path.join(BASE_OUTPUT_DIR, "parts")
+    os.makedirs(parts_dir, exist_ok=True)
+    total = {"total": 0, "whitelist": 0, "alerts": 0, "duration": 0.0, "confusion": {}, "labeled": False}
+    results = {}
+    print(f"🚀 Predicting {len(csv_files)} file(s) with {workers} worker process(es) ...")
+    with stage("predict_pool"), ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(model_path,)) as pool:
+        futures = {pool.submit(predict_file_worker, f, parts_dir, chunk_size): f for f in csv_files}
+        for future in as_completed(futures):
+            csv_path = futures[future]
+            try:
+                stats, output_part, whitelist_part = future.result()
+            except Exception as e:
+                print(f"❌ Failed: {os.path.basename(csv_path)} → {e}")
+                continue
+            acc = report_from_confusion(stats["confusion"])["accuracy"] if stats["confusion"] else None
+            print(f"✅ {os.path.basename(csv_path)}: {stats['total']:,} rows, Alerts={stats['alerts']}")
+            archive_and_log(csv_path, input_folder, acc, stats["duration"], stats["total"])
+            results[csv_path] = (output_part, whitelist_part)
+            merge_stats(total, stats)
+
+    # รวมผลตามลำดับไฟล์ (เก่า → ใหม่) ให้ dashboard อ่านไฟล์เดียวเหมือนเดิม
+    done = [f for f in csv_files if f in results]
+    if done:
+        with stage("merge_parts", rows=total["total"]):
+            output_path = concat_artifacts([results[f][0] for f in done], artifact_path(BASE_OUTPUT_DIR, "predict_result"))
+            print(f"💾 Saved predictions → {output_path}")
+            whitelist_parts = [results[f][1] for f in done if results[f][1]]
+            if whitelist_parts:
+                whitelist_path = concat_artifacts(whitelist_parts, artifact_path(BASE_OUTPUT_DIR, "whitelist_filtered"))
+                print(f"💾 Whitelist entries saved → {whitelist_path}")
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    acc, report_html = summarize_stats(total)
+    return total["total"], acc, report_html, total["duration"]
+
 # สร้าง HTML Report
 def generate_html_report(acc, duration, report_html):
     env = Environment(loader=FileSystemLoader("templates"))
@@ -155,11 +411,11 @@ def upload_to_minio():
             obj_path = f"reports/{timestamp}/classification_report_predict.html"
             print(f"→ {obj_path}")
             client.fput_object(bucket_name, obj_path, report_path)
-        csv_path = os.path.join(BASE_OUTPUT_DIR, "predict_result.csv")
-        if os.path.exists(csv_path):
-            obj_path = f"datasets/{timestamp}/predict_result.csv"
+        result_path = find_artifact(BASE_OUTPUT_DIR, "predict_result")
+        if result_path:
+            obj_path = f"datasets/{timestamp}/{os.path.basename(result_path)}"
             print(f"→ {obj_path}")
-            client.fput_object(bucket_name, obj_path, csv_path)
+            client.fput_object(bucket_name, obj_path, result_path)
         print("✅ Upload complete!\n")
     except Exception as e:
         print(f"❌ Upload failed: {e}")
@@ -183,13 +439,42 @@ def main():
     input_folder = os.path.abspath(input_folder)
     print(f"🧭 Model path: {model_path}")
     print(f"📂 Input folder: {input_folder}")
+    # 📡 PREDICT_MODE=live → รันค้างไว้ ตามอ่านบรรทัดใหม่ของไฟล์ใน input folder (ไม่ archive ไฟล์)
+    if os.getenv("PREDICT_MODE", "batch") == "live":
+        from live_predict import run_live
+        run_live(model_path, input_folder)
+        return
+    chunk_size = int(os.getenv("PREDICT_CHUNK_SIZE", 0))
+    workers = int(os.getenv("PREDICT_WORKERS", 0))
+    start_run("predict", BASE_OUTPUT_DIR)
+    if workers > 0:
+        csv_files = get_pending_csvs(input_folder)
+        total_rows, acc, report_html, duration = run_prediction_parallel(model_path, input_folder, csv_files, workers, chunk_size)
+        with stage("report"):
+            generate_html_report(acc, duration, report_html)
+        with stage("upload"):
+            upload_to_minio()
+        print(f"✅ Finished {len(csv_files)} file(s), {total_rows:,} rows in {duration:.2f} seconds.")
+        finish_run(mode="parallel", workers=workers, chunk_size=chunk_size, files=len(csv_files), rows=total_rows)
+        return
     latest_csv = get_latest_csv(input_folder)
-    df, df_clean = load_and_prepare_data(latest_csv)
-    y_pred, acc, report_html, duration = run_prediction(model_path, df, df_clean)
-    html_output_path = generate_html_report(acc, duration, report_html)
-    upload_to_minio()
-    archive_and_log(latest_csv, input_folder, acc, duration, len(df))
+    with stage("load_transformer"):
+        transformer = load_feature_transformer(model_path)
+    if chunk_size > 0:
+        total_rows, acc, report_html, duration = run_prediction_streaming(model_path, latest_csv, transformer, chunk_size)
+    else:
+        verdicts = open_verdict_cache(model_path, transformer)
+        df, df_clean, file_hash = load_and_prepare_data(latest_csv, transformer, verdicts)
+        y_pred, acc, report_html, duration = run_prediction(model_path, df, df_clean, transformer, verdicts, file_hash)
+        total_rows = len(df)
+    with stage("report"):
+        html_output_path = generate_html_report(acc, duration, report_html)
+    with stage("upload"):
+        upload_to_minio()
+    with stage("archive"):
+        archive_and_log(latest_csv, input_folder, acc, duration, total_rows)
     print(f"✅ Finished successfully in {duration:.2f} seconds.")
+    finish_run(mode="streaming" if chunk_size > 0 else "memory", chunk_size=chunk_size, rows=total_rows)
 
 if __name__ == "__main__":
     main()
@@ -1,17 +1,24 @@
 import pandas as pd
-import os, sys, glob, ipaddress
+import numpy as np
+import joblib
+import os, sys, re, math, time, datetime, ipaddress, threading
 from urllib.parse import urlparse
 from sklearn.model_selection import train_test_split
 from sklearn.feature_extraction.text import TfidfVectorizer
+from artifacts import artifact_path, write_artifact
+from feature_cache import file_sha256, open_feature_cache
+from zeek_logs import list_inputs, read_input
+from stage_metrics import Laps, stage, start_run, finish_run
+from session_features import SESSION_WINDOW_S, SESSION_FEATURES, SessionStore, session_features, session_spec, timestamps_ms
 
 # -------------------------------------
-# 📥 โหลด CSV จาก input folder หรือไฟล์เดี่ยว
+# 📥 โหลด CSV / Parquet / Zeek http.log (TSV, JSON, .gz) จาก input folder หรือไฟล์เดี่ยว
 # -------------------------------------
 def load_csv(input_path, keep_fields):
     if os.path.isfile(input_path):
         files = [input_path]
     else:
-        files = glob.glob(os.path.join(input_path, "*.csv"))
+        files = list_inputs(input_path)
 
     if not files:
         sys.exit("❌ No CSV Files found.")
@@ -19,7 +26,7 @@ def load_csv(input_path, keep_fields):
     dfs = []
     for f in files:
         print(f"📄 Loading file:", os.path.basename(f))
-        df = pd.read_csv(f, on_bad_lines="skip")
+        df = read_input(f, keep_fields, on_bad_lines="skip")
         for col in keep_fields:
             if col not in df.columns:
                 df[col] = None
@@ -30,6 +37,17 @@ def load_csv(input_path, keep_fields):
     return pd.concat(dfs, ignore_index=True)
 
 
+# -------------------------------------
+# 📋 คอลัมน์ input ที่ transform_data ต้องใช้
+# -------------------------------------
+INPUT_FIELDS = [
+    "@timestamp", "source.ip", "destination.ip", "url.original",
+    "http.response.status_code", "destination.port", "network.protocol",
+    "user_agent.original", "http.request.method", "http.request.referrer",
+    "source.geoip.country_code2", "destination.geoip.country_code2"
+]
+
+
 # -------------------------------------
 # 🧩 แปลง IP → Octets
 # -------------------------------------
@@ -43,143 +61,476 @@ def ip_to_octets(ip):
     return [0, 0, 0, 0]
 
 
+# -------------------------------------
+# 🔒 IP Private / Referrer ภายนอก
+# -------------------------------------
+def is_internal_ip(ip):
+    try:
+        return ipaddress.ip_address(ip).is_private
+    except:
+        return False
+
+
+def is_external_referrer(ref, dest):
+    try:
+        ref_host = urlparse(ref).hostname or ""
+        dest_host = urlparse(dest).hostname or ""
+        return bool(ref_host and dest_host and ref_host != dest_host)
+    except:
+        return False
+
+
+# -------------------------------------
+# 🪟 Keyword lists ที่ใช้ร่วมกันทั้ง frame และ record เดี่ยว
+# -------------------------------------
+MS_SYSTEM_KEYWORDS = [
+    "microsoft", "windows", "msftconnect", "cryptoapi",
+    "delivery-optimization", "tlu.dl.delivery.mp.microsoft.com",
+    "delivery.mp.microsoft.com", "officecdn", "windowsupdate",
+    "update", "microsoft.com", "msedge.net"
+]
+MS_DOMAINS = [
+    ".microsoft.com", ".windowsupdate.com", ".msedge.net",
+    ".delivery.mp.microsoft.com", ".officecdn.microsoft.com"
+]
+
+
+# -------------------------------------
+# ⚡ ฟีเจอร์ราย record แบบ columnar: ใช้แค่ string / regex / NumPy (ไม่มี callback ต่อแถว)
+# -------------------------------------
+IPV4_PARTS_RE = r"\A([^.]*)\.([^.]*)\.([^.]*)\.([^.]*)\Z"
+IPV4_OCTET_RE = r"(0|[1-9][0-9]{0,2})"
+IPV4_STRICT_RE = r"\A" + r"\.".join([IPV4_OCTET_RE] * 4) + r"\Z"
+URL_NETLOC_RE = r"\A(?:[A-Za-z][A-Za-z0-9+.\-]*:)?//([^/?#]*)"
+URL_C0_OR_SPACE = "".join(chr(c) for c in range(0x21))
+
+# อ่านช่วง private จาก stdlib โดยตรง เพื่อให้ตรงกับ ipaddress.is_private ของ Python ที่รันอยู่
+_IPV4_CONSTANTS = ipaddress.IPv4Address._constants
+PRIVATE_IPV4_RANGES = np.array(
+    [(int(n.network_address), int(n.broadcast_address)) for n in _IPV4_CONSTANTS._private_networks],
+    dtype=np.int64
+).reshape(-1, 2)
+PRIVATE_IPV4_EXCEPTIONS = np.array(
+    [(int(n.network_address), int(n.broadcast_address))
+     for n in getattr(_IPV4_CONSTANTS, "_private_networks_exceptions", [])],
+    dtype=np.int64
+).reshape(-1, 2)
+
+
+def keyword_pattern(keywords):
+    return "|".join(re.escape(k) for k in keywords)
+
+
+def factorize_text(values):
+    """แยกเป็น (codes, uniques) — Zeek log ซ้ำกันสูง จึงคำนวณบนค่า unique แล้ว gather กลับด้วย codes"""
+    codes, uniques = pd.factorize(values.astype(str))
+    return codes, pd.Series(uniques, dtype=object)
+
+
+def ip_octets_vectorized(text):
+    """ip_to_octets() แบบ columnar: คืน int64 array ขนาด (n, 4)"""
+    parts = text.str.extract(IPV4_PARTS_RE)
+    octets = np.zeros((len(text), 4), dtype=np.int64)
+    irregular = np.zeros(len(text), dtype=bool)
+    for i in range(4):
+        part = parts[i]
+        is_digit = part.str.isdigit().eq(True).to_numpy()
+        is_plain = part.str.fullmatch(r"[0-9]{1,18}", na=False).to_numpy(dtype=bool)
+        octets[is_plain, i] = pd.to_numeric(part[is_plain]).to_numpy(dtype=np.int64)
+        # digit แบบ unicode / เลขยาวเกิน int64 → ให้ ip_to_octets ตัดสินเหมือนเดิม
+        irregular |= is_digit & ~is_plain
+    if irregular.any():
+        octets[irregular] = [ip_to_octets(ip) for ip in text[irregular]]
+    return octets
+
+
+def is_private_ip_vectorized(text):
+    """is_internal_ip() แบบ columnar สำหรับ IPv4, IPv6 (พบน้อย) ใช้ ipaddress ตัดสิน"""
+    octets = text.str.extract(IPV4_STRICT_RE)
+    valid = octets[0].notna().to_numpy()
+    result = np.zeros(len(text), dtype=bool)
+    if valid.any():
+        values = octets[valid].astype(np.int64).to_numpy()
+        in_range = (values <= 255).all(axis=1)
+        addr = (values[:, 0] << 24) | (values[:, 1] << 16) | (values[:, 2] << 8) | values[:, 3]
+        private = ((addr[:, None] >= PRIVATE_IPV4_RANGES[:, 0]) & (addr[:, None] <= PRIVATE_IPV4_RANGES[:, 1])).any(axis=1)
+        if len(PRIVATE_IPV4_EXCEPTIONS):
+            private &= ~((addr[:, None] >= PRIVATE_IPV4_EXCEPTIONS[:, 0]) & (addr[:, None] <= PRIVATE_IPV4_EXCEPTIONS[:, 1])).any(axis=1)
+        result[valid] = in_range & private
+    maybe_v6 = text.str.contains(":", regex=False).to_numpy(dtype=bool)
+    if maybe_v6.any():
+        result[maybe_v6] = [is_internal_ip(ip) for ip in text[maybe_v6]]
+    return result
+
+
+def private_ip_column(values, codes_of, col):
+    """is_internal_ip() ของทั้งคอลัมน์: ค่า str ทั้งหมด → แบบ columnar บน unique,
+    มีค่าที่ไม่ใช่ str (เช่น IP เป็น int จาก JSON / คอลัมน์ตัวเลข) → ipaddress ตัดสินต่อค่า unique เหมือนเดิม (ip_address(12345) ใช้ได้)"""
+    if pd.api.types.infer_dtype(values, skipna=False) == "string":
+        codes, ips = codes_of(col)
+        return is_private_ip_vectorized(ips)[codes]
+    codes, uniques = pd.factorize(values)
+    return np.array([is_internal_ip(ip) for ip in uniques.tolist()], dtype=bool)[codes]
+
+
+def url_hostname_vectorized(text):
+    """urlparse(url).hostname แบบ columnar → (hostname หรือ "", mask ของค่าที่ต้องให้ urlparse ตัดสิน)"""
+    text = text.str.lstrip(URL_C0_OR_SPACE).str.replace(r"[\t\r\n]", "", regex=True)
+    netloc = text.str.extract(URL_NETLOC_RE, expand=False)
+    # IPv6 แบบ [..] และ netloc ที่ไม่ใช่ ASCII มี validation พิเศษใน urlsplit
+    irregular = netloc.str.contains(r"[\[\]]|[^\x00-\x7f]", regex=True, na=False).to_numpy(dtype=bool)
+    hostinfo = netloc.str.replace(r"(?s)\A.*@", "", regex=True)
+    host = hostinfo.str.extract(r"(?s)\A([^:%]*)(%[^:]*)?", expand=True)
+    hostname = host[0].str.lower() + host[1].fillna("")
+    return hostname.fillna("").to_numpy(dtype=object), irregular
+
+
+def record_features_vectorized(df, need=None):
+    out = pd.DataFrame(index=df.index)
+    wanted = feature_filter(need)
+
+    # factorize เฉพาะคอลัมน์ที่ฟีเจอร์ที่ต้องการใช้จริง (ครั้งเดียวต่อคอลัมน์)
+    factorized = {}
+    def codes_of(col):
+        if col not in factorized:
+            factorized[col] = factorize_text(df[col])
+        return factorized[col]
+
+    if wanted(*IP_OCTET_FEATURES[:4]):
+        src_codes, src_ips = codes_of("source.ip")
+        src_octets = ip_octets_vectorized(src_ips)[src_codes]
+        for i in range(4):
+            out[f"source_ip_oct{i + 1}"] = src_octets[:, i]
+    if wanted(*IP_OCTET_FEATURES[4:]):
+        dest_codes, dest_ips = codes_of("destination.ip")
+        dest_octets = ip_octets_vectorized(dest_ips)[dest_codes]
+        for i in range(4):
+            out[f"destination_ip_oct{i + 1}"] = dest_octets[:, i]
+
+    if wanted("is_night"):
+        out["is_night"] = ((df["hour"] <= 5) | (df["hour"] >= 22)).astype(int)
+    if wanted("src_is_private_ip"):
+        out["src_is_private_ip"] = private_ip_column(df["source.ip"], codes_of, "source.ip").astype(int)
+    if wanted("dst_is_internal_ip"):
+        out["dst_is_internal_ip"] = private_ip_column(df["destination.ip"], codes_of, "destination.ip").astype(int)
+
+    if wanted("ua_is_microsoft_system"):
+        ms_pattern = keyword_pattern(MS_SYSTEM_KEYWORDS)
+
+        def has_ms(col):
+            codes, uniques = codes_of(col)
+            return uniques.str.lower().str.contains(ms_pattern, regex=True).to_numpy(dtype=bool)[codes]
+
+        out["ua_is_microsoft_system"] = (
+            has_ms("user_agent.original") | has_ms("destination.ip") | has_ms("url.original")
+        ).astype(int)
+
+    if wanted("dest_is_microsoft"):
+        dest = df["destination.ip"]
+        if pd.api.types.is_object_dtype(dest) or pd.api.types.is_string_dtype(dest):
+            # ค่าที่ไม่ใช่ str ได้ NaN จาก .str → False เหมือน isinstance(dest, str) เดิม
+            out["dest_is_microsoft"] = dest.str.lower().str.contains(
+                keyword_pattern(MS_DOMAINS), regex=True, na=False
+            ).astype(int)
+        else:
+            out["dest_is_microsoft"] = 0
+
+    if wanted("url_depth", "has_query"):
+        url_codes, urls = codes_of("url.original")
+        out["url_depth"] = urls.str.count("/").to_numpy(dtype=np.int64)[url_codes]
+        out["has_query"] = urls.str.contains("?", regex=False).to_numpy(dtype=bool)[url_codes]
+
+    if wanted("referrer_is_external"):
+        url_codes, urls = codes_of("url.original")
+        ref_codes, referrers = codes_of("http.request.referrer")
+        ref_host, ref_irregular = url_hostname_vectorized(referrers)
+        dest_host, dest_irregular = url_hostname_vectorized(urls)
+        ref_host, dest_host = ref_host[ref_codes], dest_host[url_codes]
+        referrer_is_external = (ref_host != "") & (dest_host != "") & (ref_host != dest_host)
+        irregular = ref_irregular[ref_codes] | dest_irregular[url_codes]
+        if irregular.any():
+            # แถวส่วนน้อยที่ urlparse อาจ raise ValueError → ใช้ logic เดิม
+            referrer_is_external[irregular] = [
+                is_external_referrer(r, u)
+                for r, u in zip(referrers.to_numpy()[ref_codes[irregular]], urls.to_numpy()[url_codes[irregular]])
+            ]
+        out["referrer_is_external"] = referrer_is_external.astype(bool)
+    if wanted("ua_length"):
+        ua_codes, uas = codes_of("user_agent.original")
+        out["ua_length"] = uas.str.len().to_numpy(dtype=np.int64)[ua_codes]
+    return out
+
+
+# -------------------------------------
+# 🔤 TF-IDF vocabulary ของ URL
+# -------------------------------------
+URL_TOKENS = ["login", "admin", "update", "download", "upload",
+              "passwd", "config", "reset", "token", "php"]
+
+
+def make_url_vectorizer():
+    return TfidfVectorizer(vocabulary=URL_TOKENS, token_pattern=r"[a-zA-Z]{3,}")
+
+
+# -------------------------------------
+# 📐 ลำดับคอลัมน์ของ feature matrix (predict mode)
+# -------------------------------------
+BASE_FEATURES = [
+    "status_code", "hour", "weekday", "is_error", "url_length",
+    "num_special_chars", "contains_suspicious_keyword", "is_night",
+    "src_is_private_ip", "dst_is_public_ip", "ip_match_local",
+    "is_common_port", "protocol_is_http", "req_method_is_post",
+    "is_referrer_missing", "same_country",
+    "ua_is_browser", "ua_is_microsoft", "ua_is_python_script",
+    "ua_is_openstack", "ua_is_cloud_service", "ua_is_bot",
+    "ua_is_windows_update", "ua_is_microsoft_system", "dest_is_microsoft",
+    "is_non_browser_external", "is_http_external", "is_suspicious_http",
+    "is_python_to_external", "is_openstack_internal", "risk_score"
+]
+IP_OCTET_FEATURES = [f"source_ip_oct{i}" for i in range(1, 5)] + [f"destination_ip_oct{i}" for i in range(1, 5)]
+BEHAVIOR_FEATURES = ["url_depth", "has_query", "method_is_uncommon", "referrer_is_external", "ua_length"]
+FEATURE_COLUMNS = BASE_FEATURES + IP_OCTET_FEATURES + URL_TOKENS + BEHAVIOR_FEATURES
+
+
+# -------------------------------------
+# ✂️ Pruned pipeline: คำนวณเฉพาะฟีเจอร์ที่โมเดลใช้ (+ ฟีเจอร์ที่มันคำนวณต่อมา)
+# -------------------------------------
+# ฟีเจอร์ที่คำนวณจากฟีเจอร์/คอลัมน์ระหว่างทางตัวอื่น (ua_is_empty, dst_is_internal_ip ไม่ได้ออกเป็น feature)
+FEATURE_DEPENDENCIES = {
+    "is_error": ["status_code"],
+    "is_night": ["hour"],
+    "dst_is_public_ip": ["dst_is_internal_ip"],
+    "is_http_external": ["protocol_is_http", "dst_is_internal_ip"],
+    "is_suspicious_http": ["is_http_external", "ua_is_empty"],
+    "is_python_to_external": ["ua_is_python_script", "dst_is_internal_ip"],
+    "is_openstack_internal": ["ua_is_openstack", "dst_is_internal_ip"],
+    "is_non_browser_external": ["ua_is_browser", "dst_is_internal_ip", "protocol_is_http"],
+    "risk_score": ["is_suspicious_http", "is_python_to_external", "is_non_browser_external", "is_http_external", "is_openstack_internal"],
+}
+
+
+def required_features(features):
+    """features ที่ต้องการ → set ของทุกอย่างที่ต้องคำนวณ (None = ครบทุกฟีเจอร์)"""
+    if features is None:
+        return None
+    need, pending = set(), list(features)
+    while pending:
+        name = pending.pop()
+        if name not in need:
+            need.add(name)
+            pending.extend(FEATURE_DEPENDENCIES.get(name, []))
+    return need
+
+
+def feature_filter(need):
+    """wanted(*names) → True ถ้าต้องคำนวณชื่อใดชื่อหนึ่ง"""
+    if need is None:
+        return lambda *names: True
+    return lambda *names: not need.isdisjoint(names)
+
+
+# -------------------------------------
+# 🗜 Feature schema: dtype + ช่วงค่าของทุกฟีเจอร์ (ตามลำดับ FEATURE_COLUMNS + SESSION_FEATURES)
+# -------------------------------------
+# บังคับท้าย transform_data, ตอนโหลด training set และใน fast path → ทุกทางได้ค่าเดียวกัน
+# ค่านอกช่วง (เช่น IP แปลก ๆ "999.1.1.1" หรือ URL ยาวเกิน 65535) ถูก clip แทนที่จะ overflow
+COUNT_FEATURES = ["status_code", "url_length", "num_special_chars", "url_depth", "ua_length"]
+BOOL_FEATURES = ["has_query", "method_is_uncommon", "referrer_is_external"]
+
+
+def feature_spec(name):
+    if name in COUNT_FEATURES:
+        return ("uint16", 0, 65535)
+    if name in BOOL_FEATURES:
+        return ("bool", 0, 1)
+    if name in IP_OCTET_FEATURES:
+        return ("uint8", 0, 255)
+    if name in URL_TOKENS:
+        return ("float32", 0.0, 1.0)
+    if name in SESSION_FEATURES:
+        return session_spec(name)
+    return {"hour": ("int8", 0, 23), "weekday": ("int8", 0, 6), "risk_score": ("int8", 0, 10)}.get(name, ("uint8", 0, 1))
+
+
+FEATURE_SCHEMA = {name: feature_spec(name) for name in FEATURE_COLUMNS + SESSION_FEATURES}
+LABEL_SCHEMA = ("int8", -128, 127)
+
+# ⚠️ warning ของการ clip: ต่อคอลัมน์ไม่เกิน 1 ครั้งต่อ CLIP_WARN_INTERVAL_S (ml-serve เรียกทุก request)
+# จำนวนที่ถูกกดไว้ระหว่างนั้นรวมไปแจ้งในครั้งถัดไป
+CLIP_WARN_INTERVAL_S = float(os.getenv("CLIP_WARN_INTERVAL_S", 60))
+_clip_warnings = {}
+_clip_lock = threading.Lock()
+
+
+def warn_clipped(col, count, lo, hi):
+    now = time.monotonic()
+    with _clip_lock:
+        last, pending = _clip_warnings.get(col, (None, 0))
+        if last is not None and now - last < CLIP_WARN_INTERVAL_S:
+            _clip_warnings[col] = (last, pending + count)
+            return
+        _clip_warnings[col] = (now, 0)
+    since = f" (+{pending} since last warning)" if pending else ""
+    print(f"⚠️ {col}: clipped {count} value(s) to [{lo}, {hi}]{since}")
+
+
+def enforce_feature_schema(df):
+    """แปลงคอลัมน์ที่อยู่ใน FEATURE_SCHEMA (+ label) เป็น dtype ที่ประกาศ — คอลัมน์อื่นคงเดิม"""
+    columns = {}
+    for col in df.columns:
+        spec = LABEL_SCHEMA if col == "label" else FEATURE_SCHEMA.get(col)
+        values = df[col]
+        if spec is None or values.dtype == spec[0]:
+            columns[col] = values
+            continue
+        dtype, lo, hi = spec
+        if dtype != "bool":
+            out_of_range = int(((values < lo) | (values > hi)).sum())
+            if out_of_range:
+                warn_clipped(col, out_of_range, lo, hi)
+                values = values.clip(lo, hi)
+        columns[col] = values.astype(dtype)
+    return pd.DataFrame(columns, index=df.index)
+
+
+def enforce_record_schema(values, columns=FEATURE_COLUMNS):
+    """enforce_feature_schema สำหรับ feature vector เดียว (ลำดับ columns)"""
+    out = []
+    for value, (dtype, lo, hi) in zip(values, (FEATURE_SCHEMA[c] for c in columns)):
+        if dtype == "float32":
+            value = float(np.float32(min(max(value, lo), hi)))
+        elif dtype != "bool":
+            value = min(max(value, lo), hi)
+        out.append(value)
+    return out
+
+
 # -------------------------------------
 # 🧠 ฟังก์ชันหลัก: ทำความสะอาด + แปลงฟีเจอร์
 # -------------------------------------
-def transform_data(df, mode="auto"):
+def transform_data(df, mode="auto", vectorizer=None, features=None, session_window_s=None, session=None, session_values=None):
+    # features (จาก transformer ที่ prune แล้ว) → คำนวณเฉพาะกลุ่มที่ต้องใช้, ออกเฉพาะคอลัมน์นั้น (ลำดับ FEATURE_COLUMNS)
+    need = required_features(features)
+    wanted = feature_filter(need)
+    selected = (lambda cols: list(cols)) if features is None else (lambda cols: [c for c in cols if c in features])
+
+    # ⏱ เวลาแต่ละกลุ่มฟีเจอร์ → transform.<กลุ่ม> ใน metrics ของ run (ถ้ามี)
+    laps = Laps("transform", rows=len(df))
     df = df.copy().fillna("-")
 
-    # ========= 1️⃣ แปลง IP =========
-    src_octets = df["source.ip"].apply(ip_to_octets)
-    dest_octets = df["destination.ip"].apply(ip_to_octets)
-    df[[f"source_ip_oct{i}" for i in range(1, 5)]] = pd.DataFrame(src_octets.tolist(), index=df.index)
-    df[[f"destination_ip_oct{i}" for i in range(1, 5)]] = pd.DataFrame(dest_octets.tolist(), index=df.index)
-
-    # ========= 2️⃣ TF-IDF จาก URL =========
-    whitelist_tokens = ["login", "admin", "update", "download", "upload",
-                        "passwd", "config", "reset", "token", "php"]
-    vectorizer = TfidfVectorizer(vocabulary=whitelist_tokens, token_pattern=r"[a-zA-Z]{3,}")
-    url_features = vectorizer.fit_transform(df["url.original"].astype(str))
-    url_df = pd.DataFrame(url_features.toarray(), columns=vectorizer.get_feature_names_out())
-
-    # ========= 3️⃣ Time & HTTP Features =========
-    df["@timestamp"] = pd.to_datetime(df["@timestamp"], errors="coerce")
-    df["hour"] = df["@timestamp"].dt.hour.fillna(0).astype(int)
-    df["weekday"] = df["@timestamp"].dt.weekday.fillna(0).astype(int)
-    df["status_code"] = pd.to_numeric(df["http.response.status_code"], errors="coerce").fillna(0).astype(int)
-    df["is_error"] = (df["status_code"] >= 400).astype(int)
-    df["url_length"] = df["url.original"].astype(str).str.len()
-    df["num_special_chars"] = df["url.original"].astype(str).str.count(r"[?=&%]")
-    df["contains_suspicious_keyword"] = df["url.original"].astype(str).str.contains(
-        "login|admin|cmd|token|download|shell", case=False, na=False
-    ).astype(int)
-    df["is_night"] = df["hour"].apply(lambda x: 1 if x <= 5 or x >= 22 else 0)
+    # ========= 1️⃣ TF-IDF จาก URL =========
+    # vectorizer ที่ fit แล้ว (จาก FeatureTransformer) → transform อย่างเดียว, ไม่งั้น fit กับ batch นี้
+    tokens = selected(URL_TOKENS)
+    if vectorizer is None:
+        vectorizer = make_url_vectorizer()
+        url_features = vectorizer.fit_transform(df["url.original"].astype(str))
+    elif tokens:
+        url_features = vectorizer.transform(df["url.original"].astype(str))
+    if features is None:
+        url_df = pd.DataFrame(url_features.toarray(), columns=vectorizer.get_feature_names_out(), index=df.index)
+    elif tokens:
+        # l2 norm คิดจากทุก token แล้ว → เลือกคอลัมน์บน sparse ก่อนแปลงเป็น dense
+        index = [vectorizer.vocabulary_[t] for t in tokens]
+        url_df = pd.DataFrame(url_features[:, index].toarray(), columns=tokens, index=df.index)
+    else:
+        url_df = pd.DataFrame(index=df.index)
+    laps.mark("tfidf")
+
+    # ========= 2️⃣ Time & HTTP Features =========
+    if wanted("hour", "weekday"):
+        df["@timestamp"] = pd.to_datetime(df["@timestamp"], errors="coerce")
+        df["hour"] = df["@timestamp"].dt.hour.fillna(0).astype(int)
+        df["weekday"] = df["@timestamp"].dt.weekday.fillna(0).astype(int)
+    if wanted("status_code"):
+        df["status_code"] = pd.to_numeric(df["http.response.status_code"], errors="coerce").fillna(0).astype(int)
+    if wanted("is_error"):
+        df["is_error"] = (df["status_code"] >= 400).astype(int)
+    if wanted("url_length"):
+        df["url_length"] = df["url.original"].astype(str).str.len()
+    if wanted("num_special_chars"):
+        df["num_special_chars"] = df["url.original"].astype(str).str.count(r"[?=&%]")
+    if wanted("contains_suspicious_keyword"):
+        df["contains_suspicious_keyword"] = df["url.original"].astype(str).str.contains(
+            "login|admin|cmd|token|download|shell", case=False, na=False
+        ).astype(int)
+    laps.mark("time_http")
+
+    # ========= 3️⃣ ฟีเจอร์ราย record (IP octets, private IP, Microsoft, URL/UA) =========
+    record_df = record_features_vectorized(df, need)
+    df[list(record_df.columns)] = record_df
+    laps.mark("record")
 
     # ========= 4️⃣ IP Behavior =========
-    def is_internal(ip):
-        try:
-            return ipaddress.ip_address(ip).is_private
-        except:
-            return False
-
-    df["src_is_private_ip"] = df["source.ip"].apply(is_internal).astype(int)
-    df["dst_is_internal_ip"] = df["destination.ip"].apply(is_internal).astype(int)
-    df["dst_is_public_ip"] = (df["dst_is_internal_ip"] == 0).astype(int)
-    df["ip_match_local"] = (
-        df["source.ip"].astype(str).str.split(".").str[0] ==
-        df["destination.ip"].astype(str).str.split(".").str[0]
-    ).astype(int)
+    if wanted("dst_is_public_ip"):
+        df["dst_is_public_ip"] = (df["dst_is_internal_ip"] == 0).astype(int)
+    if wanted("ip_match_local"):
+        df["ip_match_local"] = (
+            df["source.ip"].astype(str).str.split(".").str[0] ==
+            df["destination.ip"].astype(str).str.split(".").str[0]
+        ).astype(int)
 
     # ========= 5️⃣ Protocol & UA Behavior =========
-    df["is_common_port"] = df["destination.port"].astype(str).isin(["80", "443", "8080"]).astype(int)
-    df["protocol_is_http"] = df["network.protocol"].astype(str).str.contains("http", case=False, na=False).astype(int)
-    df["req_method_is_post"] = df["http.request.method"].astype(str).str.upper().eq("POST").astype(int)
-    df["is_referrer_missing"] = df["http.request.referrer"].astype(str).str.strip().isin(["-", "", "none"]).astype(int)
-    df["same_country"] = (
-        (df["source.geoip.country_code2"].astype(str).str.upper() ==
-         df["destination.geoip.country_code2"].astype(str).str.upper()) &
-        (df["source.geoip.country_code2"] != "-")
-    ).astype(int)
+    if wanted("is_common_port"):
+        df["is_common_port"] = df["destination.port"].astype(str).isin(["80", "443", "8080"]).astype(int)
+    if wanted("protocol_is_http"):
+        df["protocol_is_http"] = df["network.protocol"].astype(str).str.contains("http", case=False, na=False).astype(int)
+    if wanted("req_method_is_post"):
+        df["req_method_is_post"] = df["http.request.method"].astype(str).str.upper().eq("POST").astype(int)
+    if wanted("is_referrer_missing"):
+        df["is_referrer_missing"] = df["http.request.referrer"].astype(str).str.strip().isin(["-", "", "none"]).astype(int)
+    if wanted("same_country"):
+        df["same_country"] = (
+            (df["source.geoip.country_code2"].astype(str).str.upper() ==
+             df["destination.geoip.country_code2"].astype(str).str.upper()) &
+            (df["source.geoip.country_code2"] != "-")
+        ).astype(int)
+    laps.mark("ip_protocol")
 
     # ========= 6️⃣ User-Agent Intelligence =========
-    ua_col = df["user_agent.original"].astype(str).str.lower()
-    df["ua_is_empty"] = (ua_col == "-").astype(int)
-    df["ua_is_browser"] = ua_col.str.contains("mozilla|chrome|safari|edge|firefox", na=False).astype(int)
-    df["ua_is_microsoft"] = ua_col.str.contains("microsoft|windows|cryptoapi|msftconnect|delivery-optimization", na=False).astype(int)
-    df["ua_is_python_script"] = ua_col.str.contains("python|requests|urllib|aiohttp", na=False).astype(int)
-    df["ua_is_openstack"] = ua_col.str.contains("magnum|keystoneauth|openstack", na=False).astype(int)
-    df["ua_is_cloud_service"] = ua_col.str.contains("aws|google|gcp|azure|cloudflare", na=False).astype(int)
-    df["ua_is_bot"] = ua_col.str.contains("bot|crawler|curl", na=False).astype(int)
-    df["ua_is_windows_update"] = ua_col.str.contains("microsoft|windows", na=False).astype(int)
+    # UA ซ้ำกันสูงมาก → match regex บนค่า unique แล้ว gather กลับ
+    if wanted("ua_is_empty", *UA_PATTERNS):
+        ua_codes, ua_uniques = factorize_text(df["user_agent.original"])
+        ua_col = ua_uniques.str.lower()
+        if wanted("ua_is_empty"):
+            df["ua_is_empty"] = (ua_col == "-").to_numpy(dtype=np.int64)[ua_codes]
+        for name, pattern in UA_PATTERNS.items():
+            if wanted(name):
+                df[name] = ua_col.str.contains(pattern, na=False).to_numpy(dtype=np.int64)[ua_codes]
+    laps.mark("user_agent")
 
     # ========= 7️⃣ Suspicious Pattern =========
-    df["is_http_external"] = ((df["protocol_is_http"] == 1) & (df["dst_is_internal_ip"] == 0)).astype(int)
-    df["is_suspicious_http"] = ((df["is_http_external"] == 1) & (df["ua_is_empty"] == 1)).astype(int)
-    df["is_python_to_external"] = ((df["ua_is_python_script"] == 1) & (df["dst_is_internal_ip"] == 0)).astype(int)
-    df["is_openstack_internal"] = ((df["ua_is_openstack"] == 1) & (df["dst_is_internal_ip"] == 1)).astype(int)
-
-    # ========= 8️⃣ Microsoft Whitelist =========
-    def is_microsoft_system(ua, dest, url):
-        ua = str(ua).lower()
-        dest = str(dest).lower()
-        url = str(url).lower()
-        ms_keywords = [
-            "microsoft", "windows", "msftconnect", "cryptoapi",
-            "delivery-optimization", "tlu.dl.delivery.mp.microsoft.com",
-            "delivery.mp.microsoft.com", "officecdn", "windowsupdate",
-            "update", "microsoft.com", "msedge.net"
-        ]
-        return any(k in ua for k in ms_keywords) or any(k in dest for k in ms_keywords) or any(k in url for k in ms_keywords)
-
-    df["ua_is_microsoft_system"] = df.apply(
-        lambda x: is_microsoft_system(x["user_agent.original"], x["destination.ip"], x["url.original"]),
-        axis=1
-    ).astype(int)
-
-    def dest_is_microsoft_domain(dest):
-        if not isinstance(dest, str):
-            return False
-        dest = dest.lower()
-        microsoft_domains = [
-            ".microsoft.com", ".windowsupdate.com", ".msedge.net",
-            ".delivery.mp.microsoft.com", ".officecdn.microsoft.com"
-        ]
-        return any(dest.endswith(k) or k in dest for k in microsoft_domains)
-
-    df["dest_is_microsoft"] = df["destination.ip"].apply(dest_is_microsoft_domain).astype(int)
-
-    # ========= 9️⃣ Non-Browser External =========
-    df["is_non_browser_external"] = (
-        (df["ua_is_browser"] == 0) &
-        (df["dst_is_internal_ip"] == 0) &
-        (df["protocol_is_http"] == 1)
-    ).astype(int)
-
-    # ========= 🔟 Risk Scoring =========
-    df["risk_score"] = (
-        (df["is_suspicious_http"] * 2)
-        + (df["is_python_to_external"] * 3)
-        + (df["is_non_browser_external"] * 2)
-        + (df["is_http_external"] * 1)
-        - (df["is_openstack_internal"] * 2)
-    ).clip(lower=0, upper=10)
+    if wanted("is_http_external"):
+        df["is_http_external"] = ((df["protocol_is_http"] == 1) & (df["dst_is_internal_ip"] == 0)).astype(int)
+    if wanted("is_suspicious_http"):
+        df["is_suspicious_http"] = ((df["is_http_external"] == 1) & (df["ua_is_empty"] == 1)).astype(int)
+    if wanted("is_python_to_external"):
+        df["is_python_to_external"] = ((df["ua_is_python_script"] == 1) & (df["dst_is_internal_ip"] == 0)).astype(int)
+    if wanted("is_openstack_internal"):
+        df["is_openstack_internal"] = ((df["ua_is_openstack"] == 1) & (df["dst_is_internal_ip"] == 1)).astype(int)
+
+    # ========= 8️⃣ Non-Browser External =========
+    if wanted("is_non_browser_external"):
+        df["is_non_browser_external"] = (
+            (df["ua_is_browser"] == 0) &
+            (df["dst_is_internal_ip"] == 0) &
+            (df["protocol_is_http"] == 1)
+        ).astype(int)
+
+    # ========= 9️⃣ Risk Scoring =========
+    if wanted("risk_score"):
+        df["risk_score"] = (
+            (df["is_suspicious_http"] * 2)
+            + (df["is_python_to_external"] * 3)
+            + (df["is_non_browser_external"] * 2)
+            + (df["is_http_external"] * 1)
+            - (df["is_openstack_internal"] * 2)
+        ).clip(lower=0, upper=10)
+    laps.mark("risk")
 
     # ========= 🔟 รวมทั้งหมด =========
     final_df = pd.concat([
-        df[[
-            "status_code", "hour", "weekday", "is_error", "url_length",
-            "num_special_chars", "contains_suspicious_keyword", "is_night",
-            "src_is_private_ip", "dst_is_public_ip", "ip_match_local",
-            "is_common_port", "protocol_is_http", "req_method_is_post",
-            "is_referrer_missing", "same_country",
-            "ua_is_browser", "ua_is_microsoft", "ua_is_python_script",
-            "ua_is_openstack", "ua_is_cloud_service", "ua_is_bot",
-            "ua_is_windows_update", "ua_is_microsoft_system", "dest_is_microsoft",
-            "is_non_browser_external", "is_http_external", "is_suspicious_http",
-            "is_python_to_external", "is_openstack_internal", "risk_score"
-        ]],
-        df[[f"source_ip_oct{i}" for i in range(1, 5)] +
-           [f"destination_ip_oct{i}" for i in range(1, 5)]],
+        df[selected(BASE_FEATURES)],
+        df[selected(IP_OCTET_FEATURES)],
         url_df
     ], axis=1)
 
@@ -196,85 +547,436 @@ def transform_data(df, mode="auto"):
                 final_df = final_df.drop(columns=[col])
 
     # ========= 🧩 เพิ่มฟีเจอร์เชิงพฤติกรรมใหม่ =========
-    # เพิ่มเฉพาะ 5 ตัวที่ยังไม่มี
-    df["url.original"] = df["url.original"].fillna("-").astype(str)
+    # เพิ่มเฉพาะ 5 ตัวที่ยังไม่มี (pipeline ที่ prune แล้ว → เฉพาะตัวที่เลือกไว้)
+    behavior = selected(BEHAVIOR_FEATURES)
     df["http.request.method"] = df["http.request.method"].fillna("-").astype(str)
-    df["user_agent.original"] = df["user_agent.original"].fillna("-").astype(str)
-    df["http.request.referrer"] = df["http.request.referrer"].fillna("-").astype(str)
 
-    if "url_depth" not in final_df.columns:
-        final_df["url_depth"] = df["url.original"].apply(lambda x: x.count("/") if isinstance(x, str) else 0)
+    if "url_depth" in behavior and "url_depth" not in final_df.columns:
+        final_df["url_depth"] = df["url_depth"]
 
-    if "has_query" not in final_df.columns:
-        final_df["has_query"] = df["url.original"].apply(lambda x: "?" in x)
+    if "has_query" in behavior and "has_query" not in final_df.columns:
+        final_df["has_query"] = df["has_query"]
 
-    if "method_is_uncommon" not in final_df.columns:
+    if "method_is_uncommon" in behavior and "method_is_uncommon" not in final_df.columns:
         uncommon = {"PUT", "DELETE", "OPTIONS", "TRACE", "CONNECT"}
         final_df["method_is_uncommon"] = df["http.request.method"].str.upper().isin(uncommon)
 
-    if "referrer_is_external" not in final_df.columns:
-        def is_external_ref(row):
-            try:
-                ref_host = urlparse(row["http.request.referrer"]).hostname or ""
-                dest_host = urlparse(row["url.original"]).hostname or ""
-                return bool(ref_host and dest_host and ref_host != dest_host)
-            except:
-                return False
-        final_df["referrer_is_external"] = df.apply(is_external_ref, axis=1)
+    if "referrer_is_external" in behavior and "referrer_is_external" not in final_df.columns:
+        final_df["referrer_is_external"] = df["referrer_is_external"]
+
+    if "ua_length" in behavior and "ua_length" not in final_df.columns:
+        final_df["ua_length"] = df["ua_length"]
 
-    if "ua_length" not in final_df.columns:
-        final_df["ua_length"] = df["user_agent.original"].apply(lambda x: len(x) if isinstance(x, str) else 0)
+    print(f"✅ Added new features: {', '.join(behavior) or '(none — pruned)'}")
 
-    print("✅ Added new features: url_depth, has_query, method_is_uncommon, referrer_is_external, ua_length")
+    # ========= 🪟 Session / behavior window (session_window_s ไม่ตั้ง → ไม่มีกลุ่มนี้) =========
+    # session_values: คำนวณไว้แล้ว (prepare ทั้ง dataset ก่อน split, verdict cache) ลำดับแถวเดียวกับ df
+    # ส่งเป็น argument เท่านั้น ไม่อ่านจากคอลัมน์ของ input → request ส่งค่า window ปลอมเข้ามาไม่ได้
+    # streaming (session) → ต่อ state ข้าม chunk/request
+    windowed = selected(SESSION_FEATURES) if session_window_s else []
+    if windowed:
+        if session_values is None:
+            session_values = session.update_frame(df) if session is not None else session_features(df, session_window_s)
+        for col in windowed:
+            final_df[col] = session_values[col].to_numpy()
+        laps.mark("session")
 
+    final_df = enforce_feature_schema(final_df)
+    laps.mark("assemble_schema")
     return final_df
 
 
+# -------------------------------------
+# 🏎 Single-record fast path: dict → feature vector โดยไม่ผ่าน pandas
+# -------------------------------------
+# ให้ผลเหมือน transform_data(pd.DataFrame([record], dtype=object), mode="predict") ทุกคอลัมน์
+# ค่าที่รูปแบบแปลก (timestamp/status ที่ไม่ใช่แบบปกติ) ส่งให้ pandas ตัดสินทีละค่า
+ISO_TIMESTAMP_RE = re.compile(r"(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:\.\d{1,9})?(?:Z|[+-]\d{2}:\d{2})?")
+ISO_TIMESTAMP_PARTS_RE = re.compile(r"(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,9}))?(Z|[+-]\d{2}:\d{2})?")
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+STATUS_CODE_RE = re.compile(r"[0-9]{1,9}")
+URL_TOKEN_RE = re.compile(r"[a-zA-Z]{3,}")
+SUSPICIOUS_URL_RE = re.compile("login|admin|cmd|token|download|shell", re.IGNORECASE)
+HTTP_RE = re.compile("http", re.IGNORECASE)
+UA_PATTERNS = {
+    "ua_is_browser": re.compile("mozilla|chrome|safari|edge|firefox"),
+    "ua_is_microsoft": re.compile("microsoft|windows|cryptoapi|msftconnect|delivery-optimization"),
+    "ua_is_python_script": re.compile("python|requests|urllib|aiohttp"),
+    "ua_is_openstack": re.compile("magnum|keystoneauth|openstack"),
+    "ua_is_cloud_service": re.compile("aws|google|gcp|azure|cloudflare"),
+    "ua_is_bot": re.compile("bot|crawler|curl"),
+    "ua_is_windows_update": re.compile("microsoft|windows"),
+}
+MS_SYSTEM_RE = re.compile(keyword_pattern(MS_SYSTEM_KEYWORDS))
+MS_DOMAINS_RE = re.compile(keyword_pattern(MS_DOMAINS))
+UNCOMMON_METHODS = {"PUT", "DELETE", "OPTIONS", "TRACE", "CONNECT"}
+
+
+def fill_value(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return "-"
+    return value
+
+
+def record_hour_weekday(value):
+    if isinstance(value, str):
+        m = ISO_TIMESTAMP_RE.fullmatch(value)
+        if m:
+            try:
+                ts = datetime.datetime(*(int(g) for g in m.groups()))
+                # นอกช่วง Timestamp ของ pandas (ns) จะกลายเป็น NaT → ให้ pandas ตัดสิน
+                if 1677 < ts.year < 2262:
+                    return ts.hour, ts.weekday()
+            except ValueError:
+                pass
+    ts = pd.to_datetime(pd.Series([value], dtype=object), errors="coerce")
+    return int(ts.dt.hour.fillna(0).iloc[0]), int(ts.dt.weekday.fillna(0).iloc[0])
+
+
+# @timestamp → epoch ms แบบเดียวกับ timestamps_ms (utc, ไม่มี timezone ถือเป็น UTC); None = parse ไม่ได้
+def record_time_ms(value):
+    if isinstance(value, str):
+        m = ISO_TIMESTAMP_PARTS_RE.fullmatch(value)
+        if m:
+            *parts, fraction, offset = m.groups()
+            try:
+                ts = datetime.datetime(*(int(g) for g in parts), tzinfo=datetime.timezone.utc)
+                if 1677 < ts.year < 2262:
+                    ms = (ts - EPOCH) // datetime.timedelta(milliseconds=1) + int((fraction or "0")[:3].ljust(3, "0"))
+                    if offset and offset != "Z":
+                        minutes = int(offset[1:3]) * 60 + int(offset[4:6])
+                        ms -= (1 if offset[0] == "+" else -1) * minutes * 60000
+                    return ms
+            except ValueError:
+                pass
+    ms, valid = timestamps_ms(pd.Series([value], dtype=object))
+    return int(ms[0]) if valid[0] else None
+
+
+def record_status_code(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and STATUS_CODE_RE.fullmatch(value):
+        return int(value)
+    return int(pd.to_numeric(pd.Series([value], dtype=object), errors="coerce").fillna(0).astype(int).iloc[0])
+
+
+def url_tfidf(url, vectorizer):
+    """TfidfVectorizer.transform([url]) สำหรับ 1 record (lowercase → นับ token → idf → l2)"""
+    counts = [0] * len(URL_TOKENS)
+    for token in URL_TOKEN_RE.findall(url.lower()):
+        j = vectorizer.vocabulary_.get(token)
+        if j is not None:
+            counts[j] += 1
+    values = [c * idf for c, idf in zip(counts, vectorizer.idf_.tolist())]
+    norm = math.sqrt(sum(v * v for v in values if v))
+    return [v / norm for v in values] if norm else values
+
+
+def record_session_event(record):
+    """record → (t_ms, src, dst, url, is_error) ที่ SessionStore นับเข้า window"""
+    r = {f: fill_value(record[f]) for f in ("@timestamp", "source.ip", "destination.ip", "url.original", "http.response.status_code")}
+    is_error = record_status_code(r["http.response.status_code"]) >= 400
+    return record_time_ms(r["@timestamp"]), str(r["source.ip"]), str(r["destination.ip"]), str(r["url.original"]), is_error
+
+
+def record_session_values(record, session):
+    """record → ค่า SESSION_FEATURES และนับ record นี้เข้า window ของ session"""
+    return session.update(*record_session_event(record))
+
+
+def records_session_values(records, session):
+    """หลาย record → ค่า SESSION_FEATURES ต่อ record, นับเข้า window ทีเดียวทั้งชุด (เรียงตามเวลา, lock ครั้งเดียว)
+    field หาย → KeyError ก่อนแตะ state (ไม่มี record ไหนถูกนับไปแล้วครึ่งชุด)"""
+    return session.update_many([record_session_event(record) for record in records])
+
+
+def record_to_features(record, vectorizer, need=None, session=None, session_values=None):
+    """need (จาก required_features) → ข้ามกลุ่มที่แพง (timestamp, ipaddress, regex, urlparse, TF-IDF) ที่ไม่ได้ใช้
+    session (SessionStore) → เพิ่ม SESSION_FEATURES และนับ record นี้เข้า window | session_values → ใช้ค่าที่คำนวณไว้แล้ว"""
+    wanted = feature_filter(need)
+    r = {f: fill_value(record[f]) for f in INPUT_FIELDS}
+    url = str(r["url.original"])
+    ua = str(r["user_agent.original"])
+    src_ip, dest_ip = str(r["source.ip"]), str(r["destination.ip"])
+    referrer = str(r["http.request.referrer"])
+    method = str(r["http.request.method"])
+
+    f = {}
+    f["status_code"] = record_status_code(r["http.response.status_code"])
+    if wanted("hour", "weekday"):
+        f["hour"], f["weekday"] = record_hour_weekday(r["@timestamp"])
+        f["is_night"] = int(f["hour"] <= 5 or f["hour"] >= 22)
+    f["is_error"] = int(f["status_code"] >= 400)
+    f["url_length"] = len(url)
+    f["num_special_chars"] = sum(url.count(c) for c in "?=&%")
+    if wanted("contains_suspicious_keyword"):
+        f["contains_suspicious_keyword"] = int(SUSPICIOUS_URL_RE.search(url) is not None)
+
+    # ค่าดิบ (ไม่ใช่ str) → IP ที่เป็น int จาก JSON ได้ผลเดียวกับทาง DataFrame
+    if wanted("src_is_private_ip"):
+        f["src_is_private_ip"] = int(is_internal_ip(r["source.ip"]))
+    if wanted("dst_is_internal_ip"):
+        dst_internal = int(is_internal_ip(r["destination.ip"]))
+        f["dst_is_public_ip"] = int(dst_internal == 0)
+    f["ip_match_local"] = int(src_ip.split(".")[0] == dest_ip.split(".")[0])
+
+    f["is_common_port"] = int(str(r["destination.port"]) in ("80", "443", "8080"))
+    f["protocol_is_http"] = int(HTTP_RE.search(str(r["network.protocol"])) is not None)
+    f["req_method_is_post"] = int(method.upper() == "POST")
+    f["is_referrer_missing"] = int(referrer.strip() in ("-", "", "none"))
+    src_cc = r["source.geoip.country_code2"]
+    f["same_country"] = int(str(src_cc).upper() == str(r["destination.geoip.country_code2"]).upper() and src_cc != "-")
+
+    ua_lower = ua.lower()
+    ua_is_empty = int(ua_lower == "-")
+    for name, pattern in UA_PATTERNS.items():
+        if wanted(name):
+            f[name] = int(pattern.search(ua_lower) is not None)
+    if wanted("ua_is_microsoft_system"):
+        f["ua_is_microsoft_system"] = int(
+            MS_SYSTEM_RE.search(ua_lower) is not None
+            or MS_SYSTEM_RE.search(dest_ip.lower()) is not None
+            or MS_SYSTEM_RE.search(url.lower()) is not None
+        )
+    if wanted("dest_is_microsoft"):
+        dest_raw = r["destination.ip"]
+        f["dest_is_microsoft"] = int(isinstance(dest_raw, str) and MS_DOMAINS_RE.search(dest_raw.lower()) is not None)
+
+    # required_features รับประกันว่าตัวที่พึ่ง (dst_internal, UA flag) ถูกคำนวณแล้ว
+    if wanted("is_http_external"):
+        f["is_http_external"] = int(f["protocol_is_http"] == 1 and dst_internal == 0)
+    if wanted("is_non_browser_external"):
+        f["is_non_browser_external"] = int(f["ua_is_browser"] == 0 and dst_internal == 0 and f["protocol_is_http"] == 1)
+    if wanted("is_suspicious_http"):
+        f["is_suspicious_http"] = int(f["is_http_external"] == 1 and ua_is_empty == 1)
+    if wanted("is_python_to_external"):
+        f["is_python_to_external"] = int(f["ua_is_python_script"] == 1 and dst_internal == 0)
+    if wanted("is_openstack_internal"):
+        f["is_openstack_internal"] = int(f["ua_is_openstack"] == 1 and dst_internal == 1)
+    if wanted("risk_score"):
+        f["risk_score"] = min(max(
+            f["is_suspicious_http"] * 2 + f["is_python_to_external"] * 3 + f["is_non_browser_external"] * 2
+            + f["is_http_external"] - f["is_openstack_internal"] * 2, 0), 10)
+
+    if wanted(*IP_OCTET_FEATURES):
+        octets = ip_to_octets(src_ip) + ip_to_octets(dest_ip)
+        f.update(zip(IP_OCTET_FEATURES, octets))
+    if wanted(*URL_TOKENS):
+        f.update(zip(URL_TOKENS, url_tfidf(url, vectorizer)))
+
+    f["url_depth"] = url.count("/")
+    f["has_query"] = "?" in url
+    f["method_is_uncommon"] = method.upper() in UNCOMMON_METHODS
+    if wanted("referrer_is_external"):
+        f["referrer_is_external"] = is_external_referrer(referrer, url)
+    f["ua_length"] = len(ua)
+    if wanted(*SESSION_FEATURES):
+        if session_values is None and session is not None:
+            session_values = record_session_values(record, session)
+        if session_values is not None:
+            f.update(zip(SESSION_FEATURES, session_values))
+    return f
+
+
+# -------------------------------------
+# 🧱 FeatureTransformer: fit ครั้งเดียวตอน prepare, ตอน predict แค่ transform
+# -------------------------------------
+TRANSFORMER_FILENAME = "feature-transformer.pkl"
+
+
+class FeatureTransformer:
+    def __init__(self, session_window_s=None):
+        self.vectorizer = None
+        # None = ครบ FEATURE_COLUMNS | list = pipeline ที่ prune แล้ว (model_compaction.py) → คำนวณ/ออกเฉพาะคอลัมน์เหล่านี้
+        self.features = None
+        self.required = None
+        # วินาที → เพิ่ม SESSION_FEATURES ต่อท้าย (transformer รุ่นเก่าไม่มี → None = ปิด)
+        self.session_window_s = session_window_s
+
+    @property
+    def all_columns(self):
+        return FEATURE_COLUMNS + (SESSION_FEATURES if self.session_window_s else [])
+
+    @property
+    def columns(self):
+        return self.features or self.all_columns
+
+    def prune(self, features):
+        unknown = set(features) - set(self.all_columns)
+        if unknown:
+            raise ValueError(f"❌ Unknown feature(s): {sorted(unknown)}")
+        keep = set(features)
+        self.features = [c for c in self.all_columns if c in keep]
+        self.required = required_features(self.features)
+        return self
+
+    def fit(self, df):
+        self.vectorizer = make_url_vectorizer()
+        self.vectorizer.fit(df["url.original"].fillna("-").astype(str))
+        return self
+
+    # 🪟 state ของ session window สำหรับ stream หนึ่ง (predict ทีละ chunk, live_predict, ml-serve); ปิดอยู่ → None
+    def new_session(self):
+        return SessionStore(self.session_window_s) if self.session_window_s else None
+
+    # โมเดลใช้ SESSION_FEATURES อย่างน้อย 1 ตัว (ไม่ถูก prune ทิ้งหมด)
+    @property
+    def uses_session(self):
+        return bool(self.session_window_s) and (self.required is None or not self.required.isdisjoint(SESSION_FEATURES))
+
+    # คำนวณ window ล่วงหน้า (แล้วส่งเป็น session_values) — ไม่ใช้ session feature → None
+    def session_frame(self, df, session=None):
+        if not self.uses_session:
+            return None
+        return session.update_frame(df) if session is not None else session_features(df, self.session_window_s)
+
+    def session_records(self, records, session=None):
+        if not self.uses_session:
+            return None
+        return records_session_values(records, session if session is not None else self.new_session())
+
+    def transform(self, df, mode="auto", session=None, session_values=None):
+        if self.vectorizer is None:
+            raise RuntimeError("❌ FeatureTransformer is not fitted. Call fit() first.")
+        return transform_data(df, mode=mode, vectorizer=self.vectorizer, features=self.features,
+                              session_window_s=self.session_window_s, session=session, session_values=session_values)
+
+    # 🏎 1 record → feature vector ตามลำดับ columns (ไม่ผ่าน pandas)
+    # ไม่มี session → record นี้ถูกมองเป็น request เดียวใน window ของมัน
+    def transform_record(self, record, session=None, session_values=None):
+        if self.vectorizer is None:
+            raise RuntimeError("❌ FeatureTransformer is not fitted. Call fit() first.")
+        if session is None and session_values is None:
+            session = self.new_session()
+        features = record_to_features(record, self.vectorizer, self.required, session, session_values)
+        columns = self.columns
+        return enforce_record_schema([features[c] for c in columns], columns)
+
+    def fit_transform(self, df, mode="auto"):
+        return self.fit(df).transform(df, mode=mode)
+
+    # เก็บเป็น dict ของ state ไม่ใช่ตัว object → โหลดได้แม้ตอน save รันเป็น __main__
+    def save(self, path):
+        # เขียนไฟล์ชั่วคราวแล้ว rename → ml-serve ที่ watch ไฟล์อยู่ไม่เห็นไฟล์ครึ่ง ๆ กลาง ๆ
+        joblib.dump(dict(self.__dict__), path + ".tmp")
+        os.replace(path + ".tmp", path)
+        print(f"💾 Feature transformer saved → {path}")
+        return path
+
+    @classmethod
+    def load(cls, path):
+        transformer = cls()
+        transformer.__dict__.update(joblib.load(path))
+        return transformer
+
+
+def transformer_path_for(model_path):
+    return os.path.join(os.path.dirname(os.path.abspath(model_path)), TRANSFORMER_FILENAME)
+
+
+def load_feature_transformer(model_path):
+    """โหลด transformer ที่อยู่ข้าง model; ถ้าไม่มี (โมเดลรุ่นเก่า) คืน None → transform_data จะ fit กับ batch แทน"""
+    path = transformer_path_for(model_path)
+    if not os.path.exists(path):
+        print(f"⚠️ {TRANSFORMER_FILENAME} not found next to model — TF-IDF will be fitted per batch")
+        return None
+    transformer = FeatureTransformer.load(path)
+    print(f"🧱 Feature transformer loaded → {path}")
+    if transformer.features:
+        print(f"✂️ Pruned feature pipeline: {len(transformer.features)} / {len(transformer.all_columns)} features")
+    if transformer.session_window_s:
+        print(f"🪟 Session features over a {transformer.session_window_s:g}s window")
+    return transformer
+
+
 # -------------------------------------
 # 🚀 main() สำหรับ training mode
 # -------------------------------------
+# แถวของ window ที่คำนวณบนทั้ง dataset ตามลำดับแถวของ part (หลัง split)
+def windows_of(windows, part):
+    return None if windows is None else windows.loc[part.index]
+
+
 def main():
     input_folder = sys.argv[1]
     output_folder = sys.argv[2]
     test_pct = int(os.getenv("TEST_SET_PCT", 20))
 
-    keep_fields = [
-        "@timestamp", "source.ip", "destination.ip", "url.original",
-        "http.response.status_code", "destination.port", "network.protocol",
-        "user_agent.original", "http.request.method", "http.request.referrer",
-        "source.geoip.country_code2", "destination.geoip.country_code2",
-        "ioc.dest_ip_misp_is_alert"
-    ]
+    keep_fields = INPUT_FIELDS + ["ioc.dest_ip_misp_is_alert"]
 
     os.makedirs(output_folder, exist_ok=True)
-    df = load_csv(input_folder, keep_fields)
+    start_run("prepare_data", output_folder)
     script_path = os.path.join(input_folder, "script_attacks.csv")
-    if os.path.exists(script_path):
-        print("⚡ Merging script_attacks.csv into dataset...")
-        df_script = pd.read_csv(script_path, on_bad_lines="skip")
-        for col in keep_fields:
-            if col not in df_script.columns:
-                df_script[col] = None
-        df = pd.concat([df, df_script[keep_fields]], ignore_index=True)
-    else:
-        print("⚠️ script_attacks.csv not found — skipping merge")
-
-    df_transformed = transform_data(df, mode="train")
 
-    print("✅ Dataset size:", df_transformed.shape)
-    if "label" in df_transformed.columns:
-        print(df_transformed["label"].value_counts())
-
-    train_df, test_df = train_test_split(
-        df_transformed,
-        test_size=test_pct/100,
-        random_state=42,
-        stratify=df_transformed["label"] if "label" in df_transformed else None
-    )
-
-    train_df.to_csv(os.path.join(output_folder, "training-set.csv"), index=False)
-    test_df.to_csv(os.path.join(output_folder, "testing-set.csv"), index=False)
+    # 🗄 input ชุดเดิม + TEST_SET_PCT เดิม + pipeline เดิม → ใช้ feature block จาก cache ไม่ต้อง transform ใหม่
+    cache = open_feature_cache(output_folder)
+    if cache:
+        with stage("cache_lookup"):
+            inputs = [input_folder] if os.path.isfile(input_folder) else list_inputs(input_folder)
+            if os.path.exists(script_path) and script_path not in inputs:
+                inputs.append(script_path)
+            run_key = cache.key("prepare", test_pct, SESSION_WINDOW_S, *[file_sha256(f) for f in inputs])
+            cached = [cache.get(run_key + "-train"), cache.get(run_key + "-test"), cache.get_object(run_key + "-transformer")]
+
+    if cache and all(item is not None for item in cached):
+        print(f"♻️ Feature cache hit — skipping transform ({run_key})")
+        train_df, test_df, state = cached
+        transformer = FeatureTransformer()
+        transformer.__dict__.update(state)
+    else:
+        with stage("load") as info:
+            df = load_csv(input_folder, keep_fields)
+            if os.path.exists(script_path):
+                print("⚡ Merging script_attacks.csv into dataset...")
+                df_script = pd.read_csv(script_path, on_bad_lines="skip")
+                for col in keep_fields:
+                    if col not in df_script.columns:
+                        df_script[col] = None
+                df = pd.concat([df, df_script[keep_fields]], ignore_index=True)
+            else:
+                print("⚠️ script_attacks.csv not found — skipping merge")
+            info["rows"] = len(df)
+
+        # 🪟 window ต้องเห็นทุก request ตามเวลา → คำนวณบนทั้ง dataset ก่อน split (แยกกันคำนวณ → test ได้ window ที่ขาดแถว)
+        windows = None
+        if SESSION_WINDOW_S:
+            with stage("session_features", rows=len(df)):
+                windows = session_features(df, SESSION_WINDOW_S)
+
+        # split ก่อน แล้ว fit transformer กับ train เท่านั้น (IDF ไม่รั่วจาก test set)
+        with stage("split", rows=len(df)):
+            labels = df["ioc.dest_ip_misp_is_alert"].fillna(0).astype(int)
+            train_raw, test_raw = train_test_split(
+                df,
+                test_size=test_pct/100,
+                random_state=42,
+                stratify=labels
+            )
+
+        transformer = FeatureTransformer(session_window_s=SESSION_WINDOW_S or None)
+        with stage("fit_transform_train", rows=len(train_raw)):
+            train_df = transformer.fit(train_raw).transform(train_raw, mode="train", session_values=windows_of(windows, train_raw))
+        with stage("transform_test", rows=len(test_raw)):
+            test_df = transformer.transform(test_raw, mode="train", session_values=windows_of(windows, test_raw))
+        if cache:
+            with stage("cache_store"):
+                cache.put(run_key + "-train", train_df)
+                cache.put(run_key + "-test", test_df)
+                cache.put_object(run_key + "-transformer", dict(transformer.__dict__))
+    transformer.save(os.path.join(output_folder, TRANSFORMER_FILENAME))
+    if cache:
+        print(cache.summary())
+
+    print("✅ Dataset size:", (len(train_df) + len(test_df), train_df.shape[1]))
+    print(pd.concat([train_df["label"], test_df["label"]]).value_counts())
+
+    # ARTIFACT_FORMAT=parquet → flag เป็น bool/int8, ตัวเลขอื่น downcast
+    with stage("write", rows=len(train_df) + len(test_df)):
+        for name, frame in [("training-set", train_df), ("testing-set", test_df)]:
+            print(f"💾 Saved → {write_artifact(frame, artifact_path(output_folder, name))}")
     print("✅ Data saved successfully.")
+    finish_run(rows=len(train_df) + len(test_df), cache_hit=bool(cache and cache.hits and not cache.misses))
 
 
 if __name__ == "__main__":
@@ -1,6 +1,7 @@
-import os
+import os, sys, shutil
 import pandas as pd
 import subprocess
+from artifacts import find_artifact, read_artifact
 
 # -----------------------------
 # 🌍 Path Settings
@@ -15,11 +16,11 @@ os.makedirs(OUTPUT_DIR, exist_ok=True)
 # -----------------------------
 # 1️⃣ Extract whitelist traffic
 # -----------------------------
-predict_file = os.path.join(OUTPUT_DIR, "predict_result.csv")
-if not os.path.exists(predict_file):
-    raise FileNotFoundError("❌ ไม่พบไฟล์ predict_result.csv กรุณารัน predict ก่อน retrain")
+predict_file = find_artifact(OUTPUT_DIR, "predict_result")
+if not predict_file:
+    raise FileNotFoundError("❌ ไม่พบไฟล์ predict_result (.csv / .parquet) กรุณารัน predict ก่อน retrain")
 
-df = pd.read_csv(predict_file)
+df = read_artifact(predict_file)
 
 # เงื่อนไขดึง Microsoft / Windows traffic
 whitelist_df = df[
@@ -43,6 +44,16 @@ dataset_new = os.path.join(OUTPUT_DIR, "dataset_v4.csv")
 if not os.path.exists(dataset_old):
     raise FileNotFoundError("❌ ไม่พบ dataset_v3.csv กรุณาตรวจสอบไฟล์ dataset")
 
+# 🔁 RETRAIN_MODE=incremental → ต่อ boosting จากโมเดลเดิมด้วยแถวใหม่เท่านั้น (ไม่ prepare/train ใหม่ทั้งหมด)
+if os.getenv("RETRAIN_MODE", "full") == "incremental":
+    from incremental_retrain import incremental_retrain
+    if not os.path.exists(dataset_new):
+        shutil.copyfile(dataset_old, dataset_new)
+    print("\n🔁 Incremental retrain ...")
+    if incremental_retrain(whitelist_df, dataset_new, OUTPUT_DIR):
+        print("\n✅ Incremental retrain completed successfully! 🎉")
+    sys.exit(0)
+
 df_main = pd.read_csv(dataset_old)
 df_merge = pd.concat([df_main, whitelist_df], ignore_index=True)
 df_merge.to_csv(dataset_new, index=False)
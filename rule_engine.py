@@ -0,0 +1,169 @@
+import re, json, ipaddress
+import numpy as np
+import pandas as pd
+
+# -------------------------------------
+# 📜 Rule engine: rule แบบ declarative (JSON) → compile ครั้งเดียว → ใช้ได้ทั้งทีละ record และทั้ง frame
+# -------------------------------------
+# condition: {"field": ..., "lower": bool, <op>: value}  |  {"all": [...]}  |  {"any": [...]}  |  {"not": {...}}
+# op: contains (keyword list หรือชื่อใน keyword_sets → regex alternation เดียว), startswith, equals,
+#     in / not_in, is_private_ip, lt / gte (ตัวเลข), same_as (เทียบกับอีก field)
+# ค่าถูกแปลงด้วย str() เหมือน logic เดิม (NaN → "nan", None → "None", 200.0 → "200.0")
+# แบบ frame: คำนวณบนค่า unique ของแต่ละคอลัมน์แล้ว gather กลับ (log ซ้ำกันสูง)
+TEXT_OPS = ["contains", "startswith", "equals", "in", "not_in", "is_private_ip"]
+
+
+def is_internal_ip(ip):
+    try: return ipaddress.ip_address(ip).is_private
+    except: return False
+
+
+class FrameView:
+    """cache ค่า unique ต่อ (field, lower) ระหว่างประเมิน rule หลายตัวบน frame เดียวกัน"""
+
+    def __init__(self, df):
+        self.df = df
+        self.cache = {}
+
+    def text(self, field, lower):
+        key = (field, lower)
+        if key not in self.cache:
+            column = self.df[field] if field in self.df.columns else pd.Series("", index=self.df.index)
+            codes, uniques = pd.factorize(column.astype(str))
+            uniques = pd.Series(uniques, dtype=object)
+            self.cache[key] = (codes, uniques.str.lower() if lower else uniques)
+        return self.cache[key]
+
+
+class Condition:
+    def __init__(self, spec, keyword_sets):
+        self.field = spec["field"]
+        self.lower = spec.get("lower", False)
+        self.default = spec.get("default", "")
+        ops = [op for op in TEXT_OPS + ["lt", "gte", "same_as"] if op in spec]
+        if len(ops) != 1:
+            raise ValueError(f"❌ Rule condition on '{self.field}' needs exactly one operator, got {ops or 'none'}")
+        self.op = ops[0]
+        value = spec[self.op]
+        if self.op in ("contains", "in", "not_in"):
+            value = keyword_sets[value] if isinstance(value, str) else value
+        if self.op == "contains":
+            self.regex = re.compile("|".join(re.escape(k) for k in value))
+        self.value = set(value) if self.op in ("in", "not_in") else value
+
+    # field ที่ condition นี้อ่าน (same_as อ่านอีก field ด้วย)
+    def fields(self):
+        return {self.field, self.value} if self.op == "same_as" else {self.field}
+
+    def text_test(self, text):
+        if self.op == "contains":
+            return self.regex.search(text) is not None
+        if self.op == "startswith":
+            return text.startswith(self.value)
+        if self.op == "equals":
+            return text == self.value
+        if self.op == "in":
+            return text in self.value
+        if self.op == "not_in":
+            return text not in self.value
+        return is_internal_ip(text)
+
+    def match(self, row):
+        value = row.get(self.field, self.default)
+        if self.op in ("lt", "gte"):
+            return value < self.value if self.op == "lt" else value >= self.value
+        if self.op == "same_as":
+            return str(value) == str(row.get(self.value, self.default))
+        text = str(value)
+        return self.text_test(text.lower() if self.lower else text)
+
+    def mask(self, view):
+        df = view.df
+        if self.op in ("lt", "gte"):
+            values = pd.to_numeric(df[self.field], errors="coerce") if self.field in df.columns else pd.Series(self.default, index=df.index)
+            return (values < self.value if self.op == "lt" else values >= self.value).to_numpy(dtype=bool)
+        if self.op == "same_as":
+            left_codes, left = view.text(self.field, False)
+            right_codes, right = view.text(self.value, False)
+            return left.to_numpy(dtype=object)[left_codes] == right.to_numpy(dtype=object)[right_codes]
+        codes, uniques = view.text(self.field, self.lower)
+        if self.op == "contains":
+            hits = uniques.str.contains(self.regex, regex=True).to_numpy(dtype=bool)
+        elif self.op == "startswith":
+            hits = uniques.str.startswith(self.value).to_numpy(dtype=bool)
+        else:
+            hits = np.fromiter((self.text_test(u) for u in uniques), dtype=bool, count=len(uniques))
+        return hits[codes]
+
+
+class Group:
+    def __init__(self, kind, children):
+        self.kind = kind
+        self.children = children
+
+    def fields(self):
+        return set().union(*(child.fields() for child in self.children))
+
+    def match(self, row):
+        if self.kind == "not":
+            return not self.children[0].match(row)
+        test = all if self.kind == "all" else any
+        return test(child.match(row) for child in self.children)
+
+    def mask(self, view):
+        masks = [child.mask(view) for child in self.children]
+        if self.kind == "not":
+            return ~masks[0]
+        return np.logical_and.reduce(masks) if self.kind == "all" else np.logical_or.reduce(masks)
+
+
+def compile_condition(spec, keyword_sets):
+    for kind in ("all", "any"):
+        if kind in spec:
+            return Group(kind, [compile_condition(s, keyword_sets) for s in spec[kind]])
+    if "not" in spec and isinstance(spec["not"], dict):
+        return Group("not", [compile_condition(spec["not"], keyword_sets)])
+    return Condition(spec, keyword_sets)
+
+
+class RuleSet:
+    def __init__(self, config):
+        keyword_sets = config.get("keyword_sets", {})
+        self.threshold = float(config.get("threshold", 0.5))
+        self.whitelist = [(r["name"], compile_condition(r, keyword_sets)) for r in config.get("whitelist", [])]
+        self.post_filter_rules = [(r["name"], compile_condition(r, keyword_sets)) for r in config.get("post_filter", [])]
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    # ทุก field ที่ rule อ่าน (รวม prob_1) → ใช้ทำ key ของ verdict cache
+    @property
+    def fields(self):
+        return set().union(*(rule.fields() for _, rule in self.whitelist + self.post_filter_rules))
+
+    # ---- ทีละ record (dict / pandas row) ----
+    def is_whitelisted(self, row):
+        return any(rule.match(row) for _, rule in self.whitelist)
+
+    def post_filter(self, row, pred):
+        if pred == 1 and any(rule.match(row) for _, rule in self.post_filter_rules):
+            return 0
+        return pred
+
+    # ---- ทั้ง frame ----
+    def any_mask(self, rules, df, view=None):
+        view = view or FrameView(df)
+        if not rules or not len(df):
+            return np.zeros(len(df), dtype=bool)
+        return np.logical_or.reduce([rule.mask(view) for _, rule in rules])
+
+    def whitelist_mask(self, df):
+        return self.any_mask(self.whitelist, df)
+
+    def post_filter_frame(self, df, pred):
+        pred = np.asarray(pred).copy()
+        suppress = self.any_mask(self.post_filter_rules, df)
+        pred[(pred == 1) & suppress] = 0
+        return pred
@@ -0,0 +1,239 @@
+import os, json, glob, time, bisect, threading
+
+# -------------------------------------
+# 📊 Prometheus metrics ของ ml-serve (text exposition format, ไม่ต้องพึ่ง prometheus_client)
+# -------------------------------------
+# hot path: perf_counter ไม่กี่ครั้ง + lock ครั้งเดียวต่อ request / ต่อ batch
+# gunicorn หลาย worker → แต่ละ worker flush snapshot ลง SERVE_METRICS_DIR/serve-<pid>.json
+# แล้ว /metrics ของ worker ไหนก็ได้รวมทุกไฟล์ให้ (ไม่ตั้ง SERVE_METRICS_DIR → เฉพาะ process นี้)
+METRICS_DIR = os.getenv("SERVE_METRICS_DIR", "")
+FLUSH_S = float(os.getenv("SERVE_METRICS_FLUSH_S", 5))
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+ROW_BUCKETS = (1, 2, 5, 10, 32, 64, 128, 256, 512, 1024, 4096, 16384)
+STAGES = ("parse", "transform", "inference", "decide", "total")
+
+
+def new_histogram(buckets):
+    return {"counts": [0] * (len(buckets) + 1), "sum": 0.0}
+
+
+# le semantics: ค่าเท่ากับขอบ bucket นับเข้า bucket นั้น → bisect_left
+def observe(hist, buckets, value):
+    hist["counts"][bisect.bisect_left(buckets, value)] += 1
+    hist["sum"] += value
+
+
+class ServeMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.stages = {stage: new_histogram(LATENCY_BUCKETS) for stage in STAGES}
+        self.rows = new_histogram(ROW_BUCKETS)
+        self.batches = {}
+        self.totals = {"rows": 0, "alerts": 0, "whitelist": 0, "reloads": 0, "cache_hits": 0, "cache_misses": 0}
+        self.cache_entries = 0
+        self.model_version = None
+        self.flusher = None
+
+    # ---------- hot path ----------
+    def observe_request(self, status, parse_s, total_s, rows=0, alerts=0, whitelist=0):
+        with self.lock:
+            self.requests[status] = self.requests.get(status, 0) + 1
+            observe(self.stages["parse"], LATENCY_BUCKETS, parse_s)
+            observe(self.stages["total"], LATENCY_BUCKETS, total_s)
+            if rows:
+                observe(self.rows, ROW_BUCKETS, rows)
+                self.totals["rows"] += rows
+                self.totals["alerts"] += alerts
+                self.totals["whitelist"] += whitelist
+
+    # 1 ครั้งต่อการเรียก predict_records (micro-batch = หลาย request รวมกัน)
+    def observe_batch(self, path, transform_s, inference_s, decide_s):
+        with self.lock:
+            self.batches[path] = self.batches.get(path, 0) + 1
+            observe(self.stages["transform"], LATENCY_BUCKETS, transform_s)
+            observe(self.stages["inference"], LATENCY_BUCKETS, inference_s)
+            observe(self.stages["decide"], LATENCY_BUCKETS, decide_s)
+
+    # verdict cache: record ที่ตอบจาก cache / ต้องคำนวณ + ขนาด cache ปัจจุบันของ worker นี้
+    def observe_cache(self, hits, misses, entries):
+        with self.lock:
+            self.totals["cache_hits"] += hits
+            self.totals["cache_misses"] += misses
+            self.cache_entries = entries
+
+    def set_model(self, version, reloaded=False):
+        with self.lock:
+            self.model_version = version
+            if reloaded:
+                self.totals["reloads"] += 1
+
+    # ---------- snapshot / รวมหลาย worker ----------
+    def snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps({
+                "pid": os.getpid(),
+                "model_version": self.model_version,
+                "requests": self.requests,
+                "stages": self.stages,
+                "rows": self.rows,
+                "batches": self.batches,
+                "totals": self.totals,
+                "cache_entries": self.cache_entries,
+            }))
+
+    def flush(self):
+        if not METRICS_DIR:
+            return
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f"serve-{os.getpid()}.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + ".tmp", path)
+
+    # thread แยก flush เป็นระยะ → worker ที่ไม่ได้รับ /metrics ก็มีตัวเลขล่าสุด (start หลัง fork)
+    def start_flusher(self):
+        if not METRICS_DIR or self.flusher is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(FLUSH_S)
+                try:
+                    self.flush()
+                except OSError as e:
+                    print(f"⚠️ [METRICS] flush failed → {e}")
+
+        self.flusher = threading.Thread(target=loop, name="serve-metrics-flush", daemon=True)
+        self.flusher.start()
+
+    def collect(self):
+        if not METRICS_DIR:
+            return [self.snapshot()]
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(METRICS_DIR, "serve-*.json")):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self):
+        return render(self.collect())
+
+
+# worker ที่ตายไปแล้ว: counter ยังนับรวม (ไม่ให้ค่าถอยหลัง) แต่ไม่แสดง model_info
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+# เริ่ม server ใหม่ → ล้าง snapshot ของรอบก่อน (gunicorn on_starting)
+def clear_snapshots():
+    for path in glob.glob(os.path.join(METRICS_DIR, "serve-*.json")) if METRICS_DIR else []:
+        os.remove(path)
+
+
+def merge_histogram(total, hist):
+    if total is None:
+        return {"counts": list(hist["counts"]), "sum": hist["sum"]}
+    total["counts"] = [a + b for a, b in zip(total["counts"], hist["counts"])]
+    total["sum"] += hist["sum"]
+    return total
+
+
+def histogram_lines(name, buckets, hist, labels=""):
+    lines, cumulative = [], 0
+    sep = "," if labels else ""
+    for le, n in zip([*buckets, "+Inf"], hist["counts"]):
+        cumulative += n
+        lines.append(f'{name}_bucket{{{labels}{sep}le="{le}"}} {cumulative}')
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {hist['sum']:.6f}")
+    lines.append(f"{name}_count{suffix} {cumulative}")
+    return lines
+
+
+def render(snapshots):
+    requests, batches = {}, {}
+    totals = {"rows": 0, "alerts": 0, "whitelist": 0, "reloads": 0, "cache_hits": 0, "cache_misses": 0}
+    stages = {stage: None for stage in STAGES}
+    rows = None
+    for snap in snapshots:
+        for status, n in snap["requests"].items():
+            requests[status] = requests.get(status, 0) + n
+        for path, n in snap["batches"].items():
+            batches[path] = batches.get(path, 0) + n
+        for key in totals:
+            totals[key] += snap["totals"].get(key, 0)
+        for stage in STAGES:
+            stages[stage] = merge_histogram(stages[stage], snap["stages"][stage])
+        rows = merge_histogram(rows, snap["rows"])
+
+    lines = [
+        "# HELP ml_serve_requests_total /predict requests by HTTP status.",
+        "# TYPE ml_serve_requests_total counter",
+    ]
+    lines += [f'ml_serve_requests_total{{status="{status}"}} {n}' for status, n in sorted(requests.items())]
+
+    lines += [
+        "# HELP ml_serve_stage_duration_seconds Latency per stage (parse/total per request, transform/inference/decide per batch).",
+        "# TYPE ml_serve_stage_duration_seconds histogram",
+    ]
+    for stage in STAGES:
+        lines += histogram_lines("ml_serve_stage_duration_seconds", LATENCY_BUCKETS, stages[stage] or new_histogram(LATENCY_BUCKETS), f'stage="{stage}"')
+
+    lines += [
+        "# HELP ml_serve_request_rows Records per /predict request.",
+        "# TYPE ml_serve_request_rows histogram",
+    ]
+    lines += histogram_lines("ml_serve_request_rows", ROW_BUCKETS, rows or new_histogram(ROW_BUCKETS))
+
+    lines += [
+        "# HELP ml_serve_batches_total Feature batches by transform path (fast = per record, pandas = frame).",
+        "# TYPE ml_serve_batches_total counter",
+    ]
+    lines += [f'ml_serve_batches_total{{path="{path}"}} {n}' for path, n in sorted(batches.items())]
+
+    lookups = totals["cache_hits"] + totals["cache_misses"]
+    for key, help_text in [("rows", "Records scored."), ("alerts", "Records predicted malicious after whitelist/post-filter."), ("whitelist", "Records matched by a whitelist rule.")]:
+        lines += [f"# HELP ml_serve_{key}_total {help_text}", f"# TYPE ml_serve_{key}_total counter", f"ml_serve_{key}_total {totals[key]}"]
+    lines += [
+        "# HELP ml_serve_alert_ratio Alerts / rows since start.",
+        "# TYPE ml_serve_alert_ratio gauge",
+        f"ml_serve_alert_ratio {totals['alerts'] / totals['rows'] if totals['rows'] else 0:.6f}",
+        "# HELP ml_serve_model_reloads_total Successful hot reloads.",
+        "# TYPE ml_serve_model_reloads_total counter",
+        f"ml_serve_model_reloads_total {totals['reloads']}",
+        "# HELP ml_serve_verdict_cache_hits_total Records answered from the verdict cache.",
+        "# TYPE ml_serve_verdict_cache_hits_total counter",
+        f"ml_serve_verdict_cache_hits_total {totals['cache_hits']}",
+        "# HELP ml_serve_verdict_cache_misses_total Records scored because they were not in the verdict cache.",
+        "# TYPE ml_serve_verdict_cache_misses_total counter",
+        f"ml_serve_verdict_cache_misses_total {totals['cache_misses']}",
+        "# HELP ml_serve_verdict_cache_hit_ratio Verdict cache hits / lookups since start.",
+        "# TYPE ml_serve_verdict_cache_hit_ratio gauge",
+        f"ml_serve_verdict_cache_hit_ratio {totals['cache_hits'] / lookups if lookups else 0:.6f}",
+        "# HELP ml_serve_verdict_cache_entries Entries held in the verdict cache of each live worker.",
+        "# TYPE ml_serve_verdict_cache_entries gauge",
+    ]
+    own = os.getpid()
+    live = [snap for snap in snapshots if snap["pid"] == own or pid_alive(snap["pid"])]
+    lines += [f'ml_serve_verdict_cache_entries{{pid="{snap["pid"]}"}} {snap.get("cache_entries", 0)}' for snap in live]
+    lines += [
+        "# HELP ml_serve_model_info Model version served by each live worker.",
+        "# TYPE ml_serve_model_info gauge",
+    ]
+    lines += [
+        f'ml_serve_model_info{{version="{snap["model_version"]}",pid="{snap["pid"]}"}} 1'
+        for snap in live if snap["model_version"]
+    ]
+    return "\n".join(lines) + "\n"
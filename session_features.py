@@ -0,0 +1,344 @@
+import os, math, threading, itertools
+from collections import deque
+import numpy as np
+import pandas as pd
+import joblib
+
+# -------------------------------------
+# 🪟 Session features: aggregate ย้อนหลัง SESSION_WINDOW_S วินาทีต่อ source IP และต่อคู่ (source, destination)
+# -------------------------------------
+# window ของแถว i = แถวของ key เดียวกันที่ t_j อยู่ใน (t_i - W, t_i] และมาก่อน/พร้อม i (causal → streaming ได้ค่าเดียวกับ batch)
+#   req_rate      = จำนวน request ใน window ต่อนาที
+#   distinct_urls = จำนวน URL ไม่ซ้ำใน window
+#   error_ratio   = สัดส่วน status >= 400 ใน window
+#   jitter_s      = ส่วนเบี่ยงเบนมาตรฐานของช่วงห่างระหว่าง request ใน window (beaconing → jitter ต่ำ)
+# batch: sort ครั้งเดียว + searchsorted/cumsum (ไม่มี loop ต่อแถว) | streaming: SessionStore เก็บ state ต่อ key
+# (frame → window_aggregates บน event ที่ค้างอยู่ใน window + แถวใหม่, record เดี่ยว → SessionWindow.update)
+# @timestamp ที่ parse ไม่ได้ → ไม่เข้า window และได้ 0 ทุกค่า
+# ปิดอยู่ (0) จนกว่าจะตั้งเอง: state อยู่ใน memory ของ process → ml-serve ที่ใช้โมเดลแบบนี้รันได้แค่ 1 gunicorn worker
+SESSION_WINDOW_S = float(os.getenv("SESSION_WINDOW_S", 0))
+SESSION_KEYS = ["src", "pair"]
+SESSION_METRICS = ["req_rate", "distinct_urls", "error_ratio", "jitter_s"]
+SESSION_FEATURES = [f"{key}_{metric}" for key in SESSION_KEYS for metric in SESSION_METRICS]
+SESSION_SCHEMA = {
+    "req_rate": ("float32", 0.0, 1e6),
+    "distinct_urls": ("uint16", 0, 65535),
+    "error_ratio": ("float32", 0.0, 1.0),
+    "jitter_s": ("float32", 0.0, 1e6),
+}
+
+
+def session_spec(name):
+    return SESSION_SCHEMA[name.split("_", 1)[1]]
+
+
+def window_ms(window_s):
+    return int(round(float(window_s) * 1000))
+
+
+# @timestamp → epoch ms (UTC, ไม่มี timezone ถือเป็น UTC) + mask ของค่าที่ parse ได้
+def timestamps_ms(values):
+    ts = pd.to_datetime(values, errors="coerce", utc=True)
+    valid = ts.notna().to_numpy()
+    return np.where(valid, ts.array.asi8 // 1_000_000, 0), valid
+
+
+# คอลัมน์ดิบที่ใช้ → (t_ms, valid, src, dst, url, is_error) แบบเดียวกันทั้ง batch และ SessionStore.update_frame
+def frame_inputs(df):
+    t, valid = timestamps_ms(df["@timestamp"])
+    text = lambda col: df[col].fillna("-").astype(str).to_numpy(dtype=object)
+    status = pd.to_numeric(df["http.response.status_code"].fillna("-"), errors="coerce").fillna(0)
+    return t, valid, text("source.ip"), text("destination.ip"), text("url.original"), (status >= 400).to_numpy()
+
+
+# -------------------------------------
+# ⚡ Batch: ทุก key พร้อมกันบนแกนเวลาเดียว (key * band + t) → searchsorted หา window ทีเดียวทั้ง array
+# -------------------------------------
+def window_aggregates(key_codes, t, url_codes, errors, width):
+    n = len(t)
+    out = np.zeros((n, len(SESSION_METRICS)), dtype=np.float64)
+    if n == 0:
+        return out
+    # เรียงตาม key, เวลา, ลำดับที่เข้ามา (stable) → แถวเวลาเดียวกันนับตามลำดับไฟล์เหมือน streaming
+    order = np.lexsort((np.arange(n), t, key_codes))
+    k, ts, urls, errs = key_codes[order], t[order], url_codes[order], errors[order].astype(np.int64)
+    t0 = ts.min()
+    band = int(ts.max() - t0) + width + 1
+    if (int(k.max()) + 1) * band >= 2 ** 62:
+        raise ValueError("❌ Session window: time span x key count too large for int64 time axis")
+    axis = k * band + (ts - t0)
+    pos = np.arange(n)
+    left = np.searchsorted(axis, axis - width, side="right")
+    count = pos - left + 1
+
+    cum_err = np.concatenate([[0], np.cumsum(errs)])
+    error_ratio = (cum_err[pos + 1] - cum_err[left]) / count
+
+    # ช่วงห่าง j-1 → j ใช้เมื่อทั้งคู่อยู่ใน window (j ใน (left, i]) → ไม่เกิน width, clip ไว้ให้ cumsum ไม่โต
+    first = np.ones(n, dtype=bool)
+    first[1:] = k[1:] != k[:-1]
+    gap = np.zeros(n, dtype=np.int64)
+    gap[1:] = ts[1:] - ts[:-1]
+    gap[first] = 0
+    gap = np.minimum(gap, width) / 1000.0
+    cum_gap = np.concatenate([[0.0], np.cumsum(gap)])
+    cum_gap2 = np.concatenate([[0.0], np.cumsum(gap * gap)])
+    n_gaps = count - 1
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (cum_gap[pos + 1] - cum_gap[left + 1]) / n_gaps
+        var = (cum_gap2[pos + 1] - cum_gap2[left + 1]) / n_gaps - mean * mean
+    jitter = np.where(n_gaps > 0, np.sqrt(np.clip(var, 0, None)), 0.0)
+
+    # distinct = count - แถวใน window ที่ URL เดียวกันเคยมาแล้วใน window (prev_t > t_i - W)
+    # prev_t + W > t_j (B) → นับเป็นซ้ำจนถึงเวลา prev_t + W; ที่เหลือไม่มีทางซ้ำใน window ไหน
+    combo = k * (int(urls.max()) + 1) + urls
+    by_url = np.argsort(combo, kind="stable")
+    same = combo[by_url[1:]] == combo[by_url[:-1]]
+    has_prev = np.zeros(n, dtype=bool)
+    prev_t = np.zeros(n, dtype=np.int64)
+    has_prev[by_url[1:][same]] = True
+    prev_t[by_url[1:][same]] = ts[by_url[:-1][same]]
+    live = has_prev & (prev_t + width > ts)
+    group_start = np.searchsorted(axis, k * band, side="left")
+    cum_live = np.concatenate([[0], np.cumsum(live)])
+    expiry = np.sort(k[live] * band + (prev_t[live] - t0) + width)
+    expired = np.searchsorted(expiry, axis, side="right") - np.searchsorted(expiry, k * band, side="left")
+    repeats = cum_live[pos + 1] - cum_live[group_start] - expired
+
+    out[order, 0] = count * 60000.0 / width
+    out[order, 1] = count - repeats
+    out[order, 2] = error_ratio
+    out[order, 3] = jitter
+    return out
+
+
+def session_features(df, window_s):
+    width = window_ms(window_s)
+    t, valid, src, dst, url, errors = frame_inputs(df)
+    src_codes, _ = pd.factorize(src[valid])
+    dst_codes, _ = pd.factorize(dst[valid])
+    pair_codes, _ = pd.factorize(src_codes.astype(np.int64) * (int(dst_codes.max(initial=0)) + 1) + dst_codes)
+    url_codes, _ = pd.factorize(url[valid])
+
+    values = np.zeros((len(df), len(SESSION_FEATURES)), dtype=np.float64)
+    for i, codes in enumerate([src_codes, pair_codes]):
+        block = slice(i * len(SESSION_METRICS), (i + 1) * len(SESSION_METRICS))
+        values[valid, block] = window_aggregates(codes.astype(np.int64), t[valid], url_codes.astype(np.int64), errors[valid], width)
+    return pd.DataFrame(values, columns=SESSION_FEATURES, index=df.index)
+
+
+# -------------------------------------
+# 🌊 Streaming: state ต่อ key (event ใน window + ตัวนับ) → 1 record = O(1) amortized
+# -------------------------------------
+# แถวที่มาช้ากว่าแถวล่าสุดของ key เดียวกัน (ข้าม batch) ถือว่าเกิด ณ เวลาล่าสุด — ใน batch เดียวกันเรียงตามเวลาก่อน
+class SessionWindow:
+    __slots__ = ("events", "urls", "errors", "gap_sum", "gap_sq", "last_t")
+
+    def __init__(self):
+        self.events = deque()
+        self.urls = {}
+        self.errors = 0
+        self.gap_sum = 0
+        self.gap_sq = 0
+        self.last_t = None
+
+    def update(self, t, url, is_error, width):
+        if self.last_t is not None and t < self.last_t:
+            t = self.last_t
+        events = self.events
+        while events and events[0][0] <= t - width:
+            _, old_url, old_error, _ = events.popleft()
+            left = self.urls[old_url] - 1
+            if left:
+                self.urls[old_url] = left
+            else:
+                del self.urls[old_url]
+            self.errors -= old_error
+            # event แรกที่เหลือไม่มีตัวก่อนหน้าใน window แล้ว → ช่วงห่างของมันไม่นับ
+            if events:
+                gap = events[0][3]
+                self.gap_sum -= gap
+                self.gap_sq -= gap * gap
+        gap = 0
+        if events:
+            gap = t - self.last_t
+            self.gap_sum += gap
+            self.gap_sq += gap * gap
+        events.append((t, url, int(is_error), gap))
+        self.urls[url] = self.urls.get(url, 0) + 1
+        self.errors += int(is_error)
+        self.last_t = t
+
+        count, n_gaps = len(events), len(events) - 1
+        jitter = 0.0
+        if n_gaps:
+            mean = self.gap_sum / n_gaps
+            jitter = math.sqrt(max(self.gap_sq / n_gaps - mean * mean, 0)) / 1000.0
+        return [count * 60000.0 / width, len(self.urls), self.errors / count, jitter]
+
+
+class SessionStore:
+    def __init__(self, window_s):
+        self.window_s = float(window_s)
+        self.width = window_ms(window_s)
+        self.windows = {key: {} for key in SESSION_KEYS}
+        self.latest = None
+        self.swept_at = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(windows) for windows in self.windows.values())
+
+    # 1 record (t_ms=None → timestamp parse ไม่ได้) → ค่าตามลำดับ SESSION_FEATURES
+    def update(self, t, src, dst, url, is_error):
+        return self.update_many([(t, src, dst, url, is_error)])[0]
+
+    # หลาย record (request เดียวของ ml-serve) → lock ครั้งเดียวทั้งชุด + เรียงตามเวลาก่อนเหมือน update_frame
+    # (request ที่มาพร้อมกันใน thread อื่นไม่แทรกกลางชุด → ค่าไม่ขึ้นกับลำดับที่ thread ได้ lock ทีละแถว)
+    def update_many(self, events):
+        values = [[0.0] * len(SESSION_FEATURES) for _ in events]
+        timed = sorted((i for i, event in enumerate(events) if event[0] is not None), key=lambda i: events[i][0])
+        with self.lock:
+            for i in timed:
+                values[i] = self.update_locked(*events[i])
+        return values
+
+    def update_locked(self, t, src, dst, url, is_error):
+        values = []
+        for key, ident in (("src", src), ("pair", (src, dst))):
+            window = self.windows[key].get(ident)
+            if window is None:
+                window = self.windows[key][ident] = SessionWindow()
+            values += window.update(t, url, is_error, self.width)
+        self.latest = t if self.latest is None else max(self.latest, t)
+        self.sweep()
+        return values
+
+    # key ที่เงียบเกิน window → state ว่างอยู่แล้ว ลบทิ้ง (memory ตามจำนวน key ที่ active)
+    def sweep(self):
+        if self.swept_at is None:
+            self.swept_at = self.latest
+        if self.latest - self.swept_at < self.width:
+            return
+        cutoff = self.latest - self.width
+        for windows in self.windows.values():
+            for ident in [ident for ident, w in windows.items() if w.last_t <= cutoff]:
+                del windows[ident]
+        self.swept_at = self.latest
+
+    # ทั้ง frame (predict ทีละ chunk, live_predict, ml-serve) ภายใต้ lock เดียว → vectorized เหมือน batch:
+    # เฉพาะ key ที่อยู่ใน frame: event ที่ยังอยู่ใน window ของ key นั้น + แถวใหม่ → window_aggregates ทีเดียว
+    # แล้วเก็บ event ที่ยังอยู่ใน window กลับเป็น state (loop ต่อ key ไม่ใช่ต่อแถว)
+    def update_frame(self, df):
+        t, valid, src, dst, url, errors = frame_inputs(df)
+        values = np.zeros((len(df), len(SESSION_FEATURES)), dtype=np.float64)
+        rows = np.flatnonzero(valid)
+        if len(rows) == 0:
+            return pd.DataFrame(values, columns=SESSION_FEATURES, index=df.index)
+        t, src, dst, url, errors = t[rows], src[rows], dst[rows], url[rows], errors[rows].astype(bool)
+        src_codes, src_idents = pd.factorize(src)
+        dst_codes, _ = pd.factorize(dst)
+        pair_codes, _ = pd.factorize(src_codes.astype(np.int64) * (int(dst_codes.max()) + 1) + dst_codes)
+        _, pair_first = np.unique(pair_codes, return_index=True)
+        pair_idents = list(zip(src[pair_first].tolist(), dst[pair_first].tolist()))
+        with self.lock:
+            for i, (key, idents, codes) in enumerate([("src", src_idents.tolist(), src_codes), ("pair", pair_idents, pair_codes)]):
+                block = slice(i * len(SESSION_METRICS), (i + 1) * len(SESSION_METRICS))
+                values[rows, block] = self.merge_frame(key, idents, codes.astype(np.int64), t, url, errors)
+            latest = int(t.max())
+            self.latest = latest if self.latest is None else max(self.latest, latest)
+            self.sweep()
+        return pd.DataFrame(values, columns=SESSION_FEATURES, index=df.index)
+
+    # key ชนิดเดียว: codes = ลำดับของ idents ต่อแถวใหม่ → ค่า SESSION_METRICS ของแถวใหม่ (เรียกภายใต้ lock)
+    def merge_frame(self, key, idents, codes, t, url, errors):
+        windows = self.windows[key]
+        last = np.full(len(idents), np.iinfo(np.int64).min, dtype=np.int64)
+        carried, carried_codes = [], []
+        for code, ident in enumerate(idents):
+            window = windows.get(ident)
+            if window is not None and window.events:
+                last[code] = window.last_t
+                carried.append(window.events)
+                carried_codes.append(code)
+        # แถวที่มาช้ากว่าแถวล่าสุดของ key (ข้าม batch) → ถือว่าเกิด ณ เวลาล่าสุด เหมือน SessionWindow.update
+        t = np.maximum(t, last[codes])
+        n_old = sum(len(events) for events in carried)
+        if n_old:
+            old_t, old_url, old_error, _ = zip(*itertools.chain.from_iterable(carried))
+            codes = np.concatenate([np.repeat(carried_codes, [len(events) for events in carried]), codes])
+            t = np.concatenate([np.asarray(old_t, dtype=np.int64), t])
+            url = np.concatenate([np.asarray(old_url, dtype=object), url])
+            errors = np.concatenate([np.asarray(old_error, dtype=bool), errors])
+        url_codes, url_values = pd.factorize(url)
+        url_codes = url_codes.astype(np.int64)
+        out = window_aggregates(codes, t, url_codes, errors, self.width)
+
+        # state ใหม่ต่อ key = event ใน (t_last - W, t_last] เรียงตามเวลา/ลำดับที่เข้ามา (old มาก่อนแถวใหม่)
+        order = np.lexsort((np.arange(len(t)), t, codes))
+        k, ts, urls, errs = codes[order], t[order], url_codes[order], errors[order].astype(np.int64)
+        ends = np.append(np.flatnonzero(k[1:] != k[:-1]) + 1, len(k))
+        last_t = ts[ends - 1]
+        keep = ts > np.repeat(last_t, np.diff(ends, prepend=0)) - self.width
+        k, ts, urls, errs = k[keep], ts[keep], urls[keep], errs[keep]
+        starts = np.flatnonzero(np.r_[True, k[1:] != k[:-1]])
+        gaps = np.diff(ts, prepend=0)
+        gaps[starts] = 0
+        gap_sum, gap_sq = np.add.reduceat(gaps, starts).tolist(), np.add.reduceat(gaps * gaps, starts).tolist()
+        error_sum = np.add.reduceat(errs, starts).tolist()
+        # นับ URL ต่อ key แบบ vectorized (คู่ key+url ไม่ซ้ำ) แทน Counter ต่อ key
+        url_values = np.asarray(url_values, dtype=object)
+        pairs, pair_counts = np.unique(k * len(url_values) + urls, return_counts=True)
+        pair_starts = np.searchsorted(pairs // len(url_values), k[starts]).tolist() + [len(pairs)]
+        pair_urls, pair_counts = url_values[pairs % len(url_values)].tolist(), pair_counts.tolist()
+        ends = np.append(starts[1:], len(ts)).tolist()
+        events = list(zip(ts.tolist(), url_values[urls].tolist(), errs.tolist(), gaps.tolist()))
+        new_window = SessionWindow.__new__
+        for g, (start, end, key_code) in enumerate(zip(starts.tolist(), ends, k[starts].tolist())):
+            window = new_window(SessionWindow)
+            window.events = deque(events[start:end])
+            window.urls = dict(zip(pair_urls[pair_starts[g]:pair_starts[g + 1]], pair_counts[pair_starts[g]:pair_starts[g + 1]]))
+            window.errors, window.gap_sum, window.gap_sq = error_sum[g], gap_sum[g], gap_sq[g]
+            window.last_t = events[end - 1][0]
+            windows[idents[key_code]] = window
+        return out[n_old:]
+
+    def clear(self):
+        with self.lock:
+            self.windows = {key: {} for key in SESSION_KEYS}
+            self.latest = self.swept_at = None
+
+    # เก็บ/โหลด state ข้ามการ restart (live_predict)
+    def save(self, path):
+        with self.lock:
+            state = {"window_s": self.window_s, "latest": self.latest, "windows": {
+                key: {ident: (list(w.events), w.last_t) for ident, w in windows.items()}
+                for key, windows in self.windows.items()
+            }}
+        joblib.dump(state, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        return path
+
+    @classmethod
+    def load(cls, path, window_s):
+        store = cls(window_s)
+        if not os.path.exists(path):
+            return store
+        state = joblib.load(path)
+        if state.get("window_s") != store.window_s:
+            print(f"⚠️ Session state window {state.get('window_s')}s ≠ {store.window_s}s — starting empty")
+            return store
+        for key, windows in state["windows"].items():
+            for ident, (events, last_t) in windows.items():
+                window = store.windows[key][ident] = SessionWindow()
+                for t, url, is_error, gap in events:
+                    window.events.append((t, url, is_error, gap))
+                    window.urls[url] = window.urls.get(url, 0) + 1
+                    window.errors += is_error
+                for _, _, _, gap in events[1:]:
+                    window.gap_sum += gap
+                    window.gap_sq += gap * gap
+                window.last_t = last_t
+        store.latest = store.swept_at = state["latest"]
+        print(f"🪟 Session state loaded → {path} ({len(store):,} active key(s))")
+        return store
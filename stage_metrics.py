@@ -0,0 +1,192 @@
+import os, io, json, time, resource, cProfile, pstats, datetime
+from contextlib import contextmanager
+
+# -------------------------------------
+# ⏱ Stage metrics: wall time, rows/sec, peak RSS ต่อ stage → <output>/metrics/<run>-<timestamp>.json
+# -------------------------------------
+# start_run() ตอนเริ่ม script, with stage("name", rows=...) รอบแต่ละขั้น, finish_run() ตอนจบ
+# ไม่มี run ที่ active (เช่น ml-serve เรียก transform_data) → stage/laps ไม่บันทึกอะไร
+# PROFILE_ENABLED=1 → cProfile ทั้ง run ลง .prof ข้างไฟล์ metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "0") == "1"
+
+current_run = None
+
+
+def read_status_mb(key):
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith(key):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+# peak resident memory ของ process นี้
+# VmHWM เริ่มนับใหม่หลัง exec, ส่วน ru_maxrss ติดค่าของ parent มาด้วยถ้าถูก fork จาก process ที่ใหญ่กว่า
+def peak_rss_mb():
+    peak = read_status_mb("VmHWM:")
+    return peak if peak is not None else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def rss_mb():
+    return read_status_mb("VmRSS:") or 0.0
+
+
+# เขียน "5" ลง clear_refs → VmHWM เริ่มนับจาก RSS ปัจจุบัน (peak ต่อ stage ไม่ใช่ peak สะสมของ process)
+def reset_peak():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class RunMetrics:
+    def __init__(self, name, output_dir):
+        self.name = name
+        self.output_dir = os.getenv("METRICS_DIR", os.path.join(output_dir, "metrics"))
+        self.started_at = datetime.datetime.now()
+        self.start = time.perf_counter()
+        self.stages = []
+        self.open_stages = []
+        self.process_peak = peak_rss_mb()
+        self.profiler = None
+        if PROFILE_ENABLED:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    # ก่อน reset VmHWM: เก็บ peak ที่ผ่านมาไว้ให้ stage ที่ยังเปิดอยู่ (stage ซ้อนกันได้)
+    def fold_peak(self):
+        peak = peak_rss_mb()
+        self.process_peak = max(self.process_peak, peak)
+        for info in self.open_stages:
+            info["peak_rss_mb"] = max(info["peak_rss_mb"], peak)
+        return peak
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        self.fold_peak()
+        reset_peak()
+        info = {"name": name, "rows": rows, "peak_rss_mb": rss_mb()}
+        self.open_stages.append(info)
+        start = time.perf_counter()
+        try:
+            yield info
+        finally:
+            info["wall_s"] = round(time.perf_counter() - start, 4)
+            self.fold_peak()
+            self.open_stages.remove(info)
+            info["peak_rss_mb"] = round(info["peak_rss_mb"], 1)
+            info["rss_mb"] = round(rss_mb(), 1)
+            self.add(info)
+
+    def add(self, info):
+        if info.get("rows") and info["wall_s"] > 0:
+            info["rows_per_s"] = round(info["rows"] / info["wall_s"], 1)
+        self.stages.append(info)
+
+    def peak_mb(self):
+        return max(self.process_peak, peak_rss_mb())
+
+    # รวม stage ชื่อเดียวกัน (เช่นทุก chunk) → wall/rows รวม, peak สูงสุด
+    def summary(self):
+        totals = {}
+        for info in self.stages:
+            total = totals.setdefault(info["name"], {"name": info["name"], "calls": 0, "wall_s": 0.0, "rows": 0, "peak_rss_mb": None})
+            total["calls"] += 1
+            total["wall_s"] = round(total["wall_s"] + info["wall_s"], 4)
+            total["rows"] += info.get("rows") or 0
+            if info.get("peak_rss_mb") is not None:
+                total["peak_rss_mb"] = max(total["peak_rss_mb"] or 0, info["peak_rss_mb"])
+        for total in totals.values():
+            if total["rows"] and total["wall_s"] > 0:
+                total["rows_per_s"] = round(total["rows"] / total["wall_s"], 1)
+        return list(totals.values())
+
+    def finish(self, **extra):
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = self.started_at.strftime("%Y%m%d-%H%M%S")
+        base = os.path.join(self.output_dir, f"{self.name}-{stamp}")
+        summary = self.summary()
+        metrics = {
+            "run": self.name,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "wall_s": round(time.perf_counter() - self.start, 4),
+            "peak_rss_mb": round(self.peak_mb(), 1),
+            "pid": os.getpid(),
+            **extra,
+            "summary": summary,
+            "stages": self.stages,
+        }
+        with open(base + ".json.tmp", "w", encoding="utf-8") as f:
+            json.dump(metrics, f, indent=2, default=str)
+        os.replace(base + ".json.tmp", base + ".json")
+
+        print(f"⏱ Stage timings ({self.name}):")
+        for total in summary:
+            rate = f"{total['rows_per_s']:>12,.0f} rows/s" if total.get("rows_per_s") else " " * 19
+            peak = f"{total['peak_rss_mb']:>8.1f} MB" if total["peak_rss_mb"] is not None else ""
+            print(f"   {total['name']:<28} {total['wall_s']:>9.3f}s x{total['calls']:<4} {rate} {peak}")
+        print(f"📈 Metrics saved → {base}.json")
+
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(base + ".prof")
+            out = io.StringIO()
+            pstats.Stats(self.profiler, stream=out).sort_stats("cumulative").print_stats(15)
+            print(out.getvalue())
+            print(f"🔬 cProfile saved → {base}.prof")
+        return metrics
+
+
+def start_run(name, output_dir):
+    global current_run
+    current_run = RunMetrics(name, output_dir) if METRICS_ENABLED else None
+    return current_run
+
+
+def finish_run(**extra):
+    global current_run
+    run, current_run = current_run, None
+    return run.finish(**extra) if run else None
+
+
+# process ลูกที่ fork มาจาก run ที่ active (เช่น worker ของ PREDICT_WORKERS) → ทิ้ง run ที่ติดมา ไม่เขียนไฟล์
+def clear_run():
+    global current_run
+    if current_run is not None and current_run.profiler is not None:
+        current_run.profiler.disable()
+    current_run = None
+
+
+# stage ของ run ที่ active อยู่ (ไม่มี run → ไม่บันทึก)
+@contextmanager
+def stage(name, rows=None):
+    if current_run is None:
+        yield {"name": name, "rows": rows}
+        return
+    with current_run.stage(name, rows) as info:
+        yield info
+
+
+# peak ของทั้ง process แม้ stage จะ reset VmHWM ไปแล้ว
+def process_peak_mb():
+    return current_run.peak_mb() if current_run else peak_rss_mb()
+
+
+# ⏲ จับเวลาย่อยต่อเนื่องกันใน function เดียว (เช่นกลุ่มฟีเจอร์ใน transform_data) โดยไม่ต้องซ้อน with
+class Laps:
+    def __init__(self, group, rows=None):
+        self.group = group
+        self.rows = rows
+        self.last = time.perf_counter()
+
+    def mark(self, name):
+        now = time.perf_counter()
+        if current_run is not None:
+            current_run.add({"name": f"{self.group}.{name}", "rows": self.rows, "wall_s": round(now - self.last, 4)})
+        self.last = now
@@ -0,0 +1,4 @@
+import os, sys
+
+# สคริปต์ของ repo อยู่ชั้นบนสุด (ไม่ใช่ package) → ให้ test import ได้ตรง ๆ
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
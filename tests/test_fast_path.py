@@ -0,0 +1,115 @@
+import contextlib, io
+import numpy as np
+import pandas as pd
+import pytest
+import xgboost as xgb
+from prepare_data import FeatureTransformer, INPUT_FIELDS
+from benchmark import make_synthetic_http
+
+# -------------------------------------
+# 🏎 transform_record (fast path ของ ml-serve) ต้องให้ feature + prob เท่ากับทาง DataFrame
+# -------------------------------------
+BASE = {
+    "@timestamp": "2025-03-01T23:15:00.000Z", "source.ip": "192.168.1.10", "destination.ip": "8.8.8.8",
+    "url.original": "http://example.com/login.php?user=admin&token=1", "http.response.status_code": "200",
+    "destination.port": "443", "network.protocol": "http", "user_agent.original": "python-requests/2.31",
+    "http.request.method": "POST", "http.request.referrer": "http://other.example.org/",
+    "source.geoip.country_code2": "TH", "destination.geoip.country_code2": "US",
+}
+
+
+def edit(**changes):
+    record = dict(BASE)
+    record.update(changes)
+    return record
+
+
+EDGE_RECORDS = [
+    BASE,
+    # field หาย (JSON null / NaN)
+    {field: None for field in INPUT_FIELDS},
+    dict({field: None for field in INPUT_FIELDS}, **{"url.original": "/index.html"}),
+    edit(**{"user_agent.original": None, "http.request.referrer": None, "@timestamp": None}),
+    # geoip NaN / None / "-"
+    edit(**{"source.geoip.country_code2": float("nan"), "destination.geoip.country_code2": float("nan")}),
+    edit(**{"source.geoip.country_code2": None, "destination.geoip.country_code2": "US"}),
+    edit(**{"source.geoip.country_code2": "-", "destination.geoip.country_code2": "-"}),
+    # status ที่ไม่ใช่ตัวเลข / แปลก
+    edit(**{"http.response.status_code": "abc"}),
+    edit(**{"http.response.status_code": " 404 "}),
+    edit(**{"http.response.status_code": "200.0"}),
+    edit(**{"http.response.status_code": 503}),
+    edit(**{"http.response.status_code": -7}),
+    # ค่าที่ schema clip (status > uint16, URL ยาว, octet > 255)
+    edit(**{"http.response.status_code": "99999"}),
+    edit(**{"url.original": "/" + "a/?" * 30000, "user_agent.original": "Mozilla " * 10000}),
+    edit(**{"source.ip": "999.300.1.1", "destination.ip": "10.0.0.256"}),
+    # ชนิดข้อมูลจาก JSON ที่ไม่ใช่ str
+    edit(**{"source.ip": 12345, "destination.port": 80, "destination.ip": 3232235777}),
+    edit(**{"destination.port": 8080.0, "@timestamp": 1700000000}),
+    # timestamp แปลก
+    edit(**{"@timestamp": "not a time"}),
+    edit(**{"@timestamp": "2025-01-01 10:00:00+07:00"}),
+]
+
+
+@pytest.fixture(scope="module")
+def training_frame():
+    return make_synthetic_http(3000, seed=5)
+
+
+def fit_pipeline(frame, session_window_s=None, prune=None):
+    with contextlib.redirect_stdout(io.StringIO()):
+        transformer = FeatureTransformer(session_window_s=session_window_s).fit(frame)
+        train = transformer.transform(frame, mode="train")
+    x, y = train.drop(columns=["label"]), train["label"]
+    if prune:
+        transformer.prune(prune)
+        x = x[transformer.columns]
+    model = xgb.XGBClassifier(n_estimators=20, max_depth=4, n_jobs=1, random_state=0).fit(x, y)
+    return transformer, model
+
+
+PIPELINES = {
+    "full": {},
+    "session": {"session_window_s": 300},
+    "pruned": {"prune": ["status_code", "url_length", "source_ip_oct1", "same_country", "risk_score", "login", "ua_length"]},
+}
+
+
+@pytest.mark.parametrize("pipeline", sorted(PIPELINES))
+def test_fast_path_matches_dataframe_path(training_frame, pipeline):
+    transformer, model = fit_pipeline(training_frame, **PIPELINES[pipeline])
+    booster = model.get_booster()
+    for record in EDGE_RECORDS:
+        with contextlib.redirect_stdout(io.StringIO()):
+            x = transformer.transform(pd.DataFrame([record], dtype=object), mode="predict")
+        fast = transformer.transform_record(record)
+        assert list(x.columns) == transformer.columns
+        assert fast == x.iloc[0].tolist(), f"feature mismatch for {record}"
+
+        # ml-serve: float32 vector → booster.inplace_predict, เทียบกับ predict_proba ของทาง DataFrame
+        prob_fast = booster.inplace_predict(np.asarray([fast], dtype=np.float32), validate_features=False)[0]
+        prob_frame = model.predict_proba(x)[0, 1]
+        assert prob_fast == pytest.approx(prob_frame, abs=1e-6), f"prediction mismatch for {record}"
+
+
+# batch เดียวหลาย record (ทาง pandas ของ ml-serve) — ยกเว้น @timestamp ที่เป็นตัวเลขหรือ offset อื่นที่ไม่ใช่ Z:
+# pd.to_datetime ของคอลัมน์ที่ปนชนิด/timezone ให้ NaT (ผลขึ้นกับ record อื่นใน batch เหมือน baseline)
+def test_all_edge_records_in_one_frame_match_fast_path(training_frame):
+    transformer, _ = fit_pipeline(training_frame)
+    records = [r for r in EDGE_RECORDS if not isinstance(r["@timestamp"], (int, float)) and "+07:00" not in str(r["@timestamp"])]
+    with contextlib.redirect_stdout(io.StringIO()):
+        x = transformer.transform(pd.DataFrame(records, dtype=object), mode="predict")
+    for i, record in enumerate(records):
+        assert transformer.transform_record(record) == x.iloc[i].tolist(), f"feature mismatch for {record}"
+
+
+# key หายไปเลย → ทั้งสองทาง error (ml-serve ตอบ 400) ไม่ใช่เดาค่าแทน
+@pytest.mark.parametrize("record", [{}, {"url.original": "/index.html"}, {k: v for k, v in BASE.items() if k != "@timestamp"}])
+def test_missing_keys_raise_on_both_paths(training_frame, record):
+    transformer, _ = fit_pipeline(training_frame)
+    with pytest.raises(KeyError):
+        transformer.transform_record(record)
+    with pytest.raises(KeyError), contextlib.redirect_stdout(io.StringIO()):
+        transformer.transform(pd.DataFrame([record], dtype=object), mode="predict")
@@ -0,0 +1,28 @@
+import os, shutil
+import pytest
+import feature_cache
+from feature_cache import PIPELINE_MODULES, pipeline_version
+
+# -------------------------------------
+# 🗄 แก้ไฟล์ใดก็ตามที่กำหนดค่าใน block → pipeline_version เปลี่ยน (block เก่าไม่ถูกใช้)
+# -------------------------------------
+@pytest.fixture
+def sources(tmp_path, monkeypatch):
+    copies = []
+    for path in feature_cache.PIPELINE_SOURCES:
+        copies.append(shutil.copy(path, tmp_path / os.path.basename(path)))
+    monkeypatch.setattr(feature_cache, "PIPELINE_SOURCES", [str(p) for p in copies])
+    return {os.path.basename(p): p for p in copies}
+
+
+@pytest.mark.parametrize("module", PIPELINE_MODULES)
+def test_editing_a_pipeline_module_changes_the_version(sources, module):
+    before = pipeline_version()
+    with open(sources[module], "a", encoding="utf-8") as f:
+        f.write("\n# edited\n")
+    assert pipeline_version() != before
+
+
+def test_reader_modules_are_hashed():
+    # zeek_logs (map field / unset / empty) และ artifacts (อ่าน Parquet/CSV กลับ) กำหนดค่าที่ cache ไว้ด้วย
+    assert {"prepare_data.py", "session_features.py", "zeek_logs.py", "artifacts.py"} <= set(PIPELINE_MODULES)
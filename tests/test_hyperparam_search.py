@@ -0,0 +1,49 @@
+import contextlib, io
+import numpy as np
+import pytest
+import xgboost as xgb
+import hyperparam_search
+from artifacts import artifact_path, write_artifact
+from prepare_data import FeatureTransformer
+from benchmark import make_synthetic_http
+
+# -------------------------------------
+# 🔎 worker ของ search: ทาง dmatrix-cache กับทางอ่าน CSV ต้องได้ QuantileDMatrix ชุดเดียวกัน
+# -------------------------------------
+@pytest.fixture(scope="module")
+def train_file(tmp_path_factory):
+    frame = make_synthetic_http(1500, seed=8)
+    with contextlib.redirect_stdout(io.StringIO()):
+        features = FeatureTransformer().fit(frame).transform(frame, mode="train")
+        return write_artifact(features, artifact_path(str(tmp_path_factory.mktemp("search")), "training-set", "csv"))
+
+
+def worker_data(train_file, cache_dir=None):
+    with contextlib.redirect_stdout(io.StringIO()):
+        hyperparam_search.init_search_worker(train_file, 20, 42, 1, in_pool=False, cache_dir=cache_dir)
+    return hyperparam_search._search_data
+
+
+def test_cached_worker_builds_quantile_dmatrix_like_csv_path(train_file, tmp_path):
+    from_csv = worker_data(train_file)
+    for _ in range(2):   # cold (build + เขียน cache) แล้ว warm (โหลด binary)
+        cached = worker_data(train_file, cache_dir=str(tmp_path / "dmatrix-cache"))
+        for name in ("dtrain", "dvalid"):
+            assert isinstance(cached[name], xgb.QuantileDMatrix)
+            assert cached[name].num_row() == from_csv[name].num_row()
+            assert cached[name].feature_names == from_csv[name].feature_names
+            # แถวชุดเดียวกัน (ทาง CSV ได้ลำดับที่ train_test_split สลับ, ทาง cache เรียงตาม row)
+            np.testing.assert_array_equal(np.sort(cached[name].get_label()), np.sort(from_csv[name].get_label()))
+        for got, expected in zip(cached["dtrain"].get_quantile_cut(), from_csv["dtrain"].get_quantile_cut()):
+            np.testing.assert_allclose(got, expected)
+
+
+def test_cached_and_csv_trials_score_the_same(train_file, tmp_path):
+    base = {"n_estimators": 30, "random_state": 0}
+    params = {"max_depth": 4, "learning_rate": 0.1}
+    worker_data(train_file)
+    from_csv = hyperparam_search.run_trial(0, params, base, "logloss", 5)
+    worker_data(train_file, cache_dir=str(tmp_path / "dmatrix-cache"))
+    cached = hyperparam_search.run_trial(0, params, base, "logloss", 5)
+    assert cached["best_iteration"] == from_csv["best_iteration"]
+    assert cached["score"] == pytest.approx(from_csv["score"], rel=1e-6)
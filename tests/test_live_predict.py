@@ -0,0 +1,89 @@
+import contextlib, io, os
+import pandas as pd
+import live_predict
+from live_predict import FileTail, LiveScorer, load_offsets, save_offsets
+from session_features import SessionStore
+from test_ml_serve import train_model
+
+# -------------------------------------
+# 📍 restart ของ live mode: อ่านต่อจาก offset เดิม (ไม่ score / นับเข้า session ซ้ำ)
+# -------------------------------------
+HEADER = "@timestamp,source.ip,destination.ip,url.original,http.response.status_code\n"
+
+
+def row(i):
+    return f"2025-03-01T10:00:{i:02d}.000Z,10.0.0.1,8.8.8.8,/p{i},200\n"
+
+
+def write(path, text, mode="a"):
+    with open(path, mode, encoding="utf-8") as f:
+        f.write(text)
+
+
+def test_resume_reads_only_new_rows(tmp_path):
+    path = str(tmp_path / "http.csv")
+    write(path, HEADER + row(0) + row(1) + row(2), "w")
+    tail = FileTail(path)
+    assert len(tail.read_new()) == 3
+    state_path = str(tmp_path / "offsets.json")
+    with contextlib.redirect_stdout(io.StringIO()):
+        save_offsets({path: tail}, state_path)
+
+    # restart: บรรทัดใหม่ + บรรทัดที่ยังเขียนไม่จบ
+    write(path, row(3) + row(4) + "2025-03-01T10:00:05")
+    resumed = FileTail(path, from_start=True, resume=load_offsets(state_path)[path])
+    df = resumed.read_new()
+    assert df["url.original"].tolist() == ["/p3", "/p4"]
+    assert list(df.columns) == HEADER.strip().split(",")
+
+
+def test_resume_zeek_tsv_keeps_header(tmp_path):
+    path = str(tmp_path / "http.log")
+    header = "#separator \\x09\n#unset_field\t-\n#fields\tts\tid.orig_h\tid.resp_h\tid.resp_p\turi\n"
+    write(path, header + "1700000000.0\t10.0.0.1\t8.8.8.8\t80\t/a\n", "w")
+    tail = FileTail(path)
+    assert len(tail.read_new()) == 1
+    write(path, "1700000001.0\t10.0.0.2\t8.8.4.4\t443\t/b\n")
+    df = FileTail(path, resume=tail.state()).read_new()
+    assert df["url.original"].tolist() == ["/b"] and df["destination.port"].tolist() == ["443"]
+
+
+def test_replaced_or_truncated_file_is_read_from_start(tmp_path):
+    path = str(tmp_path / "http.csv")
+    write(path, HEADER + row(0) + row(1), "w")
+    tail = FileTail(path)
+    tail.read_new()
+    state = tail.state()
+    # rotate: ไฟล์ใหม่ชื่อเดิม (inode ใหม่)
+    os.replace(path, path + ".1")
+    write(path, HEADER + row(7), "w")
+    assert FileTail(path, resume=state).read_new()["url.original"].tolist() == ["/p7"]
+    # ไฟล์สั้นกว่า offset เดิม
+    assert FileTail(path, resume=dict(state, inode=os.stat(path).st_ino)).read_new()["url.original"].tolist() == ["/p7"]
+
+
+def test_session_state_not_restored_without_offsets(tmp_path, monkeypatch):
+    model_path = train_model(str(tmp_path), session_window_s=300)
+    state_path = str(tmp_path / "live_session_state.pkl")
+    saved = SessionStore(300)
+    saved.update(1_700_000_000_000, "10.0.0.1", "8.8.8.8", "/a", False)
+    saved.save(state_path)
+    monkeypatch.setattr(live_predict, "LIVE_SESSION_STATE", state_path)
+    monkeypatch.setattr(live_predict, "BASE_OUTPUT_DIR", str(tmp_path))
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert len(LiveScorer(model_path, restore_session=True).session) == 2
+        assert len(LiveScorer(model_path, restore_session=False).session) == 0
+
+
+def test_resume_appends_to_previous_results(tmp_path, monkeypatch):
+    model_path = train_model(str(tmp_path))
+    monkeypatch.setattr(live_predict, "BASE_OUTPUT_DIR", str(tmp_path))
+    path = str(tmp_path / "http.csv")
+    write(path, HEADER + row(0) + row(1), "w")
+    frame = FileTail(path).read_new().assign(**{"user_agent.original": "curl/8", "http.request.method": "GET",
+                                                 "http.request.referrer": "-", "destination.port": "80", "network.protocol": "http",
+                                                 "source.geoip.country_code2": None, "destination.geoip.country_code2": None})
+    with contextlib.redirect_stdout(io.StringIO()):
+        LiveScorer(model_path).score(frame, 0)
+        LiveScorer(model_path, resume=True).score(frame.iloc[:1], 0)
+    assert len(pd.read_csv(str(tmp_path / "predict_result.csv"))) == 3
@@ -0,0 +1,128 @@
+import contextlib, io, os, runpy, sys
+import joblib
+import pytest
+import xgboost as xgb
+from prepare_data import FeatureTransformer, transformer_path_for
+from benchmark import make_synthetic_http, load_serve_app
+
+# -------------------------------------
+# 🌐 ml-serve ผ่าน Flask test client (โมเดลเล็ก ๆ ที่เทรนใน tmp)
+# -------------------------------------
+def train_model(output_dir, session_window_s=None):
+    frame = make_synthetic_http(2000, seed=3)
+    with contextlib.redirect_stdout(io.StringIO()):
+        transformer = FeatureTransformer(session_window_s=session_window_s).fit(frame)
+        train = transformer.transform(frame, mode="train")
+        model = xgb.XGBClassifier(n_estimators=10, max_depth=3, n_jobs=1, random_state=0)
+        model.fit(train.drop(columns=["label"]), train["label"])
+        model_path = os.path.join(output_dir, "xgboost-model.pkl")
+        joblib.dump(model, model_path)
+        transformer.save(transformer_path_for(model_path))
+    return model_path
+
+
+@pytest.fixture(scope="module")
+def serve(tmp_path_factory):
+    return load_serve_app(train_model(str(tmp_path_factory.mktemp("model"))))
+
+
+def test_admin_reload_disabled_without_token(serve, monkeypatch):
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    client = serve.app.test_client()
+    assert client.post("/admin/reload-model?force=1").status_code == 404
+    monkeypatch.setenv("ADMIN_TOKEN", "")
+    assert client.post("/admin/reload-model?force=1", headers={"X-Admin-Token": ""}).status_code == 404
+    assert serve.reload_status["reloads"] == 0
+
+
+def test_admin_reload_requires_matching_token(serve, monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "s3cret")
+    client = serve.app.test_client()
+    assert client.post("/admin/reload-model?force=1").status_code == 401
+    assert client.post("/admin/reload-model?force=1", headers={"X-Admin-Token": "wrong"}).status_code == 401
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = client.post("/admin/reload-model?force=1", headers={"X-Admin-Token": "s3cret"})
+    assert response.status_code == 200 and response.get_json()["reloaded"]
+
+
+# -------------------------------------
+# 🪟 session window อยู่ใน memory ของ worker → โมเดลที่ใช้ session feature ต้องรัน worker เดียว
+# -------------------------------------
+class FakeArbiter:
+    def __init__(self, num_workers):
+        self.num_workers = num_workers
+
+
+@pytest.fixture(scope="module")
+def session_serve(tmp_path_factory):
+    return load_serve_app(train_model(str(tmp_path_factory.mktemp("session-model")), session_window_s=300))
+
+
+@pytest.fixture
+def gunicorn_conf():
+    return runpy.run_path(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gunicorn.conf.py"))
+
+
+def test_gunicorn_forces_single_worker_for_session_model(session_serve, gunicorn_conf, monkeypatch):
+    monkeypatch.setitem(sys.modules, "ml_serve", session_serve)
+    monkeypatch.setattr(session_serve, "worker_count", 1)
+    server = FakeArbiter(8)
+    with contextlib.redirect_stdout(io.StringIO()):
+        gunicorn_conf["limit_workers_for_session"](server)
+    assert server.num_workers == 1 and session_serve.worker_count == 1
+    # TTIN หลัง start ก็ต้องไม่เกิน 1
+    server.num_workers = 3
+    with contextlib.redirect_stdout(io.StringIO()):
+        gunicorn_conf["nworkers_changed"](server, 3, 1)
+    assert server.num_workers == 1
+
+
+def test_gunicorn_keeps_workers_without_session(serve, gunicorn_conf, monkeypatch):
+    monkeypatch.setitem(sys.modules, "ml_serve", serve)
+    monkeypatch.setattr(serve, "worker_count", 1)
+    server = FakeArbiter(8)
+    gunicorn_conf["limit_workers_for_session"](server)
+    assert server.num_workers == 8 and serve.worker_count == 8
+
+
+def test_reload_refuses_session_model_on_many_workers(session_serve, tmp_path, monkeypatch):
+    # hot reload จากโมเดลไม่มี session → มี session ขณะที่ gunicorn รันหลาย worker อยู่ → ใช้โมเดลเดิมต่อ
+    serve = load_serve_app(train_model(str(tmp_path)))
+    monkeypatch.setattr(serve, "worker_count", 4)
+    monkeypatch.setattr(serve, "MODEL_PATH", session_serve.MODEL_PATH)
+    previous = serve.active.version
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert not serve.reload_model(force=True)
+    assert serve.active.version == previous
+    assert "session features" in serve.reload_status["last_reload_error"]
+    monkeypatch.setattr(serve, "worker_count", 1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert serve.reload_model(force=True)
+    assert serve.active.session is not None
+
+
+# micro-batch ล้ม → retry ทีละ request ต้องไม่นับ record ของ request ที่ดีเข้า session ซ้ำ
+def session_events(serve):
+    return sum(len(window.events) for window in serve.active.session.windows["src"].values())
+
+
+@pytest.mark.parametrize("broken_field", ["user_agent.original", "url.original"], ids=["score-fails", "prepare-fails"])
+def test_micro_batch_retry_counts_session_once(session_serve, broken_field):
+    from concurrent.futures import Future
+    from micro_batch import MicroBatcher
+    session_serve.active.session.clear()
+    batcher = MicroBatcher(lambda records, windows: session_serve.predict_records(records, windows=windows),
+                           prepare_fn=lambda records: session_serve.session_windows(records, session_serve.active))
+    # source เดียว เวลาใกล้กัน → ทุก record ยังอยู่ใน window ตอนนับ
+    good = [dict(record, **{"source.ip": "10.9.9.9", "@timestamp": f"2025-03-01T10:00:0{i}.000Z"})
+            for i, record in enumerate(make_synthetic_http(3, seed=9).to_dict(orient="records"))]
+    bad = dict(good[0])
+    del bad[broken_field]
+    batch = [(good, Future()), ([bad], Future())]
+    with contextlib.redirect_stdout(io.StringIO()):
+        batcher.flush(batch)
+    assert len(batch[0][1].result()) == len(good)
+    with pytest.raises(KeyError):
+        batch[1][1].result()
+    # score-fails: record เสียถูกนับตอน prepare ของทั้ง batch ไปแล้ว (ครั้งเดียว) | prepare-fails: ไม่ถูกนับเลย
+    assert session_events(session_serve) == len(good) + (broken_field == "user_agent.original")
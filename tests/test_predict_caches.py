@@ -0,0 +1,125 @@
+import contextlib, io
+import numpy as np
+import pandas as pd
+import pytest
+import xgboost as xgb
+import predict
+from feature_cache import FeatureCache
+from prepare_data import FeatureTransformer
+from verdict_cache import VerdictCache
+from benchmark import make_synthetic_http
+
+# -------------------------------------
+# 🧠🗄 verdict cache + feature cache เปิดพร้อมกัน: record ที่ verdict miss อ่าน feature จาก block (ไม่ข้าม feature cache)
+# -------------------------------------
+@pytest.fixture(scope="module", params=[None, 300], ids=["plain", "session"])
+def fitted(request):
+    frame = make_synthetic_http(2000, seed=7)
+    with contextlib.redirect_stdout(io.StringIO()):
+        transformer = FeatureTransformer(session_window_s=request.param).fit(frame)
+        train = transformer.transform(frame, mode="train")
+    model = xgb.XGBClassifier(n_estimators=10, max_depth=3, n_jobs=1, random_state=0)
+    model.fit(train.drop(columns=["label"]), train["label"])
+    return transformer, model
+
+
+@pytest.fixture
+def frame():
+    # record ซ้ำกันเยอะแบบ Zeek จริง → verdict cache มี hit ภายใน chunk
+    df = make_synthetic_http(300, seed=11)
+    return pd.concat([df, df.iloc[:100]], ignore_index=True)
+
+
+@pytest.fixture
+def feature_cache(tmp_path, monkeypatch):
+    cache = FeatureCache(str(tmp_path / "feature-cache"))
+    monkeypatch.setattr(predict, "FEATURE_CACHE", cache)
+    return cache
+
+
+def count_transforms(transformer, monkeypatch):
+    calls = []
+    original = transformer.transform
+    def transform(df, *args, **kwargs):
+        calls.append(len(df))
+        return original(df, *args, **kwargs)
+    monkeypatch.setattr(transformer, "transform", transform)
+    return calls
+
+
+def expected_probs(transformer, model, df):
+    with contextlib.redirect_stdout(io.StringIO()):
+        x = transformer.transform(df, mode="predict")
+    return model.predict_proba(x)[:, 1]
+
+
+def scored(transformer, model, df, verdicts, file_hash="file-a"):
+    with contextlib.redirect_stdout(io.StringIO()):
+        probs, _, _, _ = predict.predict_probs_cached(model, transformer, df, verdicts, file_hash=file_hash)
+    return probs
+
+
+def test_verdict_misses_reuse_feature_block_across_runs(fitted, frame, feature_cache, monkeypatch):
+    transformer, model = fitted
+    expected = expected_probs(transformer, model, frame)
+    calls = count_transforms(transformer, monkeypatch)
+
+    # รอบแรก: transform record ไม่ซ้ำครั้งเดียว แล้วเขียน block
+    first = scored(transformer, model, frame, VerdictCache("v1", transformer))
+    assert len(calls) == 1 and calls[0] <= len(frame)
+    assert (feature_cache.hits, feature_cache.misses) == (0, 1)
+    np.testing.assert_allclose(first, expected, atol=1e-6)
+
+    # รอบถัดไป (process ใหม่ / โมเดลใหม่ → verdict cache ว่าง): อ่าน block ไม่ต้อง transform
+    second = scored(transformer, model, frame, VerdictCache("v2", transformer))
+    assert len(calls) == 1 and feature_cache.hits == 1
+    np.testing.assert_allclose(second, expected, atol=1e-6)
+
+
+def test_partial_verdict_hits_take_only_missing_rows_from_block(fitted, frame, feature_cache, monkeypatch):
+    transformer, model = fitted
+    expected = expected_probs(transformer, model, frame)
+    scored(transformer, model, frame, VerdictCache("v1", transformer))
+
+    # verdict cache มีบาง record อยู่แล้ว (จากไฟล์ก่อนหน้า) → ที่เหลืออ่านจาก block
+    verdicts = VerdictCache("v2", transformer)
+    scored(transformer, model, frame.iloc[:50], verdicts, file_hash="file-b")
+    calls = count_transforms(transformer, monkeypatch)
+    probs = scored(transformer, model, frame, verdicts)
+    assert calls == [] and verdicts.hits >= 50
+    np.testing.assert_allclose(probs, expected, atol=1e-6)
+
+
+def test_verdict_cache_without_file_hash_skips_feature_cache(fitted, frame, feature_cache):
+    transformer, model = fitted
+    probs = scored(transformer, model, frame, VerdictCache("v1", transformer), file_hash=None)
+    assert (feature_cache.hits, feature_cache.misses) == (0, 0)
+    np.testing.assert_allclose(probs, expected_probs(transformer, model, frame), atol=1e-6)
+
+
+def test_predict_file_uses_both_caches(fitted, frame, feature_cache, tmp_path):
+    transformer, model = fitted
+    csv_path = str(tmp_path / "http.csv")
+    frame.to_csv(csv_path, index=False)
+    outputs, lookups = [], []
+    for run in range(2):
+        output_path = str(tmp_path / f"predict_result_{run}.csv")
+        with contextlib.redirect_stdout(io.StringIO()):
+            predict.predict_file(model, transformer, csv_path, output_path, str(tmp_path / f"whitelist_{run}.csv"),
+                                 chunk_size=150, verdicts=VerdictCache(f"v{run}", transformer))
+        outputs.append(pd.read_csv(output_path))
+        lookups.append((feature_cache.misses, feature_cache.hits))
+    # 3 chunk (chunk ที่ record ทุกตัว verdict hit แล้วไม่ต้องแตะ feature cache): รอบแรกเขียน block, รอบสองอ่านทุก block
+    written = lookups[0][0]
+    assert written >= 2 and lookups == [(written, 0), (written, written)]
+    pd.testing.assert_frame_equal(outputs[0], outputs[1])
+
+
+def test_frame_keys_are_128_bit_like_record_keys(fitted, frame):
+    transformer, _ = fitted
+    verdicts = VerdictCache("v1", transformer)
+    keys = verdicts.frame_keys(frame).tolist()
+    assert {len(key) for key in keys} == {len(verdicts.record_key(frame.iloc[0].to_dict()))} == {16}
+    # แถวที่ซ้ำกัน (100 แถวท้าย) ได้ key เดียวกับแถวต้นฉบับ, แถวอื่นไม่ชนกัน
+    assert keys[300:] == keys[:100]
+    assert len(set(keys)) == len(frame.drop_duplicates())
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+import prepare_data
+from prepare_data import INPUT_FIELDS, enforce_feature_schema, transform_data
+from legacy_transform import transform_data as legacy_transform_data
+
+# -------------------------------------
+# 🧪 transform_data (vectorized) ต้องให้ feature เท่ากับ transform_data ของ baseline (ผ่าน schema เดียวกัน)
+# -------------------------------------
+NORMAL = {
+    "@timestamp": "2025-03-01T23:15:00.000Z", "source.ip": "192.168.1.10", "destination.ip": "8.8.8.8",
+    "url.original": "http://example.com/login.php?user=admin&token=1", "http.response.status_code": "200",
+    "destination.port": "443", "network.protocol": "http", "user_agent.original": "Mozilla/5.0 Chrome",
+    "http.request.method": "POST", "http.request.referrer": "http://other.example.org/",
+    "source.geoip.country_code2": "TH", "destination.geoip.country_code2": "US",
+}
+
+
+def row(**overrides):
+    record = dict(NORMAL)
+    record.update(overrides)
+    return record
+
+
+TRICKY_ROWS = [
+    NORMAL,
+    # ทุก field หาย (NaN / None)
+    {field: None for field in INPUT_FIELDS},
+    {field: np.nan for field in INPUT_FIELDS},
+    # IP เป็นตัวเลข (JSON / คอลัมน์ numeric) → ipaddress.ip_address(int) ของ baseline
+    row(**{"source.ip": 12345, "destination.ip": 3232235777}),
+    row(**{"source.ip": 167772161, "destination.ip": 12345.0}),
+    row(**{"source.ip": True, "destination.ip": 0}),
+    # IP แปลก / IPv6 / นอกช่วง
+    row(**{"source.ip": "999.1.1.1", "destination.ip": "fe80::1"}),
+    row(**{"source.ip": "10.0.0.1 ", "destination.ip": "::1"}),
+    row(**{"source.ip": "", "destination.ip": "-"}),
+    # URL / UA / referrer ว่าง
+    row(**{"url.original": "", "user_agent.original": "", "http.request.referrer": ""}),
+    row(**{"url.original": "-", "http.request.referrer": "http://[::1/"}),
+    row(**{"url.original": "x" * 70000}),
+    # status / timestamp / port แปลก
+    row(**{"http.response.status_code": "abc", "@timestamp": "not a time", "destination.port": 80}),
+    row(**{"http.response.status_code": 503, "destination.port": 8080.0}),
+    # geoip หาย
+    row(**{"source.geoip.country_code2": None, "destination.geoip.country_code2": None}),
+    row(**{"source.geoip.country_code2": "-", "destination.geoip.country_code2": "-"}),
+]
+
+
+def expected_features(df, mode):
+    return enforce_feature_schema(legacy_transform_data(df, mode=mode))
+
+
+def assert_same_features(actual, expected):
+    assert set(actual.columns) == set(expected.columns)
+    pd.testing.assert_frame_equal(actual[expected.columns], expected)
+
+
+def test_tricky_rows_match_baseline():
+    df = pd.DataFrame(TRICKY_ROWS, columns=INPUT_FIELDS, dtype=object)
+    assert_same_features(transform_data(df, mode="predict"), expected_features(df, "predict"))
+
+
+def test_each_tricky_row_alone_matches_baseline():
+    for record in TRICKY_ROWS:
+        df = pd.DataFrame([record], columns=INPUT_FIELDS, dtype=object)
+        assert_same_features(transform_data(df, mode="predict"), expected_features(df, "predict"))
+
+
+def test_numeric_ip_columns_match_baseline():
+    # คอลัมน์ IP เป็น int64 / float64 ทั้งคอลัมน์ (ไม่ใช่ object)
+    df = pd.DataFrame([NORMAL] * 4, columns=INPUT_FIELDS)
+    df["source.ip"] = [12345, 3232235777, 167772161, 134744072]
+    df["destination.ip"] = [12345.0, np.nan, 3232235777.0, 1.5]
+    assert_same_features(transform_data(df, mode="predict"), expected_features(df, "predict"))
+
+
+def test_missing_columns_filled_like_loader_match_baseline():
+    # read_input / load_csv เติมคอลัมน์ที่ไฟล์ไม่มีเป็น None
+    present = ["@timestamp", "source.ip", "destination.ip", "url.original"]
+    df = pd.DataFrame([NORMAL, row(**{"source.ip": 12345})], columns=present)
+    for col in INPUT_FIELDS:
+        if col not in df.columns:
+            df[col] = None
+    assert_same_features(transform_data(df, mode="predict"), expected_features(df, "predict"))
+
+
+def test_label_column_matches_baseline():
+    df = pd.DataFrame(TRICKY_ROWS, columns=INPUT_FIELDS, dtype=object)
+    df["ioc.dest_ip_misp_is_alert"] = [1, 0] * (len(df) // 2)
+    assert_same_features(transform_data(df, mode="train"), expected_features(df, "train"))
+
+
+def test_clip_warning_is_rate_limited(capsys, monkeypatch):
+    # ml-serve เรียก enforce_feature_schema ทุก request → warning ต่อคอลัมน์ไม่ถี่กว่า CLIP_WARN_INTERVAL_S
+    monkeypatch.setattr(prepare_data, "_clip_warnings", {})
+    df = pd.DataFrame({"url_length": [70000, 1]})
+    for _ in range(3):
+        enforce_feature_schema(df)
+    assert capsys.readouterr().out.count("clipped") == 1
+    monkeypatch.setattr(prepare_data, "CLIP_WARN_INTERVAL_S", 0)
+    enforce_feature_schema(df)
+    assert "clipped 1 value(s) to [0, 65535] (+2 since last warning)" in capsys.readouterr().out
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+import ipaddress
+from verdict import decide, decide_many, whitelist_mask, filter_predictions, THRESHOLD
+
+# -------------------------------------
+# ⚖️ rules.json ต้องตัดสินเหมือน whitelist / post-filter แบบ row-wise ของ baseline (predict.py เดิม)
+# -------------------------------------
+def legacy_is_whitelisted(row):
+    def is_internal_ip(ip):
+        try: return ipaddress.ip_address(ip).is_private
+        except: return False
+    ua = str(row.get("user_agent.original", "")).lower()
+    url = str(row.get("url.original", "")).lower()
+    src_ip = str(row.get("source.ip", ""))
+    status = str(row.get("http.response.status_code", ""))
+    ms_keywords = ["msftconnecttest", "microsoft", "windows update", "cryptoapi", "windowsupdate", "officecdn", "outlook", "onenote", "onedrive", "bingbot", "defender", "edge"]
+    safe_domains = ["microsoft.com", "windows.com", "office.com", "msedge.net", "live.com", "bing.com", "skype.com", "update.microsoft.com", "google.com", "youtube.com", "apple.com", "icloud.com", "cloudflare.com", "akamai.net"]
+    if any(k in ua for k in ms_keywords) or any(d in url for d in safe_domains):
+        if is_internal_ip(src_ip) or status.startswith("20") or "http" in url:
+            return True
+    if any(k in ua for k in ["mozilla", "chrome", "safari", "applewebkit"]):
+        if is_internal_ip(src_ip): return True
+    return False
+
+
+def legacy_post_filter(row, pred):
+    if pred == 1:
+        proto = str(row.get("network.protocol", "")).lower()
+        code = str(row.get("http.response.status_code", ""))
+        ua = str(row.get("user_agent.original", "")).lower()
+        if proto == "https" and code.startswith("20"):
+            if "mozilla" in ua or "chrome" in ua or "safari" in ua: return 0
+    src_cc = str(row.get("source.geoip.country_code2", ""))
+    dst_cc = str(row.get("destination.geoip.country_code2", ""))
+    if pred == 1 and src_cc and dst_cc and src_cc == dst_cc: return 0
+    if pred == 1 and row.get("prob_1", 0) < 0.55: return 0
+    return pred
+
+
+def legacy_decide(record, prob):
+    row = {k: (float("nan") if v is None else v) for k, v in record.items()}
+    row["prob_1"] = prob
+    whitelisted = legacy_is_whitelisted(row)
+    pred = 0 if whitelisted else int(prob >= THRESHOLD)
+    return {"prob_1": float(prob), "prediction": int(legacy_post_filter(row, pred)), "is_whitelist": bool(whitelisted)}
+
+
+# alert ที่ไม่โดน whitelist / https-browser → เหลือแค่ same_country ตัดสิน
+ALERT = {
+    "@timestamp": "2025-03-01T23:15:00.000Z", "source.ip": "203.0.113.9", "destination.ip": "198.51.100.7",
+    "url.original": "/shell.php?cmd=id", "http.response.status_code": "200", "destination.port": "80",
+    "network.protocol": "http", "user_agent.original": "python-requests/2.31", "http.request.method": "GET",
+    "http.request.referrer": "-",
+}
+GEO_PAIRS = [
+    (None, None), (np.nan, np.nan), ("nan", "nan"), ("None", "None"), ("-", "-"), ("", ""),
+    ("TH", "TH"), ("TH", "th"), ("th", "th"), ("TH", "US"), ("TH", None), (None, "TH"), ("-", "TH"),
+]
+
+
+def geo_record(src_cc, dst_cc):
+    return dict(ALERT, **{"source.geoip.country_code2": src_cc, "destination.geoip.country_code2": dst_cc})
+
+
+GEO_RECORDS = [geo_record(s, d) for s, d in GEO_PAIRS] + [dict(ALERT)]   # ตัวสุดท้าย: ไม่มี geoip (Zeek log)
+
+
+@pytest.mark.parametrize("record", GEO_RECORDS, ids=[repr(p) for p in GEO_PAIRS] + ["no-geoip"])
+@pytest.mark.parametrize("prob", [0.9, 0.6, 0.3])
+def test_decide_matches_baseline_on_geoip(record, prob):
+    assert decide(record, prob) == legacy_decide(record, prob)
+
+
+def test_decide_many_matches_baseline_on_geoip():
+    probs = [0.9] * len(GEO_RECORDS)
+    assert decide_many(GEO_RECORDS, probs) == [legacy_decide(r, p) for r, p in zip(GEO_RECORDS, probs)]
+
+
+def test_frame_path_matches_baseline_on_nan_geoip():
+    # predict.py: frame จาก CSV → geoip ว่างเป็น NaN, Zeek log → None ทั้งคอลัมน์
+    df = pd.DataFrame([geo_record(s, d) for s, d in GEO_PAIRS])
+    df["prob_1"] = 0.9
+    pred = np.ones(len(df), dtype=int)
+    whitelisted = whitelist_mask(df)
+    expected = [legacy_post_filter(row, 0 if legacy_is_whitelisted(row) else 1) for row in df.to_dict(orient="records")]
+    assert filter_predictions(df, pred, whitelisted).tolist() == expected
+    # NaN/None/"-" คู่เดียวกัน → ถูกกรองแบบ baseline (str เท่ากันและไม่ว่าง)
+    assert expected[:5] == [0, 0, 0, 0, 0]
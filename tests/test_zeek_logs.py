@@ -0,0 +1,52 @@
+import contextlib, io, json
+import pandas as pd
+from prepare_data import INPUT_FIELDS, transform_data
+from zeek_logs import read_input
+
+# -------------------------------------
+# 🦓 Zeek http.log แบบ TSV และ JSON lines ต้อง map เป็นค่าเดียวกัน
+# -------------------------------------
+ROWS = [
+    {"ts": 1700000000.25, "id.orig_h": "10.0.0.5", "id.resp_h": "93.184.216.34", "id.resp_p": 80, "method": "GET",
+     "uri": "/index.html", "referrer": "-", "user_agent": "curl/8.0", "status_code": 200},
+    # ไม่มี port / status (เช่น request ที่ไม่ได้ response) → JSON ทั้งคอลัมน์กลายเป็น float
+    {"ts": 1700000001.5, "id.orig_h": "10.0.0.6", "id.resp_h": "10.0.0.7", "method": "POST", "uri": "/login",
+     "user_agent": "python-requests/2.31"},
+    {"ts": 1700000002.0, "id.orig_h": "10.0.0.8", "id.resp_h": "8.8.8.8", "id.resp_p": 8080, "method": "GET",
+     "uri": "/", "referrer": "http://a.example/", "user_agent": "Mozilla/5.0", "status_code": 404},
+]
+FIELDS = ["ts", "id.orig_h", "id.resp_h", "id.resp_p", "method", "uri", "referrer", "user_agent", "status_code"]
+
+
+def write_json(path):
+    with open(path, "w", encoding="utf-8") as f:
+        for row in ROWS:
+            f.write(json.dumps(row) + "\n")
+
+
+def write_tsv(path):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("#separator \\x09\n#set_separator\t,\n#empty_field\t(empty)\n#unset_field\t-\n#path\thttp\n")
+        f.write("#fields\t" + "\t".join(FIELDS) + "\n")
+        for row in ROWS:
+            f.write("\t".join(str(row.get(field, "-")) for field in FIELDS) + "\n")
+
+
+def test_json_ports_and_status_stay_integer_text(tmp_path):
+    path = str(tmp_path / "http.json")
+    write_json(path)
+    df = read_input(path, INPUT_FIELDS)
+    assert df["destination.port"].tolist() == ["80", None, "8080"]
+    assert df["http.response.status_code"].tolist() == ["200", None, "404"]
+
+
+def test_json_and_tsv_give_same_features(tmp_path):
+    json_path, tsv_path = str(tmp_path / "http.json"), str(tmp_path / "http.log")
+    write_json(json_path)
+    write_tsv(tsv_path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        from_json = transform_data(read_input(json_path, INPUT_FIELDS), mode="predict")
+        from_tsv = transform_data(read_input(tsv_path, INPUT_FIELDS), mode="predict")
+    assert from_json["is_common_port"].tolist() == [1, 0, 1]
+    assert from_json["status_code"].tolist() == [200, 0, 404]
+    pd.testing.assert_frame_equal(from_json, from_tsv)
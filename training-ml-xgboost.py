@@ -1,33 +1,35 @@
-import os, sys, time
+import os, sys, json, time, shutil, tempfile
+import numpy as np
 import pandas as pd
 import xgboost as xgb
 from sklearn.metrics import accuracy_score, classification_report
 import joblib
 from jinja2 import Environment, FileSystemLoader
+from artifacts import find_artifact, read_artifact, iter_artifact
+from prepare_data import enforce_feature_schema
+from stage_metrics import stage, start_run, finish_run, process_peak_mb
+from hyperparam_search import SEARCH_MODES, load_search_space, search_hyperparameters
+from dmatrix_cache import open_dmatrix_cache, load_dmatrix, describe_load
+from model_compaction import compact_model
 
-# ------------------------------
-# 🧠 Training Pipeline
-# ------------------------------
-def main(output_folder):
-    print("🚀 Starting XGBoost training pipeline...")
-    train_file = os.path.join(output_folder, "training-set.csv")
-    test_file = os.path.join(output_folder, "testing-set.csv")
+TRAIN_MODES = ["memory", "quantile", "external", "cached"]
 
-    # ตรวจสอบว่าไฟล์มีอยู่จริง
-    if not os.path.exists(train_file) or not os.path.exists(test_file):
-        sys.exit("❌ Missing training-set.csv or testing-set.csv")
 
-    # โหลด dataset
-    df_train = pd.read_csv(train_file)
-    df_test = pd.read_csv(test_file)
+# ------------------------------
+# 💾 In-memory: โหลดทั้งไฟล์แล้ว model.fit (แบบเดิม)
+# ------------------------------
+def train_in_memory(train_file, test_file, params_used):
+    # CSV อ่านกลับมาเป็น int64/float64 → บีบเป็น dtype ตาม FEATURE_SCHEMA (uint8/int8/float32)
+    with stage("load") as info:
+        df_train = enforce_feature_schema(read_artifact(train_file))
+        df_test = enforce_feature_schema(read_artifact(test_file))
+        info["rows"] = len(df_train) + len(df_test)
+    print(f"🗜 Train feature memory: {df_train.memory_usage(deep=True).sum() / 1024**2:.1f} MB")
     print(f"📦 Loaded train: {df_train.shape}, test: {df_test.shape}")
 
     if "label" not in df_train.columns:
         sys.exit("❌ Missing 'label' column in dataset")
 
-    # ------------------------------
-    # แยก Features & Labels
-    # ------------------------------
     X_train = df_train.drop(columns=["label"])
     y_train = df_train["label"]
     X_test = df_test.drop(columns=["label"])
@@ -36,6 +38,182 @@ def main(output_folder):
     features_used = list(X_train.columns)
     print(f"🔢 Features used: {len(features_used)}")
 
+    model = xgb.XGBClassifier(
+        **params_used,
+        use_label_encoder=False,
+        n_jobs=-1
+    )
+
+    print("🏋️‍♂️ Training model ...")
+    start_time = time.time()
+    with stage("fit", rows=len(X_train)):
+        model.fit(X_train, y_train)
+    duration = time.time() - start_time
+    print(f"✅ Training complete in {duration:.2f}s")
+    with stage("evaluate", rows=len(X_test)):
+        y_pred = model.predict(X_test)
+    return model, features_used, duration, y_test, y_pred
+
+
+# ------------------------------
+# 🌊 Out-of-core: DataIter อ่าน training set ทีละ shard → QuantileDMatrix / ExtMemQuantileDMatrix
+# ------------------------------
+class ShardIterator(xgb.DataIter):
+    def __init__(self, path, shard_rows, cache_prefix=None):
+        self.path = path
+        self.shard_rows = shard_rows
+        self.shards = None
+        super().__init__(cache_prefix=cache_prefix, release_data=True)
+
+    def next(self, input_data):
+        if self.shards is None:
+            self.shards = iter_artifact(self.path, self.shard_rows)
+        shard = next(self.shards, None)
+        if shard is None:
+            return False
+        shard = enforce_feature_schema(shard)
+        input_data(data=shard.drop(columns=["label"]), label=shard["label"])
+        return True
+
+    def reset(self):
+        self.shards = None
+
+
+def train_out_of_core(train_file, test_file, params_used, train_mode, shard_rows):
+    columns = list(next(iter_artifact(train_file, 1)).columns)
+    if "label" not in columns:
+        sys.exit("❌ Missing 'label' column in dataset")
+    features_used = [c for c in columns if c != "label"]
+    print(f"🔢 Features used: {len(features_used)}")
+    print(f"🌊 Streaming {os.path.basename(train_file)} in shards of {shard_rows:,} rows ({train_mode}) ...")
+
+    xgb_params = {
+        "objective": "binary:logistic",
+        "eta": params_used["learning_rate"],
+        "max_depth": params_used["max_depth"],
+        "seed": params_used["random_state"],
+        "scale_pos_weight": params_used["scale_pos_weight"],
+        "eval_metric": params_used["eval_metric"],
+        "tree_method": "hist",
+    }
+
+    # quantile: ข้อมูล quantize (1 byte/ค่า) อยู่ใน RAM | external: page ของข้อมูลอยู่บน disk
+    cache_dir = tempfile.mkdtemp(prefix="xgb-cache-", dir=os.getenv("TRAIN_CACHE_DIR"))
+    try:
+        start_time = time.time()
+        with stage("build_dmatrix") as info:
+            if train_mode == "external":
+                dtrain = xgb.ExtMemQuantileDMatrix(ShardIterator(train_file, shard_rows, os.path.join(cache_dir, "train")))
+            else:
+                dtrain = xgb.QuantileDMatrix(ShardIterator(train_file, shard_rows))
+            info["rows"] = dtrain.num_row()
+        print(f"📦 Train rows: {dtrain.num_row():,}")
+
+        print("🏋️‍♂️ Training model ...")
+        with stage("fit", rows=dtrain.num_row()):
+            booster = xgb.train(xgb_params, dtrain, num_boost_round=params_used["n_estimators"])
+        duration = time.time() - start_time
+        print(f"✅ Training complete in {duration:.2f}s")
+        del dtrain
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    # ห่อเป็น XGBClassifier → predict.py / ml-serve ใช้ได้เหมือนโมเดลแบบเดิม
+    model = xgb.XGBClassifier(**params_used, n_jobs=-1)
+    model.load_model(bytearray(booster.save_raw("ubj")))
+
+    # test set ก็ประเมินทีละ shard
+    y_test, y_pred = [], []
+    with stage("evaluate") as info:
+        for shard in iter_artifact(test_file, shard_rows):
+            shard = enforce_feature_schema(shard)
+            y_test.append(shard["label"].to_numpy())
+            y_pred.append(model.predict(shard.drop(columns=["label"])))
+        info["rows"] = sum(len(y) for y in y_test)
+    return model, features_used, duration, np.concatenate(y_test), np.concatenate(y_pred)
+
+
+# ------------------------------
+# 💽 Cached: binary DMatrix จาก dmatrix-cache (build ครั้งแรกต่อ dataset) + hist → ไม่ parse CSV ซ้ำ
+# ------------------------------
+def train_cached(train_file, test_file, params_used, cache):
+    with stage("load_dmatrix") as info:
+        dtrain, train_info = load_dmatrix(cache, train_file)
+        dtest, test_info = load_dmatrix(cache, test_file)
+        info["rows"] = dtrain.num_row() + dtest.num_row()
+    print(describe_load("train", train_info))
+    print(describe_load("test", test_info))
+    features_used = list(dtrain.feature_names)
+    print(f"📦 Loaded train: ({dtrain.num_row()}, {dtrain.num_col()}), test: ({dtest.num_row()}, {dtest.num_col()})")
+    print(f"🔢 Features used: {len(features_used)}")
+
+    xgb_params = {
+        "objective": "binary:logistic",
+        "eta": params_used["learning_rate"],
+        "max_depth": params_used["max_depth"],
+        "seed": params_used["random_state"],
+        "scale_pos_weight": params_used["scale_pos_weight"],
+        "eval_metric": params_used["eval_metric"],
+        "tree_method": "hist",
+        "max_bin": int(os.getenv("TRAIN_MAX_BIN", 256)),
+    }
+    print("🏋️‍♂️ Training model ...")
+    start_time = time.time()
+    with stage("fit", rows=dtrain.num_row()):
+        booster = xgb.train(xgb_params, dtrain, num_boost_round=params_used["n_estimators"])
+    duration = time.time() - start_time
+    print(f"✅ Training complete in {duration:.2f}s")
+
+    model = xgb.XGBClassifier(**params_used, n_jobs=-1)
+    model.load_model(bytearray(booster.save_raw("ubj")))
+    with stage("evaluate", rows=dtest.num_row()):
+        y_pred = (booster.predict(dtest) >= 0.5).astype(int)
+    return model, features_used, duration, dtest.get_label().astype(int), y_pred, {"train": train_info, "test": test_info}
+
+
+# ------------------------------
+# 🔎 Search: หา hyperparameter บน validation split (early stopping) → ประเมินผู้ชนะกับ test set
+# ------------------------------
+def train_with_search(train_file, test_file, params_used, search_mode, output_folder):
+    space = load_search_space(os.getenv("SEARCH_SPACE", ""))
+    cache = open_dmatrix_cache(output_folder)
+    start_time = time.time()
+    with stage("search"):
+        model, winner_params, leaderboard = search_hyperparameters(
+            train_file, params_used, search_mode, space,
+            cache_dir=cache.root if cache else None,
+            trials=int(os.getenv("SEARCH_TRIALS", 12)),
+            workers=int(os.getenv("SEARCH_WORKERS", 0)),
+            validation_pct=int(os.getenv("VALIDATION_PCT", 20)),
+            early_stopping_rounds=int(os.getenv("EARLY_STOPPING_ROUNDS", 20)),
+            metric=os.getenv("SEARCH_METRIC", params_used["eval_metric"]),
+        )
+    duration = time.time() - start_time
+    print(f"✅ Search complete in {duration:.2f}s")
+
+    with stage("evaluate") as info:
+        df_test = enforce_feature_schema(read_artifact(test_file))
+        if "label" not in df_test.columns:
+            sys.exit("❌ Missing 'label' column in dataset")
+        x_test = df_test.drop(columns=["label"])
+        y_pred = model.predict(x_test)
+        info["rows"] = len(df_test)
+    return model, list(x_test.columns), duration, df_test["label"], y_pred, winner_params, leaderboard, space
+
+
+# ------------------------------
+# 🧠 Training Pipeline
+# ------------------------------
+def main(output_folder):
+    print("🚀 Starting XGBoost training pipeline...")
+    # CSV หรือ Parquet (ถ้ามีทั้งคู่ใช้ไฟล์ใหม่กว่า)
+    train_file = find_artifact(output_folder, "training-set")
+    test_file = find_artifact(output_folder, "testing-set")
+
+    # ตรวจสอบว่าไฟล์มีอยู่จริง
+    if not train_file or not test_file:
+        sys.exit("❌ Missing training-set or testing-set (.csv / .parquet)")
+
     # ------------------------------
     # รับ Hyperparameters จาก ENV
     # ------------------------------
@@ -54,28 +232,46 @@ def main(output_folder):
         "eval_metric": "logloss"
     }
 
-    # ------------------------------
-    # สร้างโมเดล XGBoost
-    # ------------------------------
-    model = xgb.XGBClassifier(
-        **params_used,
-        use_label_encoder=False,
-        n_jobs=-1
-    )
+    # TRAIN_MODE: memory (เดิม) | quantile | external → อ่าน dataset ทีละ shard ไม่โหลดทั้งไฟล์
+    train_mode = os.getenv("TRAIN_MODE", "memory")
+    if train_mode not in TRAIN_MODES:
+        sys.exit(f"❌ Unknown TRAIN_MODE: {train_mode} (choose from {TRAIN_MODES})")
+    shard_rows = int(os.getenv("TRAIN_SHARD_ROWS", 100000))
 
-    # ------------------------------
-    # ฝึกโมเดล + จับเวลา
-    # ------------------------------
-    print("🏋️‍♂️ Training model ...")
-    start_time = time.time()
-    model.fit(X_train, y_train)
-    duration = time.time() - start_time
-    print(f"✅ Training complete in {duration:.2f}s")
+    # TRAIN_SEARCH: off (เดิม) | grid | random → หลาย trial + early stopping แทนการเทรนครั้งเดียว
+    search_mode = os.getenv("TRAIN_SEARCH", "off")
+    if search_mode not in SEARCH_MODES:
+        sys.exit(f"❌ Unknown TRAIN_SEARCH: {search_mode} (choose from {SEARCH_MODES})")
+
+    start_run("training", output_folder)
+    leaderboard, search_info, dmatrix_info = None, None, None
+    if search_mode != "off":
+        model, features_used, duration, y_test, y_pred, params_used, leaderboard, space = train_with_search(train_file, test_file, params_used, search_mode, output_folder)
+        train_mode = f"search:{search_mode}"
+        search_info = {
+            "mode": search_mode,
+            "metric": os.getenv("SEARCH_METRIC", params_used["eval_metric"]),
+            "validation_pct": int(os.getenv("VALIDATION_PCT", 20)),
+            "early_stopping_rounds": int(os.getenv("EARLY_STOPPING_ROUNDS", 20)),
+            "keys": sorted(space),
+        }
+        leaderboard_path = os.path.join(output_folder, "search-leaderboard.json")
+        with open(leaderboard_path, "w", encoding="utf-8") as f:
+            json.dump({**search_info, "winner": params_used, "trials": leaderboard}, f, indent=2, default=str)
+        print(f"🏁 Leaderboard saved → {leaderboard_path}")
+    elif train_mode == "cached":
+        model, features_used, duration, y_test, y_pred, dmatrix_info = train_cached(train_file, test_file, params_used, open_dmatrix_cache(output_folder))
+    elif train_mode == "memory":
+        model, features_used, duration, y_test, y_pred = train_in_memory(train_file, test_file, params_used)
+    else:
+        model, features_used, duration, y_test, y_pred = train_out_of_core(train_file, test_file, params_used, train_mode, shard_rows)
+
+    peak_rss = process_peak_mb()
+    print(f"📈 Peak RSS: {peak_rss:.1f} MB | mode={train_mode} | train time={duration:.2f}s")
 
     # ------------------------------
     # ประเมินผล
     # ------------------------------
-    y_pred = model.predict(X_test)
     acc = accuracy_score(y_test, y_pred)
     print(f"🎯 Accuracy: {acc * 100:.2f}%")
 
@@ -96,9 +292,14 @@ def main(output_folder):
     context = {
         "accuracy": f"{acc * 100:.2f}%",
         "duration": f"{duration:.2f}s",
+        "train_mode": train_mode,
+        "peak_rss": f"{peak_rss:.1f}",
         "num_features": len(features_used),
         "params": params_used,
         "features": features_used,
+        "leaderboard": leaderboard,
+        "dmatrix_cache": dmatrix_info,
+        "search": search_info,
         "report_html": df_report.to_html(
             classes="table table-striped table-bordered",
             border=0,
@@ -111,13 +312,14 @@ def main(output_folder):
     # ------------------------------
     print("🧾 Generating HTML report ...")
     try:
-        env = Environment(loader=FileSystemLoader("templates"))
-        template = env.get_template("report_template.html")
-        html_output = template.render(context)
-        report_path = os.path.join(output_folder, "classification_report.html")
+        with stage("report"):
+            env = Environment(loader=FileSystemLoader("templates"))
+            template = env.get_template("report_template.html")
+            html_output = template.render(context)
+            report_path = os.path.join(output_folder, "classification_report.html")
 
-        with open(report_path, "w", encoding="utf-8") as f:
-            f.write(html_output)
+            with open(report_path, "w", encoding="utf-8") as f:
+                f.write(html_output)
 
         print(f"📄 HTML report saved → {report_path}")
     except Exception as e:
@@ -127,10 +329,21 @@ def main(output_folder):
     # บันทึกโมเดล
     # ------------------------------
     model_path = os.path.join(output_folder, "xgboost-model.pkl")
-    joblib.dump(model, model_path)
+    # เขียนไฟล์ชั่วคราวแล้ว rename → ml-serve hot reload ไม่โหลดไฟล์ที่เขียนไม่เสร็จ
+    with stage("save_model"):
+        joblib.dump(model, model_path + ".tmp")
+        os.replace(model_path + ".tmp", model_path)
     print(f"💾 Model saved → {model_path}")
 
+    # COMPACT_MODEL=1 → ตัดฟีเจอร์/ต้นไม้จากโมเดลที่เพิ่งบันทึก → <output>/compact (โมเดลเต็มยังอยู่ที่เดิม)
+    compaction = None
+    if os.getenv("COMPACT_MODEL", "0") == "1":
+        with stage("compact"):
+            result = compact_model(output_folder)
+        compaction = {key: result[key] for key in ("accepted", "original", "compact", "output_dir")}
+
     print("✅ Training pipeline completed successfully.")
+    finish_run(train_mode=train_mode, accuracy=round(acc, 6), train_time_s=round(duration, 4), dmatrix_cache=dmatrix_info, compaction=compaction)
     
 
 
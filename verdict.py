@@ -0,0 +1,53 @@
+import os
+import numpy as np
+import pandas as pd
+from rule_engine import RuleSet, is_internal_ip
+
+# -------------------------------------
+# ⚖️ Verdict: threshold + whitelist + post-filter (ใช้ร่วมกันทั้ง predict.py และ ml-serve)
+# -------------------------------------
+# rule อยู่ใน rules.json (หรือไฟล์ที่ RULES_PATH ชี้) → compile ครั้งเดียวตอน import
+RULES_PATH = os.getenv("RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json"))
+RULES = RuleSet.load(RULES_PATH)
+THRESHOLD = RULES.threshold
+
+
+# Whitelist Filtering
+def is_whitelisted(row):
+    return RULES.is_whitelisted(row)
+
+# Post-filter ลด False Positive เพิ่มเติม
+def post_filter(row, pred):
+    return RULES.post_filter(row, pred)
+
+
+# 🧮 แบบทั้ง frame (batch): bool array ต่อแถว / prediction หลัง whitelist + post-filter
+def whitelist_mask(df):
+    return RULES.whitelist_mask(df)
+
+def filter_predictions(df, pred, is_whitelist):
+    pred = np.where(is_whitelist, 0, pred)
+    return RULES.post_filter_frame(df, pred)
+
+
+# ตัดสิน record เดียวแบบเดียวกับ predict.run_prediction: threshold → whitelist → post-filter
+# None จาก JSON ถูกแทนด้วย NaN ให้เหมือนค่าว่างที่ pandas อ่านจาก CSV
+def decide(record, prob):
+    row = {k: (float("nan") if v is None else v) for k, v in record.items()}
+    row["prob_1"] = prob
+    whitelisted = is_whitelisted(row)
+    pred = 0 if whitelisted else int(prob >= THRESHOLD)
+    pred = post_filter(row, pred)
+    return {"prob_1": float(prob), "prediction": int(pred), "is_whitelist": bool(whitelisted)}
+
+
+# หลาย record (batch ใหญ่ของ API): ประเมิน rule ทั้ง frame ให้ผลเท่ากับ decide() ทีละ record
+# key ที่ record ไม่มี → "" (เหมือน row.get(field, "")), None → NaN
+def decide_many(records, probs):
+    df = pd.DataFrame(records, dtype=object)
+    present = pd.DataFrame([dict.fromkeys(record, True) for record in records], index=df.index, columns=df.columns).notna()
+    df = df.where(present, "").where(df.notna() | ~present, np.nan)
+    df["prob_1"] = probs
+    whitelisted = whitelist_mask(df)
+    pred = filter_predictions(df, (np.asarray(probs) >= THRESHOLD).astype(int), whitelisted)
+    return [{"prob_1": float(p), "prediction": int(y), "is_whitelist": bool(w)} for p, y, w in zip(probs, pred, whitelisted)]
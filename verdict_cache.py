@@ -0,0 +1,130 @@
+import os, time, hashlib, threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from prepare_data import INPUT_FIELDS, fill_value, record_hour_weekday
+
+# -------------------------------------
+# 🧠 Verdict cache: record ซ้ำ → ใช้ prob_1 / verdict เดิม ไม่ต้อง transform + predict ใหม่
+# -------------------------------------
+# Zeek HTTP ซ้ำกันสูง (Windows Update / telemetry: UA + URL + ปลายทางเดิมเป็นพันครั้งต่อชั่วโมง)
+# key = hash ของ field ที่ pipeline และ rule อ่าน หลัง normalize:
+#   - None / NaN → ค่าเดียวกัน (pipeline เติม "-" ทั้งคู่, rule เห็น NaN ทั้งคู่)
+#   - @timestamp → (hour, weekday) ถ้าโมเดลใช้, ไม่ใช้ → ตัดทิ้ง (ยกเว้น rule อ่าน @timestamp ตรง ๆ)
+#   - โมเดลใช้ session feature → ค่า window ของ record นั้น (float32 แบบที่โมเดลเห็น) อยู่ใน key ด้วย
+# cache 1 ตัวต่อโมเดล 1 version (สร้างพร้อมโมเดล) → reload โมเดลใหม่ = cache ใหม่, entry ของ version เก่าไม่ถูกใช้อีก
+# transformer ไม่มี (โมเดลรุ่นเก่า, TF-IDF fit ต่อ batch) → feature ขึ้นกับ batch → ไม่ cache
+VERDICT_CACHE_SIZE = int(os.getenv("VERDICT_CACHE_SIZE", 100000))
+VERDICT_CACHE_TTL_S = float(os.getenv("VERDICT_CACHE_TTL_S", 3600))
+# hash_pandas_object ให้แค่ 64 bit → frame_keys ต่อ hash 2 ชุดที่ hash_key ต่างกันเป็น key 128 bit (16 bytes เท่า record_key)
+FRAME_HASH_KEYS = ("0123456789123456", "verdict-cache-k2")
+NULL = "\x00null"
+MISSING = "\x00missing"
+
+
+def normalize(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return NULL
+    # repr แยกชนิด (200 ≠ "200") → ไม่มีทางรวม record ที่ได้ feature/rule ต่างกัน
+    return repr(value)
+
+
+def frame_hour_weekday(values):
+    ts = pd.to_datetime(values.fillna("-"), errors="coerce")
+    return ts.dt.hour.fillna(0).astype(int).astype(str) + "/" + ts.dt.weekday.fillna(0).astype(int).astype(str)
+
+
+class VerdictCache:
+    def __init__(self, version, transformer, extra_fields=(), max_entries=VERDICT_CACHE_SIZE, ttl_s=VERDICT_CACHE_TTL_S):
+        self.version = version
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        uses_time = transformer.required is None or not transformer.required.isdisjoint(("hour", "weekday"))
+        extra = set(extra_fields) - {"prob_1"}
+        self.time_bucket = uses_time and "@timestamp" not in extra
+        self.fields = sorted(set(INPUT_FIELDS) - {"@timestamp"} | extra)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expired = 0
+
+    @classmethod
+    def create(cls, version, transformer, extra_fields=()):
+        """VERDICT_CACHE_SIZE=0 หรือไม่มี transformer → None (ไม่ cache)"""
+        if VERDICT_CACHE_SIZE <= 0 or transformer is None:
+            return None
+        return cls(version, transformer, extra_fields)
+
+    def __len__(self):
+        return len(self.entries)
+
+    # ---------- key ----------
+    def record_key(self, record, session_values=None):
+        parts = [normalize(record.get(f, MISSING)) for f in self.fields]
+        if self.time_bucket:
+            parts.append(repr(record_hour_weekday(fill_value(record.get("@timestamp")))))
+        if session_values is not None:
+            parts.append(repr([float(np.float32(v)) for v in session_values]))
+        return hashlib.blake2b("\x1f".join(parts).encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+    # ทั้ง frame (predict): ค่าในคอลัมน์ของไฟล์เป็นชนิดเดียวกัน → เทียบเป็น text หลังเติม "-" แบบ transform_data
+    def frame_keys(self, df, session_values=None):
+        columns = {f: (df[f].fillna("-").astype(str) if f in df.columns else pd.Series(MISSING, index=df.index)) for f in self.fields}
+        if self.time_bucket:
+            columns["@hour_weekday"] = frame_hour_weekday(df["@timestamp"])
+        if session_values is not None:
+            for col in session_values.columns:
+                columns[col] = session_values[col].to_numpy(dtype=np.float32)
+        frame = pd.DataFrame(columns, index=df.index)
+        hashes = [pd.util.hash_pandas_object(frame, index=False, hash_key=key).to_numpy() for key in FRAME_HASH_KEYS]
+        return np.column_stack(hashes).view("V16").ravel()
+
+    # ---------- LRU + TTL (lock ครั้งเดียวต่อ batch) ----------
+    # → list ของค่า (None = miss)
+    def get_many(self, keys):
+        now = time.monotonic()
+        out = []
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is not None and self.ttl_s and entry[0] < now:
+                    del self.entries[key]
+                    self.expired += 1
+                    entry = None
+                if entry is None:
+                    self.misses += 1
+                    out.append(None)
+                else:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    out.append(entry[1])
+        return out
+
+    def put_many(self, keys, values):
+        expires = time.monotonic() + self.ttl_s
+        with self.lock:
+            for key, value in zip(keys, values):
+                self.entries[key] = (expires, value)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "version": self.version,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl_s,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expired": self.expired,
+            }
+
+    def summary(self):
+        s = self.stats()
+        return (f"🧠 Verdict cache: {s['hits']:,} hit(s), {s['misses']:,} miss(es) (hit rate {s['hit_rate'] * 100:.1f}%) | "
+                f"{s['entries']:,}/{s['max_entries']:,} entries, {s['evictions']:,} evicted, {s['expired']:,} expired")
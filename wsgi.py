@@ -0,0 +1,21 @@
+import gc
+import importlib.util
+import os
+import sys
+
+# -------------------------------------
+# 🚀 WSGI entry point สำหรับ gunicorn (ml-serve.py มี "-" ในชื่อ → import ตรง ๆ ไม่ได้)
+# -------------------------------------
+# gunicorn.conf.py ตั้ง preload_app=True → ไฟล์นี้ถูก import ใน master ครั้งเดียว
+# โมเดล + transformer ถูกโหลดก่อน fork แล้ว worker ทุกตัวใช้หน่วยความจำชุดเดียวกัน (copy-on-write)
+SERVE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ml-serve.py")
+
+spec = importlib.util.spec_from_file_location("ml_serve", SERVE_SCRIPT)
+serve = importlib.util.module_from_spec(spec)
+sys.modules["ml_serve"] = serve
+spec.loader.exec_module(serve)
+
+app = serve.app
+
+# object ที่โหลดแล้วไม่ต้องให้ GC ไล่แตะอีก → page ไม่ถูก copy ใน worker โดยไม่จำเป็น
+gc.freeze()
@@ -0,0 +1,214 @@
+import os, csv, gzip, json, glob
+import pandas as pd
+from artifacts import read_artifact, iter_artifact
+
+# -------------------------------------
+# 🦓 อ่าน Zeek http.log ตรง ๆ (TSV #fields / JSON lines / .gz ที่ rotate แล้ว) → คอลัมน์แบบ Elastic
+# -------------------------------------
+# แปลงชื่อ field ใน pass เดียวตอนอ่าน ไม่ต้อง export เป็น CSV ก่อน
+# field ที่ Zeek ไม่มี (geoip) → None เหมือน CSV ที่ไม่มีคอลัมน์นั้น
+ZEEK_FIELD_MAP = {
+    "ts": "@timestamp",
+    "id.orig_h": "source.ip",
+    "id.resp_h": "destination.ip",
+    "id.resp_p": "destination.port",
+    "uri": "url.original",
+    "status_code": "http.response.status_code",
+    "user_agent": "user_agent.original",
+    "method": "http.request.method",
+    "referrer": "http.request.referrer",
+}
+# field ตัวเลขที่ pipeline เทียบเป็น text (is_common_port: "80"/"443"/"8080") ทั้งชื่อ Zeek และ ECS
+INTEGER_FIELDS = ["id.resp_p", "status_code", "destination.port", "http.response.status_code"]
+ZEEK_PROTOCOL = "http"
+LABEL_FIELD = "ioc.dest_ip_misp_is_alert"
+GZIP_MAGIC = b"\x1f\x8b"
+
+# นามสกุลที่ pipeline รับเป็น input (CSV/Parquet export เดิม + Zeek log)
+INPUT_PATTERNS = ["*.csv", "*.CSV", "*.parquet", "*.log", "*.log.gz", "*.json", "*.ndjson", "*.json.gz"]
+
+
+def list_inputs(folder, patterns=INPUT_PATTERNS):
+    return sorted({p for pattern in patterns for p in glob.glob(os.path.join(folder, pattern))})
+
+
+def open_text(path):
+    with open(path, "rb") as f:
+        gzipped = f.read(2) == GZIP_MAGIC
+    return gzip.open(path, "rt", encoding="utf-8", errors="replace") if gzipped else open(path, "r", encoding="utf-8", errors="replace")
+
+
+# "zeek-tsv" | "zeek-json" | None (ไม่ใช่ Zeek → อ่านแบบ CSV/Parquet เดิม)
+def zeek_format(path):
+    if not path.lower().endswith((".log", ".gz", ".json", ".ndjson")):
+        return None
+    with open_text(path) as f:
+        first = f.readline()
+    if first.startswith("#separator"):
+        return "zeek-tsv"
+    if first.lstrip().startswith("{"):
+        return "zeek-json"
+    return None
+
+
+# -------------------------------------
+# 🔁 Zeek → Elastic field names
+# -------------------------------------
+def zeek_timestamp(ts):
+    numeric = pd.to_numeric(ts, errors="coerce")
+    if numeric.notna().any():
+        parsed = pd.to_datetime(numeric, unit="s", utc=True)
+    else:
+        # JSON log ที่ตั้ง json_timestamps เป็น ISO8601
+        parsed = pd.to_datetime(ts, utc=True, errors="coerce")
+    return parsed.dt.strftime("%Y-%m-%dT%H:%M:%S.%f").str[:-3] + "Z"
+
+
+def map_zeek_frame(df, keep_fields):
+    out = pd.DataFrame(index=df.index)
+    for zeek_field, field in ZEEK_FIELD_MAP.items():
+        if zeek_field in df.columns:
+            out[field] = df[zeek_field]
+    if "@timestamp" in out.columns:
+        out["@timestamp"] = zeek_timestamp(out["@timestamp"])
+    if "network.protocol" not in df.columns:
+        out["network.protocol"] = ZEEK_PROTOCOL
+    # log ที่ export เป็น ECS แล้วส่งมาเป็น JSON lines ก็ใช้ชื่อเดิมได้เลย
+    # label ไม่เติมให้ถ้าไม่มีใน log → transform มองเป็น predict mode (ไม่มี ground truth)
+    for col in keep_fields:
+        if col in df.columns and col not in out.columns:
+            out[col] = df[col]
+        elif col not in out.columns and col != LABEL_FIELD:
+            out[col] = None
+    return out[[col for col in keep_fields if col in out.columns]]
+
+
+# file-like ที่ส่งเฉพาะบรรทัดข้อมูลให้ pandas (ข้าม #close / header ที่ต่อท้ายหลัง rotate)
+class ZeekDataLines:
+    def __init__(self, lines):
+        self.lines = (line for line in lines if not line.startswith("#"))
+        self.buffer = ""
+
+    def read(self, size=-1):
+        parts, length = [self.buffer], len(self.buffer)
+        while size < 0 or length < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            parts.append(line)
+            length += len(line)
+        data = "".join(parts)
+        if size < 0:
+            self.buffer = ""
+            return data
+        self.buffer = data[size:]
+        return data[:size]
+
+
+# TSV: header #fields บอกชื่อคอลัมน์, "-" = unset, "(empty)" = ค่าว่าง
+def read_zeek_tsv(lines, meta, keep_fields, chunk_rows=0):
+    fields = meta["fields"]
+    usecols = [c for c in fields if c in ZEEK_FIELD_MAP or c in keep_fields]
+    reader = pd.read_csv(ZeekDataLines(lines), sep=meta["separator"], names=fields, usecols=usecols, dtype=str,
+                         quoting=csv.QUOTE_NONE, keep_default_na=False, na_values=[meta["unset_field"]],
+                         on_bad_lines="skip", chunksize=chunk_rows or None)
+    for chunk in (reader if chunk_rows else [reader]):
+        yield map_zeek_frame(chunk.replace(meta["empty_field"], ""), keep_fields)
+
+
+def new_zeek_meta():
+    return {"separator": "\t", "unset_field": "-", "empty_field": "(empty)", "fields": None}
+
+
+# บรรทัด header 1 บรรทัด → อัปเดต meta (ใช้ทั้งตอนอ่านทั้งไฟล์และตอน tail)
+def parse_zeek_header_line(line, meta):
+    key, _, value = line.rstrip("\r\n").partition(" " if line.startswith("#separator") else meta["separator"])
+    key = key.lstrip("#")
+    if key == "separator":
+        meta["separator"] = value.encode().decode("unicode_escape")
+    elif key == "fields":
+        meta["fields"] = value.split(meta["separator"])
+    elif key in ("unset_field", "empty_field"):
+        meta[key] = value
+    return meta
+
+
+def read_zeek_header(f):
+    meta = new_zeek_meta()
+    while True:
+        pos = f.tell()
+        line = f.readline()
+        if not line.startswith("#"):
+            # ถอยกลับไปต้นบรรทัดข้อมูลแรก (gzip ถอยแค่ระยะ header → ราคาถูก)
+            f.seek(pos)
+            return meta
+        parse_zeek_header_line(line, meta)
+
+
+# JSON: record ที่ไม่มี field ตัวเลข → pandas upcast ทั้งคอลัมน์เป็น float (80 → 80.0)
+# → แปลงกลับเป็น text แบบ TSV ("80", ไม่มีค่า = None) ก่อน map
+def integer_text(values):
+    # เฉพาะค่าที่เป็นตัวเลขจริงใน JSON — ค่าที่เป็น str (เช่น "80") คงเดิมแบบ TSV
+    numbers = values if pd.api.types.is_float_dtype(values) or pd.api.types.is_integer_dtype(values) else values.where(values.map(type).isin([int, float]))
+    numeric = pd.to_numeric(numbers, errors="coerce")
+    whole = (numeric.notna() & (numeric == numeric.round())).to_numpy()
+    out = values.astype(object).where(values.notna(), None)
+    out[whole] = numeric[whole].astype("int64").astype(str)
+    return out
+
+
+def parse_zeek_json(lines, keep_fields):
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue
+    if not records:
+        return None
+    df = pd.json_normalize(records)
+    for col in INTEGER_FIELDS:
+        if col in df.columns:
+            df[col] = integer_text(df[col])
+    return map_zeek_frame(df, keep_fields)
+
+
+# -------------------------------------
+# 📥 อ่านทีละ chunk (chunk_rows=0 → ทั้งไฟล์ chunk เดียว)
+# -------------------------------------
+def iter_zeek(path, keep_fields, chunk_rows=0):
+    fmt = zeek_format(path)
+    with open_text(path) as f:
+        if fmt == "zeek-tsv":
+            meta = read_zeek_header(f)
+            if not meta["fields"]:
+                raise ValueError(f"❌ {os.path.basename(path)}: Zeek header has no #fields line")
+            yield from read_zeek_tsv(f, meta, keep_fields, chunk_rows)
+        else:
+            batch = []
+            for line in f:
+                batch.append(line)
+                if chunk_rows and len(batch) >= chunk_rows:
+                    df = parse_zeek_json(batch, keep_fields)
+                    batch = []
+                    if df is not None:
+                        yield df
+            df = parse_zeek_json(batch, keep_fields)
+            if df is not None or not chunk_rows:
+                yield df if df is not None else pd.DataFrame(columns=[c for c in keep_fields if c != LABEL_FIELD])
+
+
+# input ไฟล์เดียว: Zeek log → map field, ไม่งั้น CSV/Parquet แบบเดิม
+def read_input(path, keep_fields, **csv_kwargs):
+    if zeek_format(path):
+        return pd.concat(list(iter_zeek(path, keep_fields)), ignore_index=True)
+    return read_artifact(path, **csv_kwargs)
+
+
+def iter_input(path, keep_fields, chunk_rows=0, **csv_kwargs):
+    if zeek_format(path):
+        yield from iter_zeek(path, keep_fields, chunk_rows)
+    elif chunk_rows > 0:
+        yield from iter_artifact(path, chunk_rows, **csv_kwargs)
+    else:
+        yield read_artifact(path, **csv_kwargs)